@@ -55,6 +55,28 @@ class PrepareFilesConfiguration:
     })
 
 
+@dataclass
+class PrepareBamConfiguration:
+    min_mapping_quality: int = field(default=0, metadata={
+        "name": "min_mapping_quality",
+        "metadata": {"description": "Minimum mapping quality for a BAM alignment to be loaded. Default: 0 (all alignments)."},
+        "validate": validate.Range(min=0, max=255),
+    })
+    skip_secondary: bool = field(default=False, metadata={
+        "name": "skip_secondary",
+        "metadata": {"description": "Boolean flag. If set to true, secondary alignments in BAM inputs will be ignored."},
+    })
+    skip_supplementary: bool = field(default=False, metadata={
+        "name": "skip_supplementary",
+        "metadata": {"description": "Boolean flag. If set to true, supplementary alignments in BAM inputs will be ignored."},
+    })
+    shard_size: int = field(default=0, metadata={
+        "name": "shard_size",
+        "metadata": {"description": "Size of the windows used to split indexed BAM inputs for parallel loading. If set to 0 (default), each reference sequence will be loaded as a single region."},
+        "validate": validate.Range(min=0),
+    })
+
+
 @dataclass
 class PrepareConfiguration:
     exclude_redundant: bool = field(default=False, metadata={
@@ -98,6 +120,14 @@ class PrepareConfiguration:
         "name": "canonical",
         "metadata": {"description": "Accepted canonical splicing junctions for the organism in examination."},
     })
+    cache_dir: Optional[str] = field(default=None, metadata={
+        "name": "cache_dir",
+        "metadata": {"description": "Optional directory for the incremental mode. If set, Mikado will cache the parsed and checked version of each input file in this folder, keyed on the checksum of the file and on the relevant options; in subsequent runs, only new or modified inputs will be processed again."},
+    })
+    bam: Optional[PrepareBamConfiguration] = field(default_factory=PrepareBamConfiguration, metadata={
+        "name": "bam",
+        "metadata": {"description": "Options related to the loading of BAM inputs."},
+    })
     files: Optional[PrepareFilesConfiguration] = field(default_factory=PrepareFilesConfiguration, metadata={
         "name": "files",
         "metadata": {"description": "Options related to the input and output files."},
@@ -125,3 +125,28 @@ class SerialiseConfiguration:
     single_thread: bool = field(default=False, metadata={
         "name": "single_thread",
     })
+    pipeline: bool = field(default=False, metadata={
+        "name": "pipeline",
+        "metadata": {"description": "Boolean switch. If set, the transcripts and BLAST targets will be loaded once \
+and then junctions, ORFs, BLAST data and external scores will be serialised concurrently, each in its own process. \
+With SQLite, each of these stages writes into a staging copy of the database, merged at the end."},
+    })
+    bulk_load: bool = field(default=False, metadata={
+        "name": "bulk_load",
+        "metadata": {"description": "Boolean switch. If set, the tables will be created without their secondary \
+indexes, which will be built in a single pass (followed by ANALYZE) once all the data has been loaded. \
+Recommended when loading very large BLAST/DIAMOND outputs."},
+    })
+    compact_match: bool = field(default=False, metadata={
+        "name": "compact_match",
+        "metadata": {"description": "Boolean switch. If set, the match lines of the BLAST HSPs will be stored in \
+run-length encoded form, considerably reducing the size of the database. Mikado decodes them transparently."},
+    })
+    tabular_chunk_size: int = field(default=0, metadata={
+        "name": "tabular_chunk_size",
+        "metadata": {"description": "If greater than 0, tabular BLAST/DIAMOND files will be read in chunks of \
+approximately this many rows, each containing only complete queries, keeping the memory usage bounded \
+irrespective of the size of the files. The files must be grouped by query, as BLAST and DIAMOND produce them. \
+Default: 0 (read each file at once)."},
+        "validate": validate.Range(min=0)
+    })
@@ -20,7 +20,7 @@ from .monosublocusholder import MonosublocusHolder
 from .sublocus import Sublocus
 from ..exceptions import NotInLocusError
 from ..parsers.GFF import GffLine
-from ..serializers.blast_serializer import Hit, Query, Target
+from ..serializers.blast_serializer import Hit, Hsp, Query, Target
 from ..serializers.external import External
 from ..serializers.junction import Junction, Chrom
 from ..serializers.orf import Orf
@@ -626,10 +626,13 @@ class Superlocus(Abstractlocus):
             for orf in orfs:
                 data_dict["orfs"][orf.query].append(orf.as_bed12())
 
-            # Now retrieve the HSPs from the BLAST HSP table
+            # Now retrieve the HSPs from the BLAST HSP table. The match lines are only needed
+            # to recalculate the hits of split transcripts.
             hsp_command = " ".join([
-                "select * from hsp where",
-                "hsp_evalue <= {0} and query_id in {1} order by query_id;"]).format(
+                "select {0} from hsp where",
+                "hsp_evalue <= {1} and query_id in {2} order by query_id;"]).format(
+                "*" if self.configuration.pick.chimera_split.execute is True else ", ".join(
+                    column.name for column in Hsp.__table__.columns if column.name != "match"),
                 self.configuration.pick.chimera_split.blast_params.hsp_evalue,
                 "({0})".format(", ".join([str(_) for _ in query_ids.keys()]))
             )
@@ -683,7 +686,7 @@ class Superlocus(Abstractlocus):
 
         return data_dict
 
-    def load_all_transcript_data(self, engine=None, data_dict=None):
+    def load_all_transcript_data(self, engine=None, data_dict=None, snapshot=None):
 
         """
         This method will load data into the transcripts instances,
@@ -698,6 +701,10 @@ class Superlocus(Abstractlocus):
         If None, a DB connection will be established to retrieve the necessary data.
         :type data_dict: (None | dict)
 
+        :param snapshot: a read-only snapshot of the database, to be used in place of the DB connection
+        if data_dict is not specified.
+        :type snapshot: (None | Mikado.serializers.snapshot.Snapshot)
+
         """
 
         if self.__data_loaded is True:
@@ -708,6 +715,10 @@ class Superlocus(Abstractlocus):
             self.approximation_level = 1
             self.reduce_method_one(None)
 
+        if data_dict is None and snapshot is not None:
+            data_dict = snapshot.create_data_dict(self.configuration, self.chrom, self.introns,
+                                                  list(self.transcripts.keys()))
+
         if data_dict is None and engine is None:
             raise ValueError("Both engine and data_dict are void.")
         elif data_dict is None:
@@ -11,6 +11,7 @@ from ..configuration import MikadoConfiguration, DaijinConfiguration
 from ..utilities import dbutils
 from ..scales.assignment.assigner import Assigner
 from ..loci.superlocus import Superlocus
+from ..serializers.snapshot import open_snapshot
 from ._merge_loci_utils import __create_gene_counters, manage_index
 import collections
 import sys
@@ -197,7 +198,8 @@ def analyse_locus(slocus: Superlocus,
                   configuration: Union[MikadoConfiguration,DaijinConfiguration],
                   logging_queue: AutoProxy,
                   engine=None,
-                  data_dict=None) -> [Superlocus]:
+                  data_dict=None,
+                  snapshot=None) -> [Superlocus]:
 
     """
     :param slocus: a superlocus instance
@@ -218,6 +220,9 @@ def analyse_locus(slocus: Superlocus,
     :param data_dict: a dictionary of preloaded data
     :type data_dict: (None|dict)
 
+    :param snapshot: an optional read-only snapshot of the database, used in place of the engine.
+    :type snapshot: (None|Mikado.serializers.snapshot.Snapshot)
+
     This function takes as input a "superlocus" instance and the pipeline configuration.
     It also accepts as optional keywords a dictionary with the CDS information
     (derived from a Bed12Parser) and a "lock" used for avoiding writing collisions
@@ -251,7 +256,8 @@ def analyse_locus(slocus: Superlocus,
 
     try:
         slocus.load_all_transcript_data(engine=engine,
-                                        data_dict=data_dict)
+                                        data_dict=data_dict,
+                                        snapshot=snapshot)
     except KeyboardInterrupt:
         raise
     except Exception as exc:
@@ -330,6 +336,7 @@ class LociProcesser(Process):
         self.name = "LociProcesser-{0}".format(self.identifier)
         self.configuration = configuration
         self.engine = None
+        self.snapshot = None
         self.handler = logging_handlers.QueueHandler(self.logging_queue)
         self.logger = logging.getLogger(self.name)
         self.logger.addHandler(self.handler)
@@ -343,6 +350,7 @@ class LociProcesser(Process):
         self.logger.debug("Starting the pool for {0}".format(self.name))
         try:
             self.engine = dbutils.connect(self.configuration, self.logger)
+            self.snapshot = open_snapshot(self.configuration, self.logger)
         except KeyboardInterrupt:
             raise
         except EOFError:
@@ -354,6 +362,7 @@ class LociProcesser(Process):
         self.analyse_locus = functools.partial(analyse_locus,
                                                configuration=self.configuration,
                                                engine=self.engine,
+                                               snapshot=self.snapshot,
                                                logging_queue=self.logging_queue)
 
     @property
@@ -364,6 +373,7 @@ class LociProcesser(Process):
 
         state = self.__dict__.copy()
         state["engine"] = None
+        state["snapshot"] = None
         state["analyse_locus"] = None
         state["logger"].removeHandler(self.handler)
         del state["handler"]
@@ -383,6 +393,9 @@ class LociProcesser(Process):
         """Private method to flush and close all handles."""
         if self.engine is not None:
             self.engine.dispose()
+        if getattr(self, "snapshot", None) is not None:
+            self.snapshot.close()
+            self.snapshot = None
         if hasattr(self, "dump_conn"):
             self.dump_conn.commit()
             self.dump_conn.close()
@@ -400,9 +413,11 @@ class LociProcesser(Process):
         self.logger.setLevel(self.configuration.log_settings.log_level)
         self.logger.propagate = False
         self.engine = dbutils.connect(self.configuration, self.logger)
+        self.snapshot = open_snapshot(self.configuration, self.logger)
         self.analyse_locus = functools.partial(analyse_locus,
                                                configuration=self.configuration,
                                                engine=self.engine,
+                                               snapshot=self.snapshot,
                                                logging_queue=self.logging_queue)
         # self.dump_db, self.dump_conn, self.dump_cursor = self._create_temporary_store(self._tempdir, self.identifier)
         self.handler = logging_handlers.QueueHandler(self.logging_queue)
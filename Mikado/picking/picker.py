@@ -29,6 +29,7 @@ from ..parsers.bed12 import Bed12Parser
 from ..parsers import Parser
 from ..serializers.junction import Chrom
 from ..serializers.external import ExternalSource
+from ..serializers.snapshot import open_snapshot
 from ..transcripts import Transcript
 from ..loci.superlocus import Superlocus
 from ..configuration.configurator import load_and_validate_config
@@ -521,12 +522,13 @@ class Picker:
     # actually file handlers. I cannot trim them down for now.
     # pylint: disable=too-many-locals
 
-    def _submit_locus(self, slocus, counter, data_dict=None, engine=None):
+    def _submit_locus(self, slocus, counter, data_dict=None, engine=None, snapshot=None):
         """
         Private method to submit / start the analysis of a superlocus in input.
         :param slocus: the locus to analyse.
         :param data_dict: the preloaded data in memory
         :param engine: connection engine
+        :param snapshot: read-only snapshot of the database, if available
         :return: job object / None
         """
 
@@ -542,7 +544,8 @@ class Picker:
                              configuration=self.configuration,
                              logging_queue=self.logging_queue,
                              data_dict=data_dict,
-                             engine=engine)
+                             engine=engine,
+                             snapshot=snapshot)
 
     def __unsorted_interrupt(self, row, current_transcript):
         """
@@ -938,9 +941,11 @@ class Picker:
         gene_counter = 0
 
         self.engine = dbutils.connect(configuration=self.configuration, logger=self.logger)
+        snapshot = open_snapshot(self.configuration, self.logger)
 
         submit_locus = functools.partial(self._submit_locus, **{"data_dict": None,
-                                                                "engine": self.engine})
+                                                                "engine": self.engine,
+                                                                "snapshot": snapshot})
 
         counter = -1
         invalid = False
@@ -996,6 +1001,8 @@ class Picker:
         # submit_locus(current_locus, counter)
         for group in handles:
             [_.close() for _ in group if _]
+        if snapshot is not None:
+            snapshot.close()
         logger.info("Final number of superloci: %d", counter)
 
     def __check_transcript(self, current_transcript, current_locus, counter, max_intron,
@@ -1,3 +1,4 @@
+import functools
 import multiprocessing
 from ..parsers import to_gff
 from ..parsers.bam_parser import BamParser
@@ -13,6 +14,7 @@ except (ImportError,ModuleNotFoundError):
     import json
 import msgpack
 import os
+import pysam
 from ..transcripts import Transcript
 from operator import itemgetter
 import random
@@ -584,32 +586,11 @@ def load_from_bed12(shelf_name,
                     "Multiple instance of %s found, skipping any subsequent entry", row.id)
                 to_ignore.add(row.id)
                 continue
-            else:
-                exon_lines[transcript.id] = dict()
-            if label:
-                exon_lines[transcript.id]["source"] = label
-            else:
-                exon_lines[transcript.id]["source"] = gff_handle.name  # BED12 files have no source
-            exon_lines[transcript.id]["features"] = dict()
-            exon_lines[transcript.id]["chrom"] = transcript.chrom
-            exon_lines[transcript.id]["strand"] = transcript.strand
-            # Should deal with GFFRead style input and BAM
-            exon_lines[transcript.id]["attributes"] = transcript.attributes
-            exon_lines[transcript.id]["tid"] = transcript.id
-            exon_lines[transcript.id]["parent"] = "{}.gene".format(transcript.id)
-            exon_lines[transcript.id]["strand_specific"] = strand_specific
-            exon_lines[transcript.id]["is_reference"] = is_reference
-            exon_lines[transcript.id]["exclude_redundant"] = exclude_redundant
-            exon_lines[transcript.id]["features"]["exon"] = [
-                (exon[0], exon[1]) for exon in transcript.exons
-            ]
-            if transcript.is_coding and not strip_cds:
-                exon_lines[transcript.id]["features"]['CDS'] = [
-                    (exon[0], exon[1]) for exon in transcript.combined_cds
-                ]
-                exon_lines[transcript.id]["features"]["UTR"] = [
-                    (exon[0], exon[1]) for exon in transcript.five_utr + transcript.three_utr
-                ]
+            exon_lines[transcript.id] = _create_exon_line(
+                transcript,
+                source=label or gff_handle.name,  # BED12 files have no source
+                strand_specific=strand_specific, is_reference=is_reference,
+                exclude_redundant=exclude_redundant, strip_cds=strip_cds)
         new_ids.add(transcript.id)
     gff_handle.close()
     rows = load_into_storage(shelf_name, exon_lines,
@@ -619,6 +600,98 @@ def load_from_bed12(shelf_name,
     return new_ids, rows
 
 
+def _create_exon_line(transcript: Transcript, source, strand_specific, is_reference, exclude_redundant,
+                      strip_cds) -> dict:
+    """Function to convert a finalised transcript (from BED12 or BAM rows) into the dictionary
+    format used by the temporary storage."""
+
+    exon_line = dict()
+    exon_line["source"] = source
+    exon_line["features"] = dict()
+    exon_line["chrom"] = transcript.chrom
+    exon_line["strand"] = transcript.strand
+    # Should deal with GFFRead style input and BAM
+    exon_line["attributes"] = transcript.attributes
+    exon_line["tid"] = transcript.id
+    exon_line["parent"] = "{}.gene".format(transcript.id)
+    exon_line["strand_specific"] = strand_specific
+    exon_line["is_reference"] = is_reference
+    exon_line["exclude_redundant"] = exclude_redundant
+    exon_line["features"]["exon"] = [(exon[0], exon[1]) for exon in transcript.exons]
+    if transcript.is_coding and not strip_cds:
+        exon_line["features"]['CDS'] = [(exon[0], exon[1]) for exon in transcript.combined_cds]
+        exon_line["features"]["UTR"] = [
+            (exon[0], exon[1]) for exon in transcript.five_utr + transcript.three_utr
+        ]
+    return exon_line
+
+
+def _keep_alignment(row: pysam.AlignedSegment, min_mapq=0, skip_secondary=False, skip_supplementary=False):
+    """Function to decide whether a BAM record should be converted into a transcript. The checks only
+    rely on the flag and MAPQ fields, so that no Python object has to be built for discarded records."""
+
+    if row.is_unmapped is True:
+        return False
+    elif skip_secondary is True and row.is_secondary is True:
+        return False
+    elif skip_supplementary is True and row.is_supplementary is True:
+        return False
+    elif row.mapping_quality < min_mapq:
+        return False
+    return True
+
+
+def _bam_regions(bam_name: str, shard_size=0):
+    """Function to split an indexed BAM file into regions. Each reference sequence is a region
+    by itself unless shard_size is positive, in which case references are split into fixed windows.
+    :param bam_name: the name of the BAM file.
+    :param shard_size: size of the windows. If 0 or negative, one region per reference sequence.
+    :return: list of (reference, start, end) tuples, in the order of the BAM header.
+    """
+
+    regions = []
+    with pysam.AlignmentFile(bam_name, "rb", check_sq=False) as bam:
+        for reference, length in zip(bam.references, bam.lengths):
+            if shard_size <= 0:
+                regions.append((reference, 0, length))
+                continue
+            for start in range(0, length, shard_size):
+                regions.append((reference, start, min(start + shard_size, length)))
+    return regions
+
+
+def _load_bam_region(bam_name: str, region, label, min_mapq=0, skip_secondary=False, skip_supplementary=False,
+                     strand_specific=False, is_reference=False, exclude_redundant=False, strip_cds=False):
+    """Function to convert the alignments *starting* within a BAM region into exon lines.
+    If the region is None, the whole file is read sequentially.
+    :return: a list of (tid, exon line) tuples, in file order, and the number of records discarded by the filters.
+    """
+
+    lines, discarded = [], 0
+    with pysam.AlignmentFile(bam_name, "rb", check_sq=False) as bam:
+        if region is None:
+            rows = bam.fetch(until_eof=True)
+            start, end = None, None
+        else:
+            reference, start, end = region
+            rows = bam.fetch(reference, start, end)
+        for row in rows:
+            # Alignments spanning the border of a window must be loaded only once
+            if start is not None and not (start <= row.reference_start < end):
+                continue
+            if not _keep_alignment(row, min_mapq=min_mapq, skip_secondary=skip_secondary,
+                                   skip_supplementary=skip_supplementary):
+                discarded += 1
+                continue
+            transcript = Transcript(row)
+            if label != '':
+                transcript.id = "{0}_{1}".format(label, transcript.id)
+            lines.append((transcript.id, _create_exon_line(
+                transcript, source=label or bam_name, strand_specific=strand_specific,
+                is_reference=is_reference, exclude_redundant=exclude_redundant, strip_cds=strip_cds)))
+    return lines, discarded
+
+
 def load_from_bam(shelf_name: str,
                   gff_handle: BamParser,
                   label: str,
@@ -629,9 +702,16 @@ def load_from_bam(shelf_name: str,
                   is_reference=False,
                   exclude_redundant=False,
                   strip_cds=False,
-                  strand_specific=False):
+                  strand_specific=False,
+                  threads=1,
+                  min_mapq=0,
+                  skip_secondary=False,
+                  skip_supplementary=False,
+                  shard_size=0):
     """
-    Method to load the exon lines from BAM files.
+    Method to load the exon lines from BAM files. If the BAM file is indexed and more than one thread
+    is requested, the file will be split by reference sequence (or by windows of shard_size bps) and
+    each region will be converted in a separate process.
     :param shelf_name: the name of the shelf DB to use.
     :param gff_handle: The handle for the BAM to be parsed. This handle is BamParser with a file attached to read from.
     :param label: label to be attached to all transcripts.
@@ -652,17 +732,96 @@ def load_from_bam(shelf_name: str,
     :type is_reference: bool
     :param exclude_redundant: boolean. If set to True, the transcript will be marked for potential redundancy removal.
     :type exclude_redundant: bool
+    :param threads: number of processes to use for converting the regions of an indexed BAM.
+    :type threads: int
+    :param min_mapq: minimum mapping quality for an alignment to be loaded.
+    :type min_mapq: int
+    :param skip_secondary: boolean flag. If set, secondary alignments will be ignored.
+    :type skip_secondary: bool
+    :param skip_supplementary: boolean flag. If set, supplementary alignments will be ignored.
+    :type skip_supplementary: bool
+    :param shard_size: size of the windows used to split each reference. If 0, one region per reference.
+    :type shard_size: int
     :return:
     """
-    return load_from_bed12(shelf_name, gff_handle, label, found_ids, logger,
-                           min_length=min_length, max_intron=max_intron,
-                           is_reference=is_reference,exclude_redundant=exclude_redundant,
-                           strip_cds=strip_cds, strand_specific=strand_specific)
+
+    strip_cds = strip_cds and (not is_reference)
+    strand_specific = strand_specific or is_reference
+    bam_name = gff_handle.name
+    gff_handle.close()
+
+    loader = functools.partial(_load_bam_region, bam_name, label=label,
+                               min_mapq=min_mapq, skip_secondary=skip_secondary,
+                               skip_supplementary=skip_supplementary,
+                               strand_specific=strand_specific, is_reference=is_reference,
+                               exclude_redundant=exclude_redundant, strip_cds=strip_cds)
+
+    with pysam.AlignmentFile(bam_name, "rb", check_sq=False) as bam:
+        indexed = bam.has_index()
+
+    if threads > 1 and indexed is True:
+        regions = _bam_regions(bam_name, shard_size=shard_size)
+        logger.info("Loading %s in %d regions using %d processes", bam_name, len(regions), threads)
+        with multiprocessing.Pool(threads) as pool:
+            # imap preserves the order of the regions, so that the result is identical to a sequential run
+            results = list(pool.imap(loader, regions))
+    else:
+        if threads > 1:
+            logger.info("%s is not indexed, loading it sequentially", bam_name)
+        results = [loader(None)]
+
+    exon_lines = dict()
+    new_ids = set()
+    discarded = 0
+    for lines, region_discarded in results:
+        discarded += region_discarded
+        for tid, exon_line in lines:
+            if tid in found_ids:
+                __raise_redundant(tid, bam_name, label)
+            if tid in exon_lines:
+                logger.warning("Multiple instance of %s found, skipping any subsequent entry", tid)
+                continue
+            exon_lines[tid] = exon_line
+            new_ids.add(tid)
+
+    if discarded > 0:
+        logger.info("Discarded %d alignments from %s (unmapped, or failing the MAPQ/secondary filters)",
+                    discarded, bam_name)
+    rows = load_into_storage(shelf_name, exon_lines,
+                             logger=logger, min_length=min_length, strip_cds=strip_cds, max_intron=max_intron)
+
+    logger.info("Finished parsing %s", bam_name)
+    return new_ids, rows
 
 
 loaders = {"gtf": load_from_gtf, "gff": load_from_gff, "gff3": load_from_gff,
            "bed12": load_from_bed12, "bed": load_from_bed12, "bam": load_from_bam}
 
+def index_name(shelf_name: str) -> str:
+    """Name of the binary file holding the index rows of a shelf."""
+    return "{}.index".format(shelf_name)
+
+
+def dump_rows(rows: list, shelf_name: str):
+    """Function to write the index rows of a shelf to disk in a single block, column by column.
+    :param rows: list of (chrom, start, end, strand, tid, write_start, write_length) tuples.
+    :param shelf_name: the name of the shelf the rows refer to.
+    """
+
+    columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in range(7)]
+    with open(index_name(shelf_name), "wb") as index:
+        msgpack.dump(columns, index)
+
+
+def load_rows(shelf_name: str) -> list:
+    """Function to read back the index rows written by dump_rows.
+    :return: a list of columns (chrom, start, end, strand, tid, write_start, write_length).
+    """
+
+    with open(index_name(shelf_name), "rb") as index:
+        return msgpack.load(index, raw=False)
+
+
 # Chrom, start, end, strand, Tid, write start, write length
 # 100 chars, unsigned Long, unsigned Long, one char, 100 chars, unsigned Long, unsigned Long
 _row_struct_str = ">1000sLLc1000sLLH"
@@ -674,14 +833,14 @@ class AnnotationParser(multiprocessing.Process):
 
     def __init__(self,
                  submission_queue: multiprocessing.JoinableQueue,
-                 return_queue: multiprocessing.JoinableQueue,
                  logging_queue: multiprocessing.JoinableQueue,
                  identifier: int,
                  min_length=0,
                  max_intron=3*10**5,
                  log_level="WARNING",
                  seed=None,
-                 strip_cds=False):
+                 strip_cds=False,
+                 bam_options=None):
 
         super().__init__()
         if seed is not None:
@@ -692,10 +851,10 @@ class AnnotationParser(multiprocessing.Process):
             random.seed(None)
 
         self.submission_queue = submission_queue
-        self.return_queue = return_queue
         self.min_length = min_length
         self.max_intron = max_intron
         self.__strip_cds = strip_cds
+        self.bam_options = bam_options if bam_options is not None else dict()
         self.logging_queue = logging_queue
         self.log_level = log_level
         self.__identifier = identifier
@@ -746,6 +905,8 @@ class AnnotationParser(multiprocessing.Process):
                 loader = loaders.get(gff_handle.__annot_type__, None)
                 if loader is None:
                     raise ValueError("Invalid file type: {}".format(gff_handle.name))
+                elif gff_handle.__annot_type__ == "bam":
+                    loader = functools.partial(loader, **self.bam_options)
                 if file_strip_cds is True:
                     file_strip_cds = True
                 else:
@@ -762,9 +923,9 @@ class AnnotationParser(multiprocessing.Process):
                         "No valid transcripts found in {0}{1}!".format(
                             handle, " (label: {0})".format(label) if label != "" else ""
                         ))
-                # Now convert the rows into structs.
+                # Write the whole table of rows next to the shelf, for the main process to read in bulk
                 self.logger.debug("Packing %d rows of %s", len(new_rows), label)
-                [self.return_queue.put_nowait((*row, shelf_index)) for row in new_rows]
+                dump_rows(new_rows, shelf_name)
                 self.logger.debug("Packed %d rows of %s", len(new_rows), label)
 
             except exceptions.InvalidAssembly as exc:
@@ -774,8 +935,6 @@ class AnnotationParser(multiprocessing.Process):
                 self.logger.exception(exc)
                 raise
 
-        self.return_queue.put_nowait("FINISHED")
-
     @property
     def identifier(self):
         """
@@ -0,0 +1,152 @@
+"""
+This module contains the per-input cache used by mikado prepare in incremental mode.
+For each input file, the cache stores:
+- the shelf produced by the loaders, together with its index rows;
+- the results of the checks against the genome, transcript by transcript, in a SQLite database
+  so that they can be retrieved one at a time without loading them all in memory.
+Entries are keyed by the checksum of the input file plus the configuration values which
+influence its parsing (or its checking), so that only the inputs which changed are reprocessed.
+"""
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import msgpack
+import pandas as pd
+from ..version import __version__
+
+
+__author__ = 'Luca Venturini'
+
+
+def file_checksum(filename: str, block_size=2 ** 20) -> str:
+    """Function to calculate the MD5 checksum of a file, reading it in blocks."""
+
+    checksum = hashlib.md5()
+    with open(filename, "rb") as handle:
+        for block in iter(lambda: handle.read(block_size), b""):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def _digest(*values) -> str:
+    return hashlib.md5(msgpack.dumps([str(value) for value in values])).hexdigest()
+
+
+class PrepareCache:
+
+    """Class to store and retrieve the intermediate results of mikado prepare for each input file."""
+
+    row_columns = ["chrom", "start", "end", "strand", "tid", "write_start", "write_length"]
+
+    def __init__(self, cache_dir: str, mikado_config, logger):
+
+        self.cache_dir = os.path.abspath(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.logger = logger
+        self.__config = mikado_config
+        self.__input_keys = dict()
+        self.__checked = dict()
+        self.__updated = set()
+        genome = mikado_config.reference.genome
+        genome = getattr(genome, "filename", genome)
+        if isinstance(genome, bytes):
+            genome = genome.decode()
+        genome_stat = os.stat(genome)
+        # Checksumming the whole genome at each run would be too expensive; we rely on size and timestamp
+        self.check_key = _digest(__version__, os.path.realpath(genome), genome_stat.st_size,
+                                 genome_stat.st_mtime_ns, mikado_config.prepare.lenient,
+                                 mikado_config.prepare.canonical, mikado_config.prepare.strip_faulty_cds)
+
+    def input_key(self, shelf_name, gff_name, label, strand_specific, is_reference, exclude_redundant,
+                  strip_cds) -> str:
+        """Method to calculate (and register, for the given shelf) the cache key of an input file."""
+
+        prepare_config = self.__config.prepare
+        bam_options = None
+        if gff_name.endswith(".bam"):
+            bam_options = (prepare_config.bam.min_mapping_quality, prepare_config.bam.skip_secondary,
+                           prepare_config.bam.skip_supplementary)
+        key = _digest(__version__, file_checksum(gff_name), label, strand_specific or is_reference,
+                      is_reference, exclude_redundant, strip_cds and not is_reference,
+                      prepare_config.minimum_cdna_length, prepare_config.max_intron_length, bam_options)
+        self.__input_keys[shelf_name] = key
+        return key
+
+    def __path(self, key, suffix):
+        return os.path.join(self.cache_dir, "{}.{}".format(key, suffix))
+
+    def restore_shelf(self, shelf_name: str):
+        """Method to restore a cached shelf into the given position.
+        :return: the index rows of the shelf as a DataFrame, or None if the input is not cached.
+        """
+
+        key = self.__input_keys[shelf_name]
+        if not (os.path.exists(self.__path(key, "shelf")) and os.path.exists(self.__path(key, "rows"))):
+            return None
+        if os.path.exists(shelf_name):
+            os.remove(shelf_name)
+        try:
+            os.link(self.__path(key, "shelf"), shelf_name)
+        except OSError:
+            shutil.copyfile(self.__path(key, "shelf"), shelf_name)
+        with open(self.__path(key, "rows"), "rb") as rows:
+            rows = pd.DataFrame(msgpack.load(rows, raw=False), columns=self.row_columns)
+        rows["shelf"] = shelf_name
+        return rows
+
+    def store_shelf(self, shelf_name: str, rows: pd.DataFrame):
+        """Method to store a freshly created shelf, together with its (decoded) index rows."""
+
+        key = self.__input_keys[shelf_name]
+        shutil.copyfile(shelf_name, self.__path(key, "shelf.tmp"))
+        os.replace(self.__path(key, "shelf.tmp"), self.__path(key, "shelf"))
+        with open(self.__path(key, "rows.tmp"), "wb") as out:
+            msgpack.dump(dict((column, rows[column].tolist()) for column in self.row_columns), out)
+        os.replace(self.__path(key, "rows.tmp"), self.__path(key, "rows"))
+
+    def __checked_db(self, shelf_name) -> sqlite3.Connection:
+        if shelf_name not in self.__checked:
+            path = self.__path(self.__input_keys[shelf_name], "{}.checked.db".format(self.check_key))
+            connection = sqlite3.connect(path)
+            connection.execute("CREATE TABLE IF NOT EXISTS checked (tid TEXT PRIMARY KEY, gtf TEXT, fasta TEXT)")
+            self.__checked[shelf_name] = connection
+        return self.__checked[shelf_name]
+
+    def get_checked(self, shelf_name, tid):
+        """Method to retrieve the result of the check of a transcript.
+        :return: None if the transcript is not cached; False if the transcript failed the check;
+        the (GTF, FASTA) tuple of the checked transcript otherwise.
+        """
+
+        result = self.__checked_db(shelf_name).execute(
+            "SELECT gtf, fasta FROM checked WHERE tid = ?", (tid,)).fetchone()
+        if result is None:
+            return None
+        elif result[0] is None:
+            return False
+        return tuple(result)
+
+    def set_checked(self, shelf_name, tid, result):
+        """Method to record the result of the check of a transcript (False if it failed the check)."""
+
+        gtf, fasta = (None, None) if result is False else result
+        self.__checked_db(shelf_name).execute(
+            "INSERT OR REPLACE INTO checked (tid, gtf, fasta) VALUES (?, ?, ?)", (tid, gtf, fasta))
+        self.__updated.add(shelf_name)
+
+    def flush(self):
+        """Method to commit to disk the check results which were updated during the run."""
+
+        for shelf_name in self.__updated:
+            self.__checked[shelf_name].commit()
+        self.__updated = set()
+
+    def close(self):
+        """Method to commit the pending check results and close the databases."""
+
+        self.flush()
+        for connection in self.__checked.values():
+            connection.close()
+        self.__checked = dict()
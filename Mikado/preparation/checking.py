@@ -31,7 +31,8 @@ def create_transcript(lines,
                                          ("GC", "AG"),
                                          ("AT", "AC")),
                       strip_faulty_cds=False,
-                      logger=None):
+                      logger=None,
+                      splice_sites=None):
     """Function to create the checker.
 
     :param lines: all the exon lines for an object
@@ -58,6 +59,7 @@ def create_transcript(lines,
 
     :param is_reference: boolean. If set, the transcript's strand will not be checked.
 
+    :param splice_sites: optional dictionary of pre-classified introns, see TranscriptChecker.classify_splice_sites.
 
     :rtype: (None|TranscriptChecker)
     """
@@ -109,7 +111,8 @@ def create_transcript(lines,
                                               canonical_splices=canonical_splices,
                                               strip_faulty_cds=strip_faulty_cds,
                                               is_reference=is_reference,
-                                              logger=logger)
+                                              logger=logger,
+                                              splice_sites=splice_sites)
         logger.debug("Finished adding exon lines to %s", lines["tid"])
         transcript_object.finalize()
         transcript_object.check_strand()
@@ -136,6 +139,102 @@ def create_transcript(lines,
     return transcript_object
 
 
+def _exon_introns(lines):
+    """Private function to derive the candidate introns of a transcript directly from its exon lines."""
+
+    exons = sorted((feat[0], feat[1]) for feat in lines["features"].get("exon", []))
+    return [(exon[1] + 1, following[0] - 1) for exon, following in zip(exons, exons[1:])
+            if following[0] > exon[1] + 1]
+
+
+def check_transcripts(entries, fasta, checker, canonical_splices, lenient=False,
+                      max_batch=1000, max_span=10 ** 7, logger=None):
+    """Function to check a series of transcripts, in batches of neighbouring transcripts.
+    For each batch, the genomic sequence is retrieved only once and the splice sites of all the introns
+    are classified together (see TranscriptChecker.classify_splice_sites); the strand decision is then
+    taken independently for each transcript.
+
+    :param entries: iterable of (index, lines, start, end) tuples, ideally sorted by genomic position.
+    :param fasta: genome object with a pysam-like "fetch" method.
+    :param checker: the create_transcript function, pre-configured apart from the transcript-specific arguments.
+    :param canonical_splices: the splices considered as canonical for the species.
+    :param lenient: boolean flag, passed to the checker.
+    :param max_batch: maximum number of transcripts in each batch.
+    :type max_batch: int
+    :param max_span: maximum genomic span of each batch. Longer transcripts will be checked on their own.
+    :type max_span: int
+    :param logger: optional logger.
+
+    :return: a generator of (index, transcript) tuples, with transcript set to None for discarded models.
+    """
+
+    if logger is None:
+        logger = create_null_logger()
+
+    def _check_batch(batch):
+        chrom = batch[0][1]["chrom"]
+        region_start, region_end = min(_[2] for _ in batch), max(_[3] for _ in batch)
+        region = str(fasta.fetch(chrom, region_start - 1, region_end))
+        introns = set()
+        for _, lines, _, _ in batch:
+            introns.update(_exon_introns(lines))
+        splice_sites = TranscriptChecker.classify_splice_sites(region, region_start, introns, canonical_splices)
+        for index, lines, start, end in batch:
+            logger.debug("Checking %s", lines["tid"])
+            transcript = checker(lines,
+                                 region[start - region_start:end - region_start + 1],
+                                 start,
+                                 end,
+                                 lenient=lenient,
+                                 is_reference=lines["is_reference"],
+                                 strand_specific=lines["strand_specific"],
+                                 splice_sites=splice_sites)
+            yield index, transcript
+
+    current, current_start, current_end = [], None, None
+    for entry in entries:
+        if current and (entry[1]["chrom"] != current[0][1]["chrom"] or len(current) >= max_batch or
+                        max(entry[3], current_end) - min(entry[2], current_start) > max_span):
+            yield from _check_batch(current)
+            current = []
+        if not current:
+            current_start, current_end = entry[2], entry[3]
+        current_start, current_end = min(entry[2], current_start), max(entry[3], current_end)
+        current.append(entry)
+    if current:
+        yield from _check_batch(current)
+
+
+def write_record(handle, counter, record: bytes):
+    """Function to write a checked transcript into a partial output file of the checking processes.
+    Each record is preceded by a header line with its number and the length of its text,
+    so that it can be read back without parsing it line by line (see read_records).
+
+    :param handle: binary file handle.
+    :param counter: the number of the transcript in the final output.
+    :type counter: int
+    :param record: the text (GTF or FASTA) of the transcript, without the trailing newline.
+    :type record: bytes
+    """
+
+    handle.write(b"%d/%d\n" % (counter, len(record) + 1))
+    handle.write(record)
+    handle.write(b"\n")
+
+
+def read_records(filename):
+    """Function to read back the records written into a partial file through write_record.
+
+    :return: a generator of (counter, record) tuples, with the records still terminated by a newline.
+    """
+
+    with open(filename, "rb") as partial:
+        for header in iter(partial.readline, b""):
+            counter, length = header.split(b"/")
+            record = partial.read(int(length))
+            yield int(counter), record
+
+
 class CheckingProcess(multiprocessing.Process):
 
     def __init__(self,
@@ -207,6 +306,30 @@ class CheckingProcess(multiprocessing.Process):
         keys = sorted(keys, key=operator.itemgetter(0))
         return keys
 
+    def _iterate_lines(self, shelve_stacks, file_keys):
+        """Private method to retrieve from the shelves the lines of each transcript to check."""
+
+        for key in file_keys:
+            counter, keys = key
+            tid, chrom, (pos) = keys
+            try:
+                tid, shelf_name, write_start, write_length = tid
+            except ValueError as exc:
+                raise ValueError(f"{exc}\t{tid}")
+            start, end = pos
+            try:
+                shelf = shelve_stacks[shelf_name]
+            except KeyError:
+                exception = f"{shelf_name} not found in shelves, available: {shelve_stacks.keys()}"
+                self.logger.error(exception)
+                raise KeyError(exception)
+
+            shelf.seek(write_start)
+            lines = msgpack.loads(zlib.decompress(shelf.read(write_length)))
+            if "is_reference" not in lines:
+                raise KeyError(lines)
+            yield counter, lines, start, end
+
     def run(self):
         checker = functools.partial(create_transcript,
                                     # lenient=self.lenient,
@@ -214,8 +337,8 @@ class CheckingProcess(multiprocessing.Process):
                                     canonical_splices=self.canonical,
                                     logger=self.logger)
 
-        fasta_out = open(self.fasta_out, "w")
-        gtf_out = open(self.gtf_out, "w")
+        fasta_out = open(self.fasta_out, "wb")
+        gtf_out = open(self.gtf_out, "wb")
         self.logger.debug("Starting %s", self.name)
         self.logger.debug("Created output FASTA {self.fasta_out} and GTF {self.gtf_out}".format(**locals()))
         time.sleep(0.1)
@@ -226,47 +349,17 @@ class CheckingProcess(multiprocessing.Process):
         file_keys = self._get_keys()
 
         try:
-            for key in file_keys:
-                counter, keys = key
-                # lines, start, end, counter = self.submission_queue.get()
-                tid, chrom, (pos) = keys
-                try:
-                    tid, shelf_name, write_start, write_length = tid
-                except ValueError as exc:
-                    raise ValueError(f"{exc}\t{tid}")
-                start, end = pos
-                try:
-                    shelf = shelve_stacks[shelf_name]
-                except KeyError:
-                    exception = f"{shelf_name} not found in shelves, available: {shelve_stacks.keys()}"
-                    self.logger.error(exception)
-                    raise KeyError(exception)
-
-                shelf.seek(write_start)
-                lines = msgpack.loads(zlib.decompress(shelf.read(write_length)))
-
-                self.logger.debug("Checking %s", lines["tid"])
-                if "is_reference" not in lines:
-                    raise KeyError(lines)
-
-                transcript = checker(lines,
-                                     str(self.fasta.fetch(lines["chrom"], start-1, end)),
-                                     start,
-                                     end,
-                                     lenient=self.lenient,
-                                     is_reference=lines["is_reference"],
-                                     strand_specific=lines["strand_specific"])
-
+            for counter, transcript in check_transcripts(self._iterate_lines(shelve_stacks, file_keys),
+                                                         self.fasta, checker, self.canonical,
+                                                         lenient=self.lenient, logger=self.logger):
                 if transcript is None:
-                    self.logger.debug("%s failed the check", lines["tid"])
+                    self.logger.debug("Transcript #%s failed the check", counter)
                     continue
                 else:
-                    self.logger.debug("Printing %s", lines["tid"])
+                    self.logger.debug("Printing %s", transcript.id)
                     __printed += 1
-                    print("\n".join(["{0}/{1}".format(counter, line) for line in
-                                     transcript.format("gtf").split("\n")]), file=gtf_out)
-                    print("\n".join(["{0}/{1}".format(counter, line) for line in
-                                     transcript.fasta.split("\n")]), file=fasta_out)
+                    write_record(gtf_out, counter, transcript.format("gtf").encode())
+                    write_record(fasta_out, counter, transcript.fasta_bytes)
         except KeyboardInterrupt:
             raise KeyboardInterrupt
         except Exception as exc:
@@ -1,8 +1,11 @@
+import codecs
+import heapq
 import os
 import tempfile
 import gc
-from .checking import create_transcript, CheckingProcess
-from .annotation_parser import AnnotationParser, loaders
+from .checking import create_transcript, check_transcripts, read_records, CheckingProcess
+from .annotation_parser import AnnotationParser, loaders, load_rows, index_name
+from .caching import PrepareCache
 from ..configuration import MikadoConfiguration
 from ..exceptions import InvalidJson
 from ..utilities import Interval, IntervalTree
@@ -18,7 +21,7 @@ import multiprocessing.connection
 import multiprocessing.sharedctypes
 from collections import defaultdict
 import logging
-from ..utilities import path_join, merge_partial, overlap
+from ..utilities import path_join, overlap
 import sqlite3
 import pysam
 import numpy as np
@@ -46,7 +49,7 @@ def __cleanup(mikado_config, shelves):
         mikado_config.prepare.files.out_fasta = mikado_config.prepare.files.out_fasta.name
 
     for fname in shelves:
-        [os.remove(fname + suff) for suff in ("", "-shm", "-wal", "-journal") if os.path.exists(fname + suff)]
+        [os.remove(fname + suff) for suff in ("", "-shm", "-wal", "-journal", ".index") if os.path.exists(fname + suff)]
 
     return
 
@@ -217,7 +220,202 @@ def _analyse_chrom(chrom: str, keys: pd.DataFrame, shelves, logger):
         yield merged_transcripts[tid]["key"]
 
 
-def perform_check(keys, shelve_names, mikado_config: MikadoConfiguration, logger):
+def _iterate_lines(keys, shelve_stacks, mikado_config: MikadoConfiguration):
+    """Function to retrieve from their shelves the transcripts to check in the main process.
+    :return: a generator of (index, lines, start, end) tuples, as expected by check_transcripts.
+    """
+
+    for index, ((tid, shelf_name, write_start, write_length), chrom, key) in keys:
+        try:
+            shelf = shelve_stacks[shelf_name]
+            shelf.seek(write_start)
+            tobj = msgpack.loads(zlib.decompress((shelf.read(write_length))), raw=False)
+        except sqlite3.ProgrammingError as exc:
+            raise sqlite3.ProgrammingError("{}. Tids: {}".format(exc, tid))
+
+        if chrom not in mikado_config.reference.genome.references:
+            raise KeyError("Invalid chromosome name! {}, {}, {}, {}".format(tid, shelf_name, chrom, key))
+        yield index, tobj, key[0], key[1]
+
+
+def _check_in_main_process(keys, shelve_names, mikado_config: MikadoConfiguration, logger):
+    """Function to check the transcripts without spawning any subprocess.
+    :param keys: iterable of (index, key) tuples.
+    :return: a generator of (index, transcript) tuples, with transcript set to None for discarded models.
+    """
+
+    shelve_stacks = dict((shelf, open(shelf, "rb")) for shelf in shelve_names)
+    # Use functools to pre-configure the function
+    # with all necessary arguments aside for the lines
+    partial_checker = functools.partial(
+        create_transcript,
+        canonical_splices=mikado_config.prepare.canonical,
+        logger=logger,
+        strip_faulty_cds=mikado_config.prepare.strip_faulty_cds)
+    try:
+        yield from check_transcripts(_iterate_lines(keys, shelve_stacks, mikado_config),
+                                     mikado_config.reference.genome, partial_checker,
+                                     mikado_config.prepare.canonical,
+                                     lenient=mikado_config.prepare.lenient, logger=logger)
+    finally:
+        [_.close() for _ in shelve_stacks.values()]
+
+
+def _launch_checkers(keys, shelve_names, mikado_config: MikadoConfiguration, logger):
+    """Function to check the transcripts using multiple CheckingProcess instances.
+    Each transcript is numbered according to its position in the keys; the processes
+    will prefix each line of their output with this number.
+    :return: the names of the partial GTF and FASTA files.
+    """
+
+    batches = list(enumerate(keys, 1))
+    # np.random.shuffle(batches)
+    random.shuffle(batches)
+    kwargs = {
+        "fasta_out": os.path.basename(mikado_config.prepare.files.out_fasta.name),
+        "gtf_out": os.path.basename(mikado_config.prepare.files.out.name),
+        "tmpdir": mikado_config.tempdir.name,
+        "seed": mikado_config.seed,
+        "lenient": mikado_config.prepare.lenient,
+        "canonical_splices": mikado_config.prepare.canonical,
+        "strip_faulty_cds": mikado_config.prepare.strip_faulty_cds,
+        "log_level": mikado_config.log_settings.log_level
+    }
+
+    working_processes = []
+    for idx, batch in enumerate(np.array_split(np.array(batches,
+                                                        dtype=object), mikado_config.threads), 1):
+        batch_file = tempfile.NamedTemporaryFile(delete=False, mode="wb")
+        msgpack.dump(batch.tolist(), batch_file)
+        batch_file.flush()
+        batch_file.close()
+
+        proc = CheckingProcess(
+            batch_file.name,
+            mikado_config.logging_queue,
+            mikado_config.reference.genome.filename,
+            idx,
+            shelve_names,
+            **kwargs)
+        try:
+            proc.start()
+        except TypeError as exc:
+            logger.critical("Failed arguments: %s", (batch_file.name,
+                                                     mikado_config.logging_queue,
+                                                     mikado_config.reference.genome.filename,
+                                                     idx,
+                                                     shelve_names))
+            logger.critical("Failed kwargs: %s", kwargs)
+            logger.critical(exc)
+            raise
+        working_processes.append(proc)
+
+    [_.join() for _ in working_processes]
+
+    partial_gtf = [os.path.join(mikado_config.tempdir.name,
+                                "{0}-{1}".format(
+                                    os.path.basename(mikado_config.prepare.files.out.name),
+                                    _ + 1)) for _ in range(mikado_config.threads)]
+    partial_fasta = [os.path.join(
+        mikado_config.tempdir.name,
+        "{0}-{1}".format(os.path.basename(mikado_config.prepare.files.out_fasta.name), _ + 1))
+                     for _ in range(mikado_config.threads)]
+    return partial_gtf, partial_fasta
+
+
+def _merge_records(filenames, handle):
+    """Function to merge the partial files created by the checking processes into the final output.
+    As each process writes its transcripts in order, the files are merged in a streaming fashion.
+    :return: the number of records written.
+    """
+
+    handle.flush()
+    if codecs.lookup(getattr(handle, "encoding", None) or "ascii").name == "utf-8" and hasattr(handle, "buffer"):
+        write = handle.buffer.write
+    else:
+        write = lambda record: handle.write(record.decode())
+    total = 0
+    for _, record in heapq.merge(*[read_records(filename) for filename in filenames],
+                                 key=operator.itemgetter(0)):
+        write(record)
+        total += 1
+    handle.flush()
+    [os.remove(filename) for filename in filenames]
+    return total
+
+
+def _merge_checked(partial_gtf, partial_fasta, positions):
+    """Function to merge the partial files created by the checking processes in the incremental mode.
+    As each process writes its transcripts in order, the files are merged in a streaming fashion.
+    :param positions: the position, among all the transcripts, of each transcript which has been checked.
+    :return: a generator of (position, result) tuples, in order, with the result set to False
+    for discarded models and to the (GTF, FASTA) tuple otherwise.
+    """
+
+    gtfs = heapq.merge(*[read_records(filename) for filename in partial_gtf], key=operator.itemgetter(0))
+    fastas = heapq.merge(*[read_records(filename) for filename in partial_fasta], key=operator.itemgetter(0))
+    gtf, fasta = next(gtfs, None), next(fastas, None)
+    for counter, position in enumerate(positions, 1):
+        if gtf is not None and gtf[0] == counter:
+            yield position, (gtf[1][:-1].decode(), fasta[1][:-1].decode())
+            gtf, fasta = next(gtfs, None), next(fastas, None)
+        else:
+            yield position, False
+    [os.remove(filename) for filename in partial_gtf + partial_fasta]
+
+
+def _perform_cached_check(keys, shelve_names, mikado_config: MikadoConfiguration, logger, cache: PrepareCache):
+    """
+    Version of perform_check for the incremental mode. Transcripts whose check result is already
+    present in the cache are not checked again; the cached and the new results are merged by position,
+    so that the output is written as it becomes available and in the same order as in the standard mode.
+    :param keys: sorted list of [tid, sequence]
+    :param shelve_names: list of the temporary files.
+    :param mikado_config: MikadoConfiguration
+    :param logger: logger
+    :param cache: the PrepareCache instance.
+    :return:
+    """
+
+    keys = list(keys)
+    to_check = [position for position, (tid, chrom, key) in enumerate(keys)
+                if cache.get_checked(tid[1], tid[0]) is None]
+
+    logger.info("Retrieved %d checked transcripts from the cache; %d to check",
+                len(keys) - len(to_check), len(to_check))
+
+    if len(to_check) == 0:
+        checked = iter([])
+    elif mikado_config.prepare.single is True or mikado_config.threads == 1:
+        checked = ((position, False if transcript_object is None else
+                    (transcript_object.format("gtf"), transcript_object.fasta))
+                   for position, transcript_object in _check_in_main_process(
+                       ((position, keys[position]) for position in to_check), shelve_names, mikado_config, logger))
+    else:
+        partial_gtf, partial_fasta = _launch_checkers([keys[position] for position in to_check],
+                                                      shelve_names, mikado_config, logger)
+        checked = _merge_checked(partial_gtf, partial_fasta, to_check)
+
+    current = next(checked, None)
+    for position, ((tid, shelf_name, _, _), _, _) in enumerate(keys):
+        if current is not None and current[0] == position:
+            result = current[1]
+            cache.set_checked(shelf_name, tid, result)
+            current = next(checked, None)
+        else:
+            result = cache.get_checked(shelf_name, tid)
+        if result is False:
+            continue
+        print(result[0], file=mikado_config.prepare.files.out)
+        print(result[1], file=mikado_config.prepare.files.out_fasta)
+    cache.close()
+
+    mikado_config.prepare.files.out_fasta.close()
+    mikado_config.prepare.files.out.close()
+    return
+
+
+def perform_check(keys, shelve_names, mikado_config: MikadoConfiguration, logger, cache=None):
 
     """
     This is the most important method. After preparing the data structure,
@@ -229,9 +427,13 @@ def perform_check(keys, shelve_names, mikado_config: MikadoConfiguration, logger
     :param shelve_names: list of the temporary files.
     :param mikado_config: MikadoConfiguration
     :param logger: logger
+    :param cache: optional PrepareCache instance, for the incremental mode.
     :return:
     """
 
+    if cache is not None:
+        return _perform_cached_check(keys, shelve_names, mikado_config, logger, cache)
+
     counter = 0
 
     # FASTA extraction *has* to be done at the main process level, it's too slow
@@ -239,34 +441,7 @@ def perform_check(keys, shelve_names, mikado_config: MikadoConfiguration, logger
 
     if mikado_config.prepare.single is True or mikado_config.threads == 1:
 
-        shelve_stacks = dict((shelf, open(shelf, "rb")) for shelf in shelve_names)
-        # Use functools to pre-configure the function
-        # with all necessary arguments aside for the lines
-        partial_checker = functools.partial(
-            create_transcript,
-            canonical_splices=mikado_config.prepare.canonical,
-            logger=logger,
-            strip_faulty_cds=mikado_config.prepare.strip_faulty_cds)
-
-        for tid, chrom, key in keys:
-            tid, shelf_name, write_start, write_length = tid
-            try:
-                shelf = shelve_stacks[shelf_name]
-                shelf.seek(write_start)
-                tobj = msgpack.loads(zlib.decompress((shelf.read(write_length))), raw=False)
-            except sqlite3.ProgrammingError as exc:
-                raise sqlite3.ProgrammingError("{}. Tids: {}".format(exc, tid))
-
-            if chrom not in mikado_config.reference.genome.references:
-                raise KeyError("Invalid chromosome name! {}, {}, {}, {}".format(tid, shelf_name, chrom, key))
-
-            transcript_object = partial_checker(
-                tobj,
-                str(mikado_config.reference.genome.fetch(chrom, key[0] - 1, key[1])),
-                key[0], key[1],
-                lenient=mikado_config.prepare.lenient,
-                is_reference=tobj["is_reference"],
-                strand_specific=tobj["strand_specific"])
+        for _, transcript_object in _check_in_main_process(enumerate(keys), shelve_names, mikado_config, logger):
             if transcript_object is None:
                 continue
             counter += 1
@@ -283,61 +458,9 @@ def perform_check(keys, shelve_names, mikado_config: MikadoConfiguration, logger
 
         # submission_queue = multiprocessing.JoinableQueue(-1)
 
-        batches = list(enumerate(keys, 1))
-        # np.random.shuffle(batches)
-        random.shuffle(batches)
-        kwargs = {
-            "fasta_out": os.path.basename(mikado_config.prepare.files.out_fasta.name),
-            "gtf_out": os.path.basename(mikado_config.prepare.files.out.name),
-            "tmpdir": mikado_config.tempdir.name,
-            "seed": mikado_config.seed,
-            "lenient": mikado_config.prepare.lenient,
-            "canonical_splices": mikado_config.prepare.canonical,
-            "strip_faulty_cds": mikado_config.prepare.strip_faulty_cds,
-            "log_level": mikado_config.log_settings.log_level
-        }
-
-        working_processes = []
-        for idx, batch in enumerate(np.array_split(np.array(batches,
-                                                            dtype=object), mikado_config.threads), 1):
-            batch_file = tempfile.NamedTemporaryFile(delete=False, mode="wb")
-            msgpack.dump(batch.tolist(), batch_file)
-            batch_file.flush()
-            batch_file.close()
-
-            proc = CheckingProcess(
-                batch_file.name,
-                mikado_config.logging_queue,
-                mikado_config.reference.genome.filename,
-                idx,
-                shelve_names,
-                **kwargs)
-            try:
-                proc.start()
-            except TypeError as exc:
-                logger.critical("Failed arguments: %s", (batch_file.name,
-                                                         mikado_config.logging_queue,
-                                                         mikado_config.reference.genome.filename,
-                                                         idx,
-                                                         shelve_names))
-                logger.critical("Failed kwargs: %s", kwargs)
-                logger.critical(exc)
-                raise
-            working_processes.append(proc)
-
-        [_.join() for _ in working_processes]
-
-        partial_gtf = [os.path.join(mikado_config.tempdir.name,
-                                    "{0}-{1}".format(
-                                        os.path.basename(mikado_config.prepare.files.out.name),
-                                        _ + 1)) for _ in range(mikado_config.threads)]
-        merge_partial(partial_gtf, mikado_config.prepare.files.out)
-
-        partial_fasta = [os.path.join(
-            mikado_config.tempdir.name,
-            "{0}-{1}".format(os.path.basename(mikado_config.prepare.files.out_fasta.name), _ + 1))
-                         for _ in range(mikado_config.threads)]
-        merge_partial(partial_fasta, mikado_config.prepare.files.out_fasta)
+        partial_gtf, partial_fasta = _launch_checkers(keys, shelve_names, mikado_config, logger)
+        _merge_records(partial_gtf, mikado_config.prepare.files.out)
+        _merge_records(partial_fasta, mikado_config.prepare.files.out_fasta)
 
     mikado_config.prepare.files.out_fasta.close()
     mikado_config.prepare.files.out.close()
@@ -352,11 +475,22 @@ def perform_check(keys, shelve_names, mikado_config: MikadoConfiguration, logger
 row_columns = ["chrom", "start", "end", "strand", "tid", "write_start", "write_length", "shelf"]
 
 
-def _load_exon_lines_single_thread(mikado_config, shelve_names, logger, min_length, strip_cds, max_intron):
+def _bam_options(mikado_config, threads=1) -> dict:
+    """Function to extract the BAM-specific loading options from the configuration.
+    :param threads: number of processes available to load a single, indexed BAM file.
+    """
+    return {"threads": max(1, threads),
+            "min_mapq": mikado_config.prepare.bam.min_mapping_quality,
+            "skip_secondary": mikado_config.prepare.bam.skip_secondary,
+            "skip_supplementary": mikado_config.prepare.bam.skip_supplementary,
+            "shard_size": mikado_config.prepare.bam.shard_size}
+
+
+def _input_table(mikado_config, shelve_names) -> list:
+    """Function to associate each input file with its shelf and its options.
+    :return: a list of (shelf, label, strand_specific, is_reference, exclude_redundant, strip_cds, gff) tuples.
+    """
 
-    logger.info("Starting to load lines from %d files (single-threaded)",
-                len(mikado_config.prepare.files.gff))
-    previous_file_ids = collections.defaultdict(set)
     if mikado_config.prepare.files.exclude_redundant == []:
         mikado_config.prepare.files.exclude_redundant = [False] * len(mikado_config.prepare.files.gff)
     if not len(mikado_config.prepare.files.exclude_redundant) == len(mikado_config.prepare.files.gff):
@@ -383,10 +517,21 @@ def _load_exon_lines_single_thread(mikado_config, shelve_names, logger, min_leng
                 mikado_config.prepare.files.gff
             )
         )
+    return to_do
+
+
+def _load_exon_lines_single_thread(mikado_config, to_do, logger, min_length, strip_cds, max_intron):
+
+    logger.info("Starting to load lines from %d files (single-threaded)", len(to_do))
+    previous_file_ids = collections.defaultdict(set)
 
     logger.debug("To do: %d combinations", len(to_do))
 
     rows = pd.DataFrame([], columns=row_columns)
+    if mikado_config.prepare.single is True:
+        bam_options = _bam_options(mikado_config, threads=1)
+    else:
+        bam_options = _bam_options(mikado_config, threads=mikado_config.threads)
 
     for new_shelf, label, strand_specific, is_reference, exclude_redundant, file_strip_cds, gff_name in to_do:
         if file_strip_cds is True:
@@ -400,6 +545,8 @@ def _load_exon_lines_single_thread(mikado_config, shelve_names, logger, min_leng
         loader = loaders.get(gff_handle.__annot_type__, None)
         if loader is None:
             raise ValueError("Invalid file type: {}".format(gff_handle.name))
+        elif gff_handle.__annot_type__ == "bam":
+            loader = functools.partial(loader, **bam_options)
         new_ids, new_rows = loader(new_shelf, gff_handle, label, found_ids, logger,
                                    min_length=min_length, max_intron=max_intron,
                                    strip_cds=file_strip_cds and not is_reference,
@@ -416,65 +563,59 @@ def _load_exon_lines_single_thread(mikado_config, shelve_names, logger, min_leng
     return rows
 
 
-def _load_exon_lines_multi(mikado_config, shelve_names, logger, min_length, strip_cds, threads, max_intron=3 * 10 ** 5):
-    logger.info("Starting to load lines from %d files (using %d processes)",
-                len(mikado_config.prepare.files.gff), threads)
+def _load_exon_lines_multi(mikado_config, to_do, logger, min_length, strip_cds, threads, max_intron=3 * 10 ** 5):
+    logger.info("Starting to load lines from %d files (using %d processes)", len(to_do), threads)
     manager = multiprocessing.Manager()
     submission_queue = manager.JoinableQueue(-1)
-    return_queue = manager.JoinableQueue(-1)
     working_processes = []
-    # working_processes = [ for _ in range(threads)]
 
     for num in range(threads):
         proc = AnnotationParser(submission_queue,
-                                return_queue,
                                 mikado_config.logging_queue,
                                 num + 1,
                                 log_level=mikado_config.log_settings.log_level,
                                 min_length=min_length,
                                 max_intron=max_intron,
                                 strip_cds=strip_cds,
+                                bam_options=_bam_options(mikado_config, mikado_config.threads // threads),
                                 seed=mikado_config.seed)
         proc.start()
         working_processes.append(proc)
 
-    shelve_df = []
     for shelf_index, (new_shelf, label, strand_specific, is_reference,
-                      exclude_redundant, file_strip_cds, gff_name) in enumerate(zip(
-            shelve_names,
-            mikado_config.prepare.files.labels,
-            mikado_config.prepare.files.strand_specific_assemblies,
-            mikado_config.prepare.files.reference,
-            mikado_config.prepare.files.exclude_redundant,
-            mikado_config.prepare.files.strip_cds,
-            mikado_config.prepare.files.gff)):
+                      exclude_redundant, file_strip_cds, gff_name) in enumerate(to_do):
+        if os.path.exists(index_name(new_shelf)):
+            os.remove(index_name(new_shelf))  # Leftover from a previous aborted run
         submission_queue.put((label, gff_name, strand_specific, is_reference, exclude_redundant, file_strip_cds,
                               new_shelf, shelf_index))
-        shelve_df.append((shelf_index, new_shelf))
 
-    shelve_df = pd.DataFrame(shelve_df, columns=["shelf_index", "shelf"])
     submission_queue.put(tuple(["EXIT"] * 8))
-    
-    rows = []
 
-    retrieved = 0
-    import sys
-    while retrieved < len(working_processes):
-        if return_queue.empty():
+    # Block until the parsers are done, without polling. Each parser writes the index of its shelves to disk.
+    pending = dict((proc.sentinel, proc) for proc in working_processes)
+    while pending:
+        for sentinel in multiprocessing.connection.wait(list(pending.keys())):
+            proc = pending.pop(sentinel)
+            proc.join()
+            if proc.exitcode != 0:
+                [_.terminate() for _ in pending.values()]
+                manager.shutdown()
+                raise RuntimeError(
+                    "{} exited with code {}. Please check the logs.".format(proc.name, proc.exitcode))
+
+    rows = []
+    for new_shelf, *_ in to_do:
+        if not os.path.exists(index_name(new_shelf)):
+            # Invalid assembly, already reported by the parser
             continue
-        row = return_queue.get(block=False)
-        if row == "FINISHED":
-            retrieved += 1
-        else:
-            rows.append(row)
-        continue
+        shelf_rows = pd.DataFrame(dict(zip(row_columns[:-1], load_rows(new_shelf))), columns=row_columns[:-1])
+        shelf_rows[row_columns[-1]] = new_shelf
+        rows.append(shelf_rows)
+        os.remove(index_name(new_shelf))
 
-    [_.join() for _ in working_processes]
-    
-    rows = pd.DataFrame(rows, columns=row_columns[:-1] + ["shelf_index"])
-    rows = rows.merge(shelve_df, on="shelf_index", how="left").drop(["shelf_index"], axis=1)
+    rows = pd.concat(rows, ignore_index=True) if rows else pd.DataFrame([], columns=row_columns)
     for key in ["chrom", "tid", "strand"]:
-         rows[key] = rows[key].str.decode("utf-8")
+        rows[key] = rows[key].str.decode("utf-8")
 
     del working_processes
     gc.collect()
@@ -483,7 +624,8 @@ def _load_exon_lines_multi(mikado_config, shelve_names, logger, min_length, stri
     return rows
 
 
-def load_exon_lines(mikado_config, shelve_names, logger, min_length=0, max_intron=3 * 10 ** 5) -> pd.DataFrame:
+def load_exon_lines(mikado_config, shelve_names, logger, min_length=0, max_intron=3 * 10 ** 5,
+                    cache=None) -> pd.DataFrame:
 
     """This function loads all exon lines from the GFF inputs into a
      defaultdict instance.
@@ -494,19 +636,50 @@ def load_exon_lines(mikado_config, shelve_names, logger, min_length=0, max_intro
     :param min_length: minimal length of the transcript. If it is not met, the transcript will be discarded.
     :param max_intron: maximum length for an intron. If it is not met, the transcript will be discarded.
     :type min_length: int
+    :param cache: optional PrepareCache instance. If provided, inputs which are already in the cache
+    will not be parsed again, and newly parsed inputs will be added to the cache.
 f
     :return: exon_lines
     :rtype: collections.defaultdict[list]
     """
 
-    threads = min([len(mikado_config.prepare.files.gff),
-                   mikado_config.threads])
     strip_cds = mikado_config.prepare.strip_cds
-
-    if mikado_config.prepare.single is True or threads == 1:
-        rows = _load_exon_lines_single_thread(mikado_config, shelve_names, logger, min_length, strip_cds, max_intron)
+    to_do = _input_table(mikado_config, shelve_names)
+    cached = dict()
+    if cache is not None:
+        for new_shelf, label, strand_specific, is_reference, exclude_redundant, file_strip_cds, gff_name in to_do:
+            cache.input_key(new_shelf, gff_name, label, strand_specific, is_reference, exclude_redundant,
+                            file_strip_cds is True or strip_cds)
+            restored = cache.restore_shelf(new_shelf)
+            if restored is not None:
+                logger.info("Retrieved %s from the cache", gff_name)
+                cached[new_shelf] = restored
+        to_do = [_ for _ in to_do if _[0] not in cached]
+        for new_shelf, *_ in to_do:
+            # A leftover shelf might be a hard link to a cached file: unlink it before it gets overwritten
+            if os.path.exists(new_shelf):
+                os.remove(new_shelf)
+
+    threads = min([len(to_do), mikado_config.threads])
+
+    if len(to_do) == 0:
+        rows = pd.DataFrame([], columns=row_columns)
+    elif mikado_config.prepare.single is True or threads == 1:
+        rows = _load_exon_lines_single_thread(mikado_config, to_do, logger, min_length, strip_cds, max_intron)
     else:
-        rows = _load_exon_lines_multi(mikado_config, shelve_names, logger, min_length, strip_cds, threads, max_intron)
+        rows = _load_exon_lines_multi(mikado_config, to_do, logger, min_length, strip_cds, threads, max_intron)
+
+    if cache is not None:
+        pieces = []
+        for new_shelf in shelve_names:
+            if new_shelf in cached:
+                pieces.append(cached[new_shelf])
+            else:
+                piece = rows[rows["shelf"] == new_shelf]
+                if piece.shape[0] > 0:
+                    cache.store_shelf(new_shelf, piece)
+                pieces.append(piece)
+        rows = pd.concat(pieces, ignore_index=True)
 
     logger.info("Finished loading lines from %d files",
                 len(mikado_config.prepare.files.gff))
@@ -622,11 +795,17 @@ def prepare(mikado_config: MikadoConfiguration, logger):
     logger.info("Started loading exon lines")
     errored = False
     try:
+        if mikado_config.prepare.cache_dir:
+            logger.info("Incremental mode: using %s as cache directory", mikado_config.prepare.cache_dir)
+            cache = PrepareCache(mikado_config.prepare.cache_dir, mikado_config, logger)
+        else:
+            cache = None
         # chrom, start, end, strand, tid, write_start, write_length, shelf
         rows = load_exon_lines(
             mikado_config, shelve_names, logger,
             min_length=mikado_config.prepare.minimum_cdna_length,
-            max_intron=mikado_config.prepare.max_intron_length,)
+            max_intron=mikado_config.prepare.max_intron_length,
+            cache=cache)
 
         logger.info("Finished loading exon lines")
 
@@ -665,7 +844,7 @@ def prepare(mikado_config: MikadoConfiguration, logger):
                 yield from _analyse_chrom(chrom, rows.loc[transcripts.groups[chrom], columns],
                                           shelves, logger=logger)
 
-        perform_check(divide_by_chrom(), shelve_names, mikado_config, logger)
+        perform_check(divide_by_chrom(), shelve_names, mikado_config, logger, cache=cache)
     except Exception as exc:
         # TODO: Consider using stderr to signal errors here too?
         logger.exception(exc)
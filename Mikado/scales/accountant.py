@@ -13,7 +13,10 @@ from logging import handlers as log_handlers
 from ..transcripts import Transcript, Namespace
 from ..utilities import calc_f1
 from .resultstorer import ResultStorer
+from .flag_tables import FlagTable, TranscriptFlags
 from ..utilities import IntervalTree
+from .reference_preparation.reference_model import ReferenceModel
+from .reference_preparation.binary_index import BinaryIndex
 import networkx as nx
 import numpy as np
 
@@ -28,7 +31,7 @@ class Accountant:
 
         """Class constructor. It requires:
         :param genes: a dictionary
-        :type genes: [dict|GeneDict]
+        :type genes: [dict|GeneDict|ReferenceModel|BinaryIndex]
         :param args: A namespace (like those provided by argparse)
         containing the parameters for the run.
         """
@@ -46,8 +49,8 @@ class Accountant:
         self.ends = dict()
         self.intron_chains = dict()
         self.monoexonic_matches = (set(), set())
-        self.ref_genes = dict()
-        self.pred_genes = dict()
+        self.ref_genes = TranscriptFlags(default=0b1000)
+        self.pred_genes = TranscriptFlags(default=0b1000)
         if load_ref is True:
             self.logger.info("Starting loading the reference for the accountant %s", self._counter)
             self.__setup_reference_data(genes)
@@ -61,24 +64,26 @@ class Accountant:
         """
         Private method that prepares the reference data into the data structure
         that will be used to compare each prediction with a reference transcript.
+        With a reference model or a binary index, the transcripts are read from their arrays, without decoding
+        the genes.
         """
 
-        for gene in genes:
-            self.ref_genes[gene] = dict()
-            for transcr in genes[gene]:
+        if isinstance(genes, (ReferenceModel, BinaryIndex)):
+            references = genes.reference_transcripts()
+        else:
+            references = ((gene, genes[gene]) for gene in genes)
+
+        for gene, transcripts in references:
+            self.ref_genes.add_gene(gene)
+            for transcr in transcripts:
                 # 0b000, indicating:
                 # First bit: stringent match (100% F1)
                 # Second bit: normal match (95% F1)
                 # Third bit: lenient match (80% F1)
-                self.ref_genes[gene][transcr.id] = 0b1000
+                self.ref_genes[(gene, transcr.id)] = 0b1000
                 #                 self.ref_transcript_num+=1
                 if transcr.chrom not in self.introns:
-                    self.exons[transcr.chrom] = dict([("+", dict()), ("-", dict())])
-                    self.starts[transcr.chrom] = dict([("+", dict()), ("-", dict())])
-                    self.ends[transcr.chrom] = dict([("+", dict()), ("-", dict())])
-
-                    self.introns[transcr.chrom] = dict([("+", dict()), ("-", dict())])
-                    self.intron_chains[transcr.chrom] = dict([("+", dict()), ("-", dict())])
+                    self.__add_chrom(transcr.chrom)
                 if transcr.strand is None:
                     strand = "+"
                 else:
@@ -93,14 +98,27 @@ class Accountant:
 
                 if transcr.exon_num == 1:
                     exon = tuple([transcr.exons[0][0], transcr.exons[0][1]])
-                    self.exons[transcr.chrom][strand][exon] = 0b00000
-                    self.exons[transcr.chrom][strand][exon] |= 0b1
-                    self.exons[transcr.chrom][strand][exon] |= 0b100
+                    self.exons[transcr.chrom][strand][exon] = 0b101
                 else:
                     self.__store_multiexonic_reference(transcr, strand)
 
         return
 
+    def __add_chrom(self, chrom):
+
+        """
+        Private method to create the tables for a new chromosome. Exons, starts and ends are
+        kept in FlagTable instances, one per strand.
+        :param chrom: the chromosome to add.
+        """
+
+        self.exons[chrom] = dict([("+", FlagTable()), ("-", FlagTable())])
+        self.starts[chrom] = dict([("+", FlagTable()), ("-", FlagTable())])
+        self.ends[chrom] = dict([("+", FlagTable()), ("-", FlagTable())])
+
+        self.introns[chrom] = dict([("+", dict()), ("-", dict())])
+        self.intron_chains[chrom] = dict([("+", dict()), ("-", dict())])
+
     def __store_multiexonic_reference(self, transcr, strand):
 
         """
@@ -122,19 +140,17 @@ class Accountant:
             self.intron_chains[transcr.chrom][strand][intron_chain] = [set(), set()]
         self.intron_chains[transcr.chrom][strand][intron_chain][0].add(transcr.id)
 
+        exons = self.exons[transcr.chrom][strand]
         for index, exon in enumerate(transcr.exons):
             exon = tuple([exon[0], exon[1]])
-            if exon not in self.exons[transcr.chrom][strand]:
-                self.exons[transcr.chrom][strand][exon] = 0b00000
-            self.exons[transcr.chrom][strand][exon] |= 0b01
             if index == 0:
-                self.exons[transcr.chrom][strand][exon] |= 0b010000
+                exons.set_bits(exon, 0b010001)
                 self.starts[transcr.chrom][strand][exon[1]] = 0b01
             elif index == transcr.exon_num - 1:
-                self.exons[transcr.chrom][strand][exon] |= 0b010000
+                exons.set_bits(exon, 0b010001)
                 self.ends[transcr.chrom][strand][exon[0]] = 0b01
             else:
-                self.exons[transcr.chrom][strand][exon] |= 0b01000
+                exons.set_bits(exon, 0b01001)
 
     def __setup_logger(self):
 
@@ -182,16 +198,6 @@ class Accountant:
                    }
         """
 
-        found_transcripts_stringent = 0  # 100% match
-        found_transcripts = 0  # 95% match
-        found_transcripts_lenient = 0  # 80% match
-        found_genes_stringent = 0  # 100% match
-        found_genes = 0  # 95% match
-        found_genes_lenient = 0  # 80% match
-        private_genes = 0
-        private_transcripts = 0
-        total_transcripts = 0
-
         if store_name == "ref":
             store = self.ref_genes
         elif store_name == "pred":
@@ -205,25 +211,19 @@ class Accountant:
         # Third bit: lenient match (80% F1)
         # Fourth bit: private
 
-        for gene in store:
-            gene_match = 0b000
-            gene_not_found = 0b1
-            for _, val in store[gene].items():
-                total_transcripts += 1
-                found_transcripts_lenient += (0b100 & val) >> 2
-                found_transcripts += (0b10 & val) >> 1
-                found_transcripts_stringent += 0b1 & val
-                # Will evaluate to 1 if the transcript has at least one match
-                private_transcripts += (0b1000 & val) >> 3
-                gene_not_found &= (0b1000 & val) >> 3
-                gene_match |= val
-
-            found_genes_stringent += gene_match & 0b1
-            # Shift back by 1
-            found_genes += (gene_match & 0b10) >> 1
-            # Shift back by 2
-            found_genes_lenient += (gene_match & 0b100) >> 2
-            private_genes += gene_not_found
+        values = store.values
+        total_transcripts = len(values)
+        found_transcripts_stringent = np.count_nonzero(values & 0b1)  # 100% match
+        found_transcripts = np.count_nonzero(values & 0b10)  # 95% match
+        found_transcripts_lenient = np.count_nonzero(values & 0b100)  # 80% match
+        private_transcripts = np.count_nonzero(values & 0b1000)
+
+        # A gene is found if any of its transcripts is, and private only if all of its transcripts are
+        gene_match, gene_not_found = store.gene_flags()
+        found_genes_stringent = np.count_nonzero(gene_match & 0b1)
+        found_genes = np.count_nonzero(gene_match & 0b10)
+        found_genes_lenient = np.count_nonzero(gene_match & 0b100)
+        private_genes = np.count_nonzero(gene_not_found & 0b1000)
 
         self.logger.debug("""Found %s transcripts:
         \tstringent\t%s
@@ -425,11 +425,10 @@ class Accountant:
 
         for chrom in self.starts:
             for strand in self.starts[chrom]:
-                for start in self.starts[chrom][strand]:
-                    exon_common_lenient += (0b1 & self.starts[chrom][strand][start]) & \
-                                           ((0b10 & self.starts[chrom][strand][start]) >> 1)
-                    exon_ref_lenient += 0b01 & self.starts[chrom][strand][start]
-                    exon_pred_lenient += (0b10 & self.starts[chrom][strand][start]) >> 1
+                values = self.starts[chrom][strand].values
+                exon_common_lenient += np.count_nonzero((values & 0b11) == 0b11)
+                exon_ref_lenient += np.count_nonzero(values & 0b01)
+                exon_pred_lenient += np.count_nonzero(values & 0b10)
         starts_common = exon_common_lenient
         starts_ref = exon_ref_lenient
         starts_pred = exon_pred_lenient
@@ -438,11 +437,10 @@ class Accountant:
 
         for chrom in self.ends:
             for strand in self.ends[chrom]:
-                for end in self.ends[chrom][strand]:
-                    exon_common_lenient += (0b01 & self.ends[chrom][strand][end]) & \
-                                           ((0b10 & self.ends[chrom][strand][end]) >> 1)
-                    exon_ref_lenient += 0b01 & self.ends[chrom][strand][end]
-                    exon_pred_lenient += (0b10 & self.ends[chrom][strand][end]) >> 1
+                values = self.ends[chrom][strand].values
+                exon_common_lenient += np.count_nonzero((values & 0b11) == 0b11)
+                exon_ref_lenient += np.count_nonzero(values & 0b01)
+                exon_pred_lenient += np.count_nonzero(values & 0b10)
 
         ends_common = exon_common_lenient - starts_common
         ends_ref = exon_ref_lenient - starts_ref
@@ -483,56 +481,35 @@ class Accountant:
                 # 0b001000: internal
                 # 0b010000: border
                 # 0b100000: single match lenient
-                curr_pred_bases = set()
-                curr_ref_bases = set()
-                curr_exon = (-1, -1)
-
-                for exon in sorted(self.exons[chrom][strand], key=operator.itemgetter(0)):
-                    # Out of previous overlap
-                    if exon[0] > curr_exon[1]:
-                        bases[0] += len(set.intersection(curr_pred_bases, curr_ref_bases))
-                        bases[1] += len(curr_pred_bases)
-                        bases[2] += len(curr_ref_bases)
-                        curr_exon = exon
-                        curr_pred_bases = set()
-                        curr_ref_bases = set()
-                    else:
-                        curr_exon = (curr_exon[0], exon[1])
-
-                    # Exon is in reference
-                    if (0b01 & self.exons[chrom][strand][exon]) == 0b1:
-                        curr_ref_bases.update(set(range(exon[0], exon[1])))
-                        exon_stringent[2] += 1
-                        # Internal (first condition)
-                        # OR
-                        # Single exon
-                        if (0b001000 & self.exons[chrom][strand][exon]) == 0b001000:
-                            exon_lenient[2] += 1
-                        elif 0b100000 & self.exons[chrom][strand][exon]:
-                            exon_lenient[2] += 1
-
-                    # Exon is in prediction
-                    if (0b10 & self.exons[chrom][strand][exon]) == 0b10:
-                        curr_pred_bases.update(set(range(exon[0], exon[1])))
-                        exon_stringent[1] += 1
-                        # Either internal, or a single exon which
-                        # has not a lenient single match with the reference annotation
-                        if (0b001000 & self.exons[chrom][strand][exon]) == 0b001000:
-                            exon_lenient[1] += 1
-                        elif 0b100000 & self.exons[chrom][strand][exon]:
-                            exon_lenient[1] += 1
-
-                    # In both
-                    if (0b11 & self.exons[chrom][strand][exon]) == 0b11:
-                        exon_stringent[0] += 1
-                        if (0b001000 & self.exons[chrom][strand][exon]) == 0b001000:
-                            exon_lenient[0] += 1
-                        elif 0b100000 & self.exons[chrom][strand][exon]:
-                            exon_lenient[0] += 1
-
-                bases[0] += len(set.intersection(curr_pred_bases, curr_ref_bases))
-                bases[1] += len(curr_pred_bases)
-                bases[2] += len(curr_ref_bases)
+                table = self.exons[chrom][strand]
+                if len(table) == 0:
+                    continue
+                coords = np.array(list(table.keys()), dtype=np.int64).reshape(-1, 2)
+                # Stable sort on the start only, so that exons with the same start keep their order of insertion
+                order = np.argsort(coords[:, 0], kind="stable")
+                starts, ends, values = coords[order, 0], coords[order, 1], table.values[order]
+
+                # Exons are grouped in clusters, a new one starting whenever an exon starts after the end of
+                # the previous one. Bases (the exons are half-open here) are counted cluster by cluster.
+                cluster = np.cumsum(np.concatenate([[1], starts[1:] > ends[:-1]]))
+                in_ref = (values & 0b01) > 0
+                in_pred = (values & 0b10) > 0
+                ref_bases = self.__covered_bases(starts[in_ref], ends[in_ref], cluster[in_ref])
+                pred_bases = self.__covered_bases(starts[in_pred], ends[in_pred], cluster[in_pred])
+                either = in_ref | in_pred
+                all_bases = self.__covered_bases(starts[either], ends[either], cluster[either])
+                bases[0] += ref_bases + pred_bases - all_bases
+                bases[1] += pred_bases
+                bases[2] += ref_bases
+
+                # Internal OR single exon with a lenient match
+                lenient = (values & 0b101000) > 0
+                exon_stringent[2] += np.count_nonzero(in_ref)
+                exon_lenient[2] += np.count_nonzero(in_ref & lenient)
+                exon_stringent[1] += np.count_nonzero(in_pred)
+                exon_lenient[1] += np.count_nonzero(in_pred & lenient)
+                exon_stringent[0] += np.count_nonzero(in_ref & in_pred)
+                exon_lenient[0] += np.count_nonzero(in_ref & in_pred & lenient)
 
         assert bases[0] <= min(bases[1], bases[2]), bases
         result_dictionary["bases"] = bases
@@ -540,6 +517,29 @@ class Accountant:
         result_dictionary["exons"]["lenient"] = exon_lenient
         return result_dictionary
 
+    @staticmethod
+    def __covered_bases(starts, ends, cluster):
+        """
+        Private method to calculate, cluster by cluster, the number of bases covered by a set of half-open
+        intervals sorted by start.
+        :param starts: the starts of the intervals, as a numpy array
+        :param ends: the ends of the intervals, as a numpy array
+        :param cluster: the (sorted) cluster of each interval, as a numpy array
+        :return: the sum over the clusters of the bases covered
+        :rtype: int
+        """
+
+        if len(starts) == 0:
+            return 0
+        # Shift each cluster past the end of the previous one, so that the running maximum restarts in each
+        width = int(max(ends.max(), starts.max()) - starts.min()) + 1
+        offset = (cluster - cluster[0]) * width - starts.min()
+        starts, ends = starts + offset, ends + offset
+        # Each interval adds the bases between the farthest end reached so far and its own end
+        reached = np.maximum.accumulate(ends)
+        previous = np.concatenate([[starts[0]], reached[:-1]])
+        return int(np.clip(ends - np.maximum(starts, previous), 0, None).sum())
+
     def __calculate_exon_stats(self):
 
         """
@@ -561,47 +561,26 @@ class Accountant:
         for attr in simplified.attributes:
             setattr(simplified, attr, getattr(self, attr))
 
+        # The flag tables are converted into plain types, for msgpack
+        simplified.pred_genes = self.pred_genes.state
+        simplified.ref_genes = self.ref_genes.state
+        for feature in ("exons", "starts", "ends"):
+            store = getattr(self, feature)
+            setattr(simplified, feature, dict(
+                (chrom, dict((strand, table.state) for strand, table in store[chrom].items())) for chrom in store))
+
         return simplified
 
     def merge_into(self, accountant):
 
-        for parent in accountant.pred_genes:
-            if parent not in self.pred_genes:
-                self.pred_genes[parent] = accountant.pred_genes[parent].copy()
-            else:
-                for tid in accountant.pred_genes[parent]:
-                    if tid in self.pred_genes[parent]:
-                        self.pred_genes[parent][tid] |= accountant.pred_genes[parent][tid]
-                    else:
-                        self.pred_genes[parent][tid] = accountant.pred_genes[parent][tid]
-
-        def clearBit(int_type, offset):
-            mask = ~(1 << offset)
-            return (int_type & mask)
-
-        def getBit(int_type, offset):
-            mask = 1 << offset
-            if (int_type & mask):
-                return 1
-            else:
-                return 0
-
-        def setBit(int_type, offset):
-            mask = 1 << offset
-            return (int_type | mask)
-
-        for ref_gene in accountant.ref_genes:
-            for refid in accountant.ref_genes[ref_gene]:
-                val = self.ref_genes[ref_gene][refid]
-                oval = accountant.ref_genes[ref_gene][refid]
-                for pos in range(3):
-                    bit = getBit(val, pos) | getBit(oval, pos)
-                    if bit:
-                        val = setBit(val, pos)
-                bit = getBit(val, 3) & getBit(oval, 3)
-                if not bit:
-                    val = clearBit(val, 3)
-                self.ref_genes[ref_gene][refid] = val
+        """
+        Method to merge into this accountant the data of another one, or of its serialised version.
+        The flags of the prediction transcripts, exons, starts and ends are merged with an OR;
+        the reference transcripts keep the "private" bit only if they are private in both.
+        """
+
+        self.pred_genes.merge(accountant.pred_genes)
+        self.ref_genes.merge(accountant.ref_genes, intersection=0b1000)
 
         for chrom in accountant.intron_chains:
             if chrom not in self.intron_chains:
@@ -630,11 +609,8 @@ class Accountant:
                     my_store[chrom] = dict()
                 for strand in store[chrom]:
                     if strand not in my_store[chrom]:
-                        my_store[chrom][strand] = dict()
-                    for feat in store[chrom][strand]:
-                        if feat not in my_store[chrom][strand]:
-                            my_store[chrom][strand][feat] = 0b0
-                        my_store[chrom][strand][feat] |= store[chrom][strand][feat]
+                        my_store[chrom][strand] = FlagTable()
+                    my_store[chrom][strand].merge(store[chrom][strand])
 
     def __store_multiexonic_result(self, transcr, strand):
 
@@ -655,23 +631,18 @@ class Accountant:
             self.intron_chains[chrom][strand][ic_key] = [set(), set()]
         self.intron_chains[chrom][strand][ic_key][1].add(transcr.id)
 
+        exons = self.exons[chrom][strand]
         for index, exon in enumerate(transcr.exons):
             exon = tuple([exon[0], exon[1]])
-            if exon not in self.exons[chrom][strand]:
-                self.exons[chrom][strand][exon] = 0b0
-            self.exons[chrom][strand][exon] |= 0b10  # set it as "in prediction"
+            # set it as "in prediction"
             if index == 0:
-                self.exons[chrom][strand][exon] |= 0b010000
-                if exon[1] not in self.starts[transcr.chrom][strand]:
-                    self.starts[chrom][strand][exon[1]] = 0b0
-                self.starts[chrom][strand][exon[1]] |= 0b10
+                exons.set_bits(exon, 0b010010)
+                self.starts[chrom][strand].set_bits(exon[1], 0b10)
             elif index == exon_num - 1:
-                self.exons[chrom][strand][exon] |= 0b010000
-                if exon[0] not in self.ends[chrom][strand]:
-                    self.ends[chrom][strand][exon[0]] = 0b00
-                self.ends[chrom][strand][exon[0]] |= 0b10
+                exons.set_bits(exon, 0b010010)
+                self.ends[chrom][strand].set_bits(exon[0], 0b10)
             else:
-                self.exons[chrom][strand][exon] |= 0b01000
+                exons.set_bits(exon, 0b01010)
 
     def __store_monoexonic_result(self, transcr, strand, result: ResultStorer, other_exon=None):
         """
@@ -684,10 +655,7 @@ class Accountant:
         """
         assert transcr.monoexonic is True
         exon = tuple([transcr.exons[0][0], transcr.exons[0][1]])
-        if exon not in self.exons[transcr.chrom][strand]:
-            self.exons[transcr.chrom][strand][exon] = 0b0
-        self.exons[transcr.chrom][strand][exon] |= 0b10
-        self.exons[transcr.chrom][strand][exon] |= 0b100
+        self.exons[transcr.chrom][strand].set_bits(exon, 0b110)
         if result.ccode == ("_",):
             self.monoexonic_matches[0].add(result.ref_id)
             self.monoexonic_matches[1].add(transcr.id)
@@ -700,12 +668,8 @@ class Accountant:
 
             assert other_exon in self.exons[transcr.chrom][strand]
 
-            if not 0b100 & self.exons[transcr.chrom][strand][other_exon]:
-                # Check the other exon is marked as single
-                self.exons[transcr.chrom][strand][other_exon] |= 0b100
-
-            # self.exons[transcr.chrom][strand][exon] |= 0b100000
-            self.exons[transcr.chrom][strand][other_exon] |= 0b100000
+            # Mark the other exon as single, with a lenient match
+            self.exons[transcr.chrom][strand].set_bits(other_exon, 0b100100)
 
     def store(self, transcr: Transcript, result: ResultStorer, other_exon):
 
@@ -722,10 +686,7 @@ class Accountant:
         """
 
         for parent in transcr.parent:
-            if parent not in self.pred_genes:
-                self.pred_genes[parent] = dict()
-            if transcr.id not in self.pred_genes[parent]:
-                self.pred_genes[parent][transcr.id] = 0b1000
+            self.pred_genes.intern((parent, transcr.id))
 
         if transcr.strand is None:
             strand = "+"
@@ -736,45 +697,35 @@ class Accountant:
             found_one = False
 
             for refid, refgene, nf1 in zip(result.ref_id, result.ref_gene, result.n_f1):
-                if refgene not in self.ref_genes:
-                    self.ref_genes[refgene] = dict()
-                if refid not in self.ref_genes[refgene]:
-                    self.ref_genes[refgene][refid] = 0b1000
+                self.ref_genes.intern((refgene, refid))
 
                 if nf1 > 0:
-                    self.ref_genes[refgene][refid] &= ~(1 << 3)  # Clear the fourth bit
+                    self.ref_genes.clear_bits((refgene, refid), 0b1000)  # Clear the fourth bit
                     found_one = True
             if found_one:
                 for parent in transcr.parent:
-                    self.pred_genes[parent][transcr.id] &= ~(1 << 3)  # Clear the fourth bit
+                    self.pred_genes.clear_bits((parent, transcr.id), 0b1000)  # Clear the fourth bit
 
             if len(result.j_f1) == 1:
                 zipper = zip(result.ref_id, result.ref_gene, result.j_f1, result.n_f1)
                 for refid, refgene, junc_f1, nucl_f1 in zipper:
                     if junc_f1 == 100 and nucl_f1 >= 80:
+                        bits = 0b100
+                        if nucl_f1 >= 95:
+                            bits |= 0b10
+                        if nucl_f1 == 100:
+                            bits |= 0b01
                         for parent in transcr.parent:
-                            self.pred_genes[parent][transcr.id] |= 0b100
-                            if nucl_f1 >= 95:
-                                self.pred_genes[parent][transcr.id] |= 0b10
-                            if nucl_f1 == 100:
-                                self.pred_genes[parent][transcr.id] |= 0b01
+                            self.pred_genes.set_bits((parent, transcr.id), bits)
                         # Unset the "private" mark
 
-                        self.ref_genes[refgene][refid] |= 0b100
-                        if nucl_f1 >= 95:
-                            self.ref_genes[refgene][refid] |= 0b10
-                        if nucl_f1 == 100:
-                            self.ref_genes[refgene][refid] |= 0b01
+                        self.ref_genes.set_bits((refgene, refid), bits)
         else:
             for parent in transcr.parent:
-                self.pred_genes[parent][transcr.id] &= 0b1000
+                self.pred_genes.clear_bits((parent, transcr.id), 0b0111)
 
         if transcr.chrom not in self.exons:
-            self.exons[transcr.chrom] = dict([("+", dict()), ("-", dict())])
-            self.starts[transcr.chrom] = dict([("+", dict()), ("-", dict())])
-            self.ends[transcr.chrom] = dict([("+", dict()), ("-", dict())])
-            self.introns[transcr.chrom] = dict([("+", dict()), ("-", dict())])
-            self.intron_chains[transcr.chrom] = dict([("+", dict()), ("-", dict())])
+            self.__add_chrom(transcr.chrom)
 
         if transcr.exon_num > 1:
             self.__store_multiexonic_result(transcr, strand)
@@ -995,8 +946,8 @@ class Accountant:
                 gene_transcript_results["ref"]["total"]))
 
         # Gene level
-        ref_genes = len(self.ref_genes)
-        pred_genes = len(self.pred_genes)
+        ref_genes = self.ref_genes.gene_num
+        pred_genes = self.pred_genes.gene_num
         # noinspection PyTypeChecker
         (gene_precision_stringent, gene_recall_stringent, gene_f1_stringent) = (
             self.__redundant_stats(
@@ -1028,9 +979,9 @@ class Accountant:
             # noinspection PyUnresolvedReferences
             print("Command line:\n{0:>10}".format(self.args.commandline), file=out)
             print(gene_transcript_results["ref"]["total"], "reference RNAs in",
-                  len(self.ref_genes), "genes", file=out)
+                  self.ref_genes.gene_num, "genes", file=out)
             print(gene_transcript_results["pred"]["total"], "predicted RNAs in ",
-                  len(self.pred_genes), "genes", file=out)
+                  self.pred_genes.gene_num, "genes", file=out)
 
             print("-" * 33, "|   Sn |   Pr |   F1 |", file=out)
             print("{0} {1:.2f}  {2:.2f}  {3:.2f}".format(
@@ -1170,12 +1121,12 @@ class Accountant:
             # noinspection PyTypeChecker
             print(self.__format_comparison_line("Missed genes (0% nF1)",
                                                 gene_transcript_results["ref"]["private"][1],
-                                                len(self.ref_genes)), file=out)
+                                                self.ref_genes.gene_num), file=out)
 
             # noinspection PyTypeChecker
             print(self.__format_comparison_line("Novel genes (0% nF1)",
                                                 gene_transcript_results["pred"]["private"][1],
-                                                len(self.pred_genes)), file=out)
+                                                self.pred_genes.gene_num), file=out)
 
         self.logger.removeHandler(self.queue_handler)
         # self.queue_handler.close()
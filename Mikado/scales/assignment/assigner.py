@@ -17,13 +17,15 @@ from functools import partial
 from logging import handlers as log_handlers
 from ...transcripts.transcript import Transcript, Namespace
 from ..accountant import Accountant
-from ..contrast import compare as c_compare
+from ..contrast import compare as c_compare, compare_many as c_compare_many
 from ..resultstorer import ResultStorer
 from ...exceptions import InvalidTranscript, InvalidCDS
 from ...utilities import IntervalTree
 import msgpack
 import tempfile
 from ..reference_preparation.gene_dict import GeneDict
+from ..reference_preparation.reference_model import ReferenceModel
+from ..reference_preparation.binary_index import BinaryIndex, open_index
 
 
 # noinspection PyPropertyAccess,PyPropertyAccess
@@ -64,13 +66,18 @@ class Assigner:
     among the reference transcripts.
     """
 
+    # Size (in bps) of the windows of reference genes retrieved at once from the index
+    prefetch_window = 1000000
+
     def __init__(self,
                  index: str,
                  args: argparse.Namespace,
                  results=(),
                  printout_tmap=True,
                  fuzzymatch=0,
-                 counter=None):
+                 counter=None,
+                 model=None,
+                 reference=None):
 
         """
 
@@ -89,6 +96,14 @@ class Assigner:
 
         :param printout_tmap: boolean value. If set to True, the object will print each row.
         :type printout_tmap: bool
+
+        :param model: optional reference model (see reference_preparation.reference_model) of the index.
+        If provided, the reference is read from it rather than from the SQLite index.
+        :type model: (None|str)
+
+        :param reference: optional Assigner for the same index, whose reference genes and positions will be
+        shared rather than loaded again (eg when comparing multiple predictions against the same reference).
+        :type reference: (None|Assigner)
         """
 
         if args is None:
@@ -147,11 +162,25 @@ class Assigner:
 
         self.logger.propagate = True
         self.dbname = index
-        self.genes = GeneDict(self.dbname, logger=self.logger,
-                              exclude_utr=self.args.exclude_utr, protein_coding=self.args.protein_coding)
-        self.positions = collections.defaultdict(dict)
-        self.indexer = collections.defaultdict(list)
-        self._load_positions()
+        cache_size = getattr(self.args, "gene_cache_size", None)
+        if reference is not None:
+            self.genes = reference.genes
+        elif model is not None:
+            self.genes = ReferenceModel(model, logger=self.logger, cache_size=cache_size)
+        else:
+            self.genes = open_index(self.dbname, logger=self.logger, cache_size=cache_size,
+                                    exclude_utr=self.args.exclude_utr, protein_coding=self.args.protein_coding)
+        self.__prefetched = (None, 0, 0)
+        self.__last_position = (None, 0)
+        self.__visited_chroms = set()
+        self.__prefetch_sorted = True
+        self.__refmap_tuple = None
+        if reference is not None:
+            self.positions, self.indexer = reference.positions, reference.indexer
+        else:
+            self.positions = collections.defaultdict(dict)
+            self.indexer = collections.defaultdict(list)
+            self._load_positions()
         self.printout_tmap = printout_tmap
         self.__done = 0
         # noinspection PyUnresolvedReferences
@@ -166,14 +195,13 @@ class Assigner:
         self.gene_matches = collections.defaultdict(dict)
         self.done = 0
 
-        if self.printout_tmap is True:
-            for gid in self.genes:
-                for tid in self.genes[gid].transcripts:
-                    self.gene_matches[gid][tid] = []
-
         self.stat_calculator = Accountant(self.genes, args=args,
                                           fuzzymatch=self.__fuzzymatch, counter=counter,
                                           load_ref=self.printout_tmap)
+        if self.printout_tmap is True:
+            # The reference transcripts have just been loaded by the accountant; no need to go through the genes again
+            for gid, tid in self.stat_calculator.ref_genes:
+                self.gene_matches[gid][tid] = []
         self.self_analysis = self.stat_calculator.self_analysis
         self.__merged = False
 
@@ -194,6 +222,53 @@ class Assigner:
         for chrom in self.positions:
             self.indexer[chrom] = IntervalTree.from_tuples(self.positions[chrom].keys())
 
+    def _prefetch(self, prediction: Transcript):
+        """Method to retrieve from the index, with a single query, the reference genes in a window
+        of the genome starting at the prediction.
+        With sorted predictions, this avoids querying the index for each gene separately. The window is
+        not moved if the prediction is inside it, or if all the genes it needs are already loaded; and
+        prefetching stops altogether as soon as the predictions are found not to be sorted, as each
+        new window would throw away genes which are likely to be needed again.
+        It is called before looking for the neighbours of each prediction."""
+
+        if not isinstance(self.genes, GeneDict) or self.__prefetch_sorted is False:
+            return
+        # noinspection PyUnresolvedReferences
+        distance = self.args.distance
+        lower, upper = max(0, prediction.start - distance), prediction.end + distance
+        last_chrom, last_start = self.__last_position
+        if prediction.chrom == last_chrom:
+            if prediction.start < last_start:
+                self.__prefetch_sorted = False
+                return
+        elif prediction.chrom in self.__visited_chroms:
+            self.__prefetch_sorted = False
+            return
+        self.__last_position = (prediction.chrom, prediction.start)
+        self.__visited_chroms.add(prediction.chrom)
+
+        chrom, start, end = self.__prefetched
+        if chrom == prediction.chrom and start <= lower and upper <= end:
+            return
+        elif prediction.chrom in self.indexer:
+            neighbours = self.find_neighbours(self.indexer[prediction.chrom], (prediction.start, prediction.end),
+                                              distance=distance)
+            if all(self.genes.is_loaded(gid) for key, _ in neighbours
+                   for gid in self.positions[prediction.chrom][key]):
+                return
+        else:
+            return
+        end = max(lower + self.prefetch_window, upper)
+        self.genes.prefetch(prediction.chrom, lower, end)
+        self.__prefetched = (prediction.chrom, lower, end)
+
+    def _reference_location(self, gid, tid):
+        """Method to retrieve the location of a reference transcript, for the RefMap."""
+
+        if isinstance(self.genes, (ReferenceModel, BinaryIndex)):
+            return self.genes.location(gid, tid)
+        return self.genes[gid][tid].location
+
     def load_result(self, refmap, stats):
 
         gene_matches = msgpack.loads(refmap,
@@ -374,7 +449,7 @@ class Assigner:
                                          match_to_gene[match[0]]):
                 strands[gene_match.strand].add(gene)
                 new_matches[gene] = sorted(
-                    [self.calc_and_store_compare(prediction, tra, fuzzymatch=fuzzymatch) for tra in gene_match],
+                    self.calc_and_store_compare_many(prediction, gene_match, fuzzymatch=fuzzymatch),
                     key=self.get_f1, reverse=True)
 
         # If we have candidates for the fusion which are on its same strand
@@ -505,16 +580,15 @@ class Assigner:
             results = []
             for match in matches:
                 self.logger.debug("%s: type %s", repr(match), type(match))
-                for tra in match:
-                    try:
-                        results.append(self.calc_and_store_compare(prediction, tra, fuzzymatch=fuzzymatch))
-                    except TypeError:
-                        failed = []
-                        for intron in prediction.introns:
-                            if not (isinstance(intron[0], int) and isinstance(intron[1], int)):
-                                failed.append(intron)
+                try:
+                    results.extend(self.calc_and_store_compare_many(prediction, match, fuzzymatch=fuzzymatch))
+                except TypeError:
+                    failed = []
+                    for intron in prediction.introns:
+                        if not (isinstance(intron[0], int) and isinstance(intron[1], int)):
+                            failed.append(intron)
 
-                        raise TypeError((failed, type(prediction), prediction.introns))
+                    raise TypeError((failed, type(prediction), prediction.introns))
 
             results = sorted(results, reverse=True,
                              key=self.get_f1)
@@ -560,8 +634,7 @@ class Assigner:
             self.stat_calculator.store(prediction, best_result, None)
             results = [best_result]
         elif genes[0][1] > 0:  # Up or downstream
-            results = [self.calc_and_store_compare(prediction, reference, fuzzymatch=fuzzymatch)
-                       for reference in genes[0][0]]
+            results = self.calc_and_store_compare_many(prediction, genes[0][0], fuzzymatch=fuzzymatch)
             best_result = sorted(results,
                                  key=operator.attrgetter("distance"))[0]
         else:
@@ -575,8 +648,9 @@ class Assigner:
                     same_strand = True
 
             if len(genes) == 1:
-                results = [self.calc_and_store_compare(prediction, reference, fuzzymatch=fuzzymatch)
-                           for reference in genes[0] if reference.id != prediction.id]
+                results = self.calc_and_store_compare_many(
+                    prediction, [reference for reference in genes[0] if reference.id != prediction.id],
+                    fuzzymatch=fuzzymatch)
                 assert len(results) > 0, (genes[0].transcripts.keys(), prediction.id)
                 best_result = sorted(results,
                                      key=operator.attrgetter("distance"))[0]
@@ -594,8 +668,9 @@ class Assigner:
                                     gene.id, __gene_removed))
 
                     result_dict[gene.id] = sorted(
-                        [self.calc_and_store_compare(prediction, reference, fuzzymatch=fuzzymatch)
-                         for reference in gene if reference.id != prediction.id],
+                        self.calc_and_store_compare_many(
+                            prediction, [reference for reference in gene if reference.id != prediction.id],
+                            fuzzymatch=fuzzymatch),
                         key=self.get_f1,
                         reverse=True)
                     if len(result_dict[gene.id]) == 0:
@@ -688,6 +763,7 @@ class Assigner:
             self.print_tmap(None)
             return None
 
+        self._prefetch(prediction)
         if prediction.chrom in self.indexer:
             keys = self.indexer[prediction.chrom]
         else:
@@ -720,7 +796,7 @@ class Assigner:
             elif distances[0][1] > 0:
                 # Polymerase run-on
                 match = self.genes[self.positions[prediction.chrom][distances[0][0]][0]]
-                results = [self.calc_and_store_compare(prediction, reference) for reference in match]
+                results = self.calc_and_store_compare_many(prediction, match)
                 best_result = sorted(results, key=operator.attrgetter("distance"))[0]
             else:
                 # All other cases
@@ -767,6 +843,8 @@ class Assigner:
         self.logger.info("Finished printing final stats")
         self.tmap_out.close()
         self.logger.info("Closed output files")
+        # The logger is shared by all the assigners of the process; do not leave our handler attached to it
+        self.logger.removeHandler(self.queue_handler)
 
     def calc_and_store_compare(self, prediction: Transcript, reference: Transcript, fuzzymatch=0) -> ResultStorer:
         """Thin layer around the calc_and_store_compare class method.
@@ -787,6 +865,27 @@ class Assigner:
 
         return result
 
+    def calc_and_store_compare_many(self, prediction: Transcript, references, fuzzymatch=0) -> list:
+        """Batch version of calc_and_store_compare, which compares the prediction against all the
+        references (eg the transcripts of a reference gene) with a single call to the comparison kernel.
+
+        :param prediction: a Transcript instance.
+
+        :param references: the Transcript instances to which the prediction is compared to.
+
+        :rtype list[ResultStorer]
+        """
+
+        results = []
+        references = list(references)
+        for reference, (result, reference_exon) in zip(references, c_compare_many(
+                prediction, references, lenient=self.lenient, fuzzymatch=fuzzymatch)):
+            assert reference_exon is None or reference_exon in reference.exons
+            self.stat_calculator.store(prediction, result, reference_exon)
+            results.append(result)
+
+        return results
+
     @staticmethod
     def compare(prediction: Transcript,
                 reference: Transcript,
@@ -872,6 +971,145 @@ class Assigner:
 
         return orderer
 
+    @property
+    def _refmap_tuple(self):
+        """The namedtuple for the rows of the RefMap; its fields depend on whether the RefMap is extended."""
+
+        # noinspection PyUnresolvedReferences
+        if self.args.extended_refmap is True:
+            fields = ["ref_id", "ccode", "tid", "gid",
+                      "nRecall", "nPrecision", "nF1",
+                      "jRecall", "jPrecision", "jF1",
+                      "eRecall", "ePrecision", "eF1",
+                      "ref_gene",
+                      "best_ccode", "best_tid", "best_gid",
+                      "best_nRecall", "best_nPrecision", "best_nF1",
+                      "best_jRecall", "best_jPrecision", "best_jF1",
+                      "best_eRecall", "best_ePrecision", "best_eF1",
+                      "location"]
+        else:
+            fields = ["ref_id", "ccode", "tid", "gid",
+                      "nF1", "jF1", "eF1",
+                      "ref_gene",
+                      "best_ccode", "best_tid", "best_gid",
+                      "best_nF1", "best_jF1", "best_eF1",
+                      "location"]
+        if self.__refmap_tuple is None or self.__refmap_tuple._fields != tuple(fields):
+            self.__refmap_tuple = namedtuple("refmap", fields)
+        return self.__refmap_tuple
+
+    def _refmap_rows(self, gid) -> list:
+        """Method to calculate the RefMap rows of a reference gene, ie the best match for each of its
+        transcripts and for the gene as a whole.
+        :param gid: the ID of the reference gene.
+        :rtype: list
+        """
+
+        out_tuple = self._refmap_tuple
+        rows = []
+        best_picks = []
+        assert len(self.gene_matches[gid].keys()) > 0
+        for tid in sorted(self.gene_matches[gid].keys()):
+            if len(self.gene_matches[gid][tid]) == 0:
+                # First part of the tuple
+                row = tuple([tid, gid] + ["NA"] * 7)
+            else:
+                # Choose the best hit for the transcript
+                if any((x.j_f1[0] > 0 or x.n_f1[0] > 0) for x in self.gene_matches[gid][tid]):
+                        best = sorted(self.gene_matches[gid][tid],
+                                      key=self.result_sorter, reverse=True)[0]
+                else:
+                    best = sorted(self.gene_matches[gid][tid],
+                                  key=operator.attrgetter("distance"),
+                                  reverse=False)[0]
+                best_picks.append(best)
+                # Store the result for the transcript
+                if self.args.extended_refmap is True:
+                    row = tuple([tid, gid, ",".join(best.ccode),
+                                 best.tid, best.gid,
+                                 best.n_recall[0], best.n_prec[0], best.n_f1[0],
+                                 best.j_recall[0], best.j_prec[0], best.j_f1[0],
+                                 best.e_recall[0], best.e_prec[0], best.e_f1[0],
+                                 best.location])
+                else:
+                    row = tuple([tid, gid, ",".join(best.ccode),
+                                 best.tid, best.gid,
+                                 best.n_f1[0], best.j_f1[0], best.e_f1[0],
+                                 best.location])
+
+            rows.append(row)
+
+        if len(best_picks) > 0:
+            best_pick = sorted(best_picks,
+                               key=self.result_sorter,
+                               reverse=True)[0]
+        else:
+            best_pick = None
+
+        final_rows = []
+        for row in rows:
+            if best_pick is not None:
+                if self.self_analysis is False:
+                    assert row[2] != "NA", row
+                if self.args.extended_refmap is True:
+                    row = out_tuple(row[0],  # Ref TID
+                                    row[2],  # class code
+                                    row[3],  # Pred TID
+                                    row[4],  # Pred GID
+                                    row[5], row[6], row[7],  # N
+                                    row[8], row[9], row[10], #J
+                                    row[11], row[12], row[13], #E
+                                    row[1],
+                                    ",".join(best_pick.ccode),
+                                    best_pick.tid,
+                                    best_pick.gid,
+                                    best_pick.n_recall[0], best_pick.n_prec[0], best_pick.n_f1[0],
+                                    best_pick.j_recall[0], best_pick.j_prec[0], best_pick.j_f1[0],
+                                    best_pick.e_recall[0], best_pick.e_prec[0], best_pick.e_f1[0],
+                                    row[14]  #Location
+                                    )
+                else:
+                    # fields = ["ref_id", "ccode", "tid", "gid",
+                    #                           "nF1", "jF1", "eF1",
+                    #                           "ref_gene",
+                    #                           "best_ccode", "best_tid", "best_gid",
+                    #                           "best_nF1", "best_jF1", "best_eF1",
+                    #                           "location"]
+                    try:
+                        row = out_tuple(ref_id=row[0],  # Ref TID
+                                        ccode=row[2],  # class code
+                                        tid=row[3],  # Pred TID
+                                        gid=row[4],  # Pred GID
+                                        nF1=row[5], jF1=row[6], eF1=row[7],  # Pred F1
+                                        ref_gene=row[1],
+                                        best_ccode=",".join(best_pick.ccode),
+                                        best_tid=best_pick.tid,
+                                        best_gid=best_pick.gid,
+                                        best_nF1=best_pick.n_f1[0],
+                                        best_jF1=best_pick.j_f1[0],
+                                        best_eF1=best_pick.e_f1[0],
+                                        location=row[8]  # Location
+                                        )
+                    except IndexError:
+                        self.logger.critical("Error in creating the refmap output")
+                        self.logger.critical(row)
+                        raise
+            else:
+                if self.args.extended_refmap is True:
+                    row = out_tuple(*[row[0]] + ["NA"] * 12 + [row[1]] + ["NA"] * 12 + [
+                        self._reference_location(gid, row[0])])
+                else:
+                    row = out_tuple(*[row[0]] + ["NA"] * 6 + [row[1]] + ["NA"] * 6 + [
+                        self._reference_location(gid, row[0])])
+            final_rows.append(row)
+        return final_rows
+
+    def _refmap(self):
+        """Method to iterate over the rows of the RefMap, sorted by reference gene."""
+
+        for gid in sorted(self.gene_matches.keys()):
+            yield from self._refmap_rows(gid)
+
     def print_refmap(self) -> None:
 
         """Function to print out the best match for each gene."""
@@ -883,126 +1121,10 @@ class Assigner:
             opening_function = partial(gzip.open, "{0}.refmap.gz".format(self.args.out), 'wt')
 
         with opening_function() as out:
-            if self.args.extended_refmap is True:
-                fields = ["ref_id", "ccode", "tid", "gid",
-                          "nRecall", "nPrecision", "nF1",
-                          "jRecall", "jPrecision", "jF1",
-                          "eRecall", "ePrecision", "eF1",
-                          "ref_gene",
-                          "best_ccode", "best_tid", "best_gid",
-                          "best_nRecall", "best_nPrecision", "best_nF1",
-                          "best_jRecall", "best_jPrecision", "best_jF1",
-                          "best_eRecall", "best_ePrecision", "best_eF1",
-                          "location"]
-            else:
-                fields = ["ref_id", "ccode", "tid", "gid",
-                          "nF1", "jF1", "eF1",
-                          "ref_gene",
-                          "best_ccode", "best_tid", "best_gid",
-                          "best_nF1", "best_jF1", "best_eF1",
-                          "location"]
-            out_tuple = namedtuple("refmap", fields)
-
-            rower = csv.DictWriter(out, fields, delimiter="\t")
+            rower = csv.DictWriter(out, self._refmap_tuple._fields, delimiter="\t")
             rower.writeheader()
-
-            for gid in sorted(self.gene_matches.keys()):
-
-                rows = []
-                best_picks = []
-                assert len(self.gene_matches[gid].keys()) > 0
-                for tid in sorted(self.gene_matches[gid].keys()):
-                    if len(self.gene_matches[gid][tid]) == 0:
-                        # First part of the tuple
-                        row = tuple([tid, gid] + ["NA"] * 7)
-                    else:
-                        # Choose the best hit for the transcript
-                        if any((x.j_f1[0] > 0 or x.n_f1[0] > 0) for x in self.gene_matches[gid][tid]):
-                                best = sorted(self.gene_matches[gid][tid],
-                                              key=self.result_sorter, reverse=True)[0]
-                        else:
-                            best = sorted(self.gene_matches[gid][tid],
-                                          key=operator.attrgetter("distance"),
-                                          reverse=False)[0]
-                        best_picks.append(best)
-                        # Store the result for the transcript
-                        if self.args.extended_refmap is True:
-                            row = tuple([tid, gid, ",".join(best.ccode),
-                                         best.tid, best.gid,
-                                         best.n_recall[0], best.n_prec[0], best.n_f1[0],
-                                         best.j_recall[0], best.j_prec[0], best.j_f1[0],
-                                         best.e_recall[0], best.e_prec[0], best.e_f1[0],
-                                         best.location])
-                        else:
-                            row = tuple([tid, gid, ",".join(best.ccode),
-                                         best.tid, best.gid,
-                                         best.n_f1[0], best.j_f1[0], best.e_f1[0],
-                                         best.location])
-
-                    rows.append(row)
-
-                if len(best_picks) > 0:
-                    best_pick = sorted(best_picks,
-                                       key=self.result_sorter,
-                                       reverse=True)[0]
-                else:
-                    best_pick = None
-
-                for row in rows:
-                    if best_pick is not None:
-                        if self.self_analysis is False:
-                            assert row[2] != "NA", row
-                        if self.args.extended_refmap is True:
-                            row = out_tuple(row[0],  # Ref TID
-                                            row[2],  # class code
-                                            row[3],  # Pred TID
-                                            row[4],  # Pred GID
-                                            row[5], row[6], row[7],  # N
-                                            row[8], row[9], row[10], #J
-                                            row[11], row[12], row[13], #E
-                                            row[1],
-                                            ",".join(best_pick.ccode),
-                                            best_pick.tid,
-                                            best_pick.gid,
-                                            best_pick.n_recall[0], best_pick.n_prec[0], best_pick.n_f1[0],
-                                            best_pick.j_recall[0], best_pick.j_prec[0], best_pick.j_f1[0],
-                                            best_pick.e_recall[0], best_pick.e_prec[0], best_pick.e_f1[0],
-                                            row[14]  #Location
-                                            )
-                        else:
-                            # fields = ["ref_id", "ccode", "tid", "gid",
-                            #                           "nF1", "jF1", "eF1",
-                            #                           "ref_gene",
-                            #                           "best_ccode", "best_tid", "best_gid",
-                            #                           "best_nF1", "best_jF1", "best_eF1",
-                            #                           "location"]
-                            try:
-                                row = out_tuple(ref_id=row[0],  # Ref TID
-                                                ccode=row[2],  # class code
-                                                tid=row[3],  # Pred TID
-                                                gid=row[4],  # Pred GID
-                                                nF1=row[5], jF1=row[6], eF1=row[7],  # Pred F1
-                                                ref_gene=row[1],
-                                                best_ccode=",".join(best_pick.ccode),
-                                                best_tid=best_pick.tid,
-                                                best_gid=best_pick.gid,
-                                                best_nF1=best_pick.n_f1[0],
-                                                best_jF1=best_pick.j_f1[0],
-                                                best_eF1=best_pick.e_f1[0],
-                                                location=row[8]  # Location
-                                                )
-                            except IndexError:
-                                self.logger.critical("Error in creating the refmap output")
-                                self.logger.critical(row)
-                                raise
-                    else:
-                        if self.args.extended_refmap is True:
-                            row = out_tuple(*[row[0]] + ["NA"] * 12 + [row[1]] + ["NA"] * 12 + [
-                                self.genes[gid][row[0]].location])
-                        else:
-                            row = out_tuple(*[row[0]] + ["NA"] * 6 + [row[1]] + ["NA"] * 6 + [
-                                self.genes[gid][row[0]].location])
-                    # noinspection PyProtectedMember,PyProtectedMember
-                    rower.writerow(row._asdict())
+            for row in self._refmap():
+                # noinspection PyProtectedMember,PyProtectedMember
+                rower.writerow(row._asdict())
         self.logger.info("Finished printing RefMap")
         return None
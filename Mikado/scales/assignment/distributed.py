@@ -1,4 +1,7 @@
+import copy
+import logging
 import multiprocessing as mp
+from logging import handlers as log_handlers
 from ...utilities.namespace import Namespace
 from .assigner import Assigner
 from ...transcripts import Transcript
@@ -15,7 +18,7 @@ def encode_result(obj):
 
 class Assigners(mp.Process):
 
-    def __init__(self, index, args: Namespace, queue, returnqueue, log_queue, counter):
+    def __init__(self, index, args: Namespace, queue, returnqueue, log_queue, counter, model=None):
         super().__init__()
         # self.accountant_instance = Accountant(genes, args, counter=counter)
         if hasattr(args, "fuzzymatch"):
@@ -24,6 +27,7 @@ class Assigners(mp.Process):
             self.__fuzzymatch = 0
         self.__counter = counter
         self._index = index
+        self._model = model
         self.queue = queue
         self.returnqueue = returnqueue
         self._args = args
@@ -34,41 +38,85 @@ class Assigners(mp.Process):
         self.assigner_instance = Assigner(self._index, self._args,
                                           printout_tmap=False,
                                           counter=self.__counter,
-                                          fuzzymatch=self.__fuzzymatch)
-        results = []
+                                          fuzzymatch=self.__fuzzymatch,
+                                          model=self._model)
+        self._results = []
         while True:
-            transcripts = self.queue.get()
-            if transcripts == "EXIT":
-                self.queue.put("EXIT")
+            job = self.queue.get()
+            if job == "EXIT":
                 self.queue.task_done()
-                result = msgpack.dumps([res.as_dict() for res in results], strict_types=True)
+                result = msgpack.dumps([res.as_dict() for res in self._results], strict_types=True)
                 self.returnqueue.put(("tmap", result))
                 refmap, stats = self.assigner_instance.dump()
                 self.returnqueue.put(("refmap", refmap, stats))
                 self.returnqueue.put("EXIT")
                 break
             else:
-                dumped = msgpack.loads(transcripts)
-                for dump in dumped:
-                    transcr = Transcript()
-                    transcr.load_dict(dump, trust_orf=True, accept_undefined_multi=True)
-                    result = self.assigner_instance.get_best(transcr)
-                    if isinstance(result, ResultStorer):
-                        result = [result]
-                    results.extend(result)
-                    if len(results) >= 1000:
-                        result = msgpack.dumps([res.as_dict() for res in results], strict_types=True)
-                        self.returnqueue.put(("tmap", result))
-                        results = []
+                self._analyse(job)
                 self.queue.task_done()
 
+    def _get_best(self, transcript: Transcript):
+        """Method to compare a transcript against the reference, sending the results back in batches."""
+        result = self.assigner_instance.get_best(transcript)
+        if isinstance(result, ResultStorer):
+            result = [result]
+        self._results.extend(result)
+        if len(self._results) >= 1000:
+            result = msgpack.dumps([res.as_dict() for res in self._results], strict_types=True)
+            self.returnqueue.put(("tmap", result))
+            self._results = []
+
+    def _analyse(self, transcripts):
+        """Method to analyse a batch of transcripts, serialised by send_transcripts."""
+        if isinstance(transcripts, tuple):
+            # Batches are sent by region; the genes already decoded are kept, within the limits of the gene cache
+            transcripts = transcripts[1]
+        dumped = msgpack.loads(transcripts)
+        for dump in dumped:
+            transcr = Transcript()
+            transcr.load_dict(dump, trust_orf=True, accept_undefined_multi=True)
+            self._get_best(transcr)
+
+
+class ShardAssigners(Assigners):
+
+    """Process used when the workers parse the prediction on their own (see sharding.find_shards). Rather than
+    batches of serialised transcripts, each job is a shard of the prediction file, containing all the transcripts
+    of a chromosome; the worker parses it with the same function used for the whole file and compares the
+    transcripts as they come, so that each transcript is parsed and finalised only once."""
+
+    def _analyse(self, shard):
+        from ..prediction_parsers import get_annotator
+        from ..prediction_parsers.sharding import open_shard
+        from ..prediction_parsers.transmission import orf_pattern
+        chrom, start, end = shard
+        prediction = open_shard(self._args.prediction, start, end)
+        args = copy.copy(self._args)
+        args.prediction = prediction
+        found_with_orf = set()
+        done = 0
+        for transcript in get_annotator(prediction)(args, self.assigner_instance.logger):
+            if transcript is None:
+                continue
+            elif orf_pattern.search(transcript.id):
+                # As in transmit_transcript, only the first ORF of each transcript is considered
+                name = orf_pattern.sub("", transcript.id)
+                if name in found_with_orf:
+                    continue
+                found_with_orf.add(name)
+            done += 1
+            self._get_best(transcript)
+        prediction.close()
+        self.assigner_instance.logger.debug("Parsed %s transcripts on %s", done, chrom)
+
 
 class FinalAssigner(mp.Process):
 
-    def __init__(self, index: str, args: Namespace, queue, log_queue, nprocs):
+    def __init__(self, index: str, args: Namespace, queue, log_queue, nprocs, model=None):
 
         super().__init__()
         self.index = index
+        self.model = model
         self.queue = queue
         # failed = set()
         self.args = args
@@ -80,7 +128,7 @@ class FinalAssigner(mp.Process):
             self.args.__dict__["log_queue"] = self.log_queue
         except AttributeError:
             raise AttributeError(self.args)
-        self.assigner = Assigner(self.index, self.args, printout_tmap=True)
+        self.assigner = Assigner(self.index, self.args, printout_tmap=True, model=self.model)
         finished_children = 0
         while finished_children < self.nprocs:
             tmap_row = self.queue.get()
@@ -100,3 +148,37 @@ class FinalAssigner(mp.Process):
         self.assigner.finish()
         self.assigner.logger.info("Finished everything, shutting down")
         return
+
+
+class PredictionAssigners(mp.Process):
+
+    """Process used when comparing multiple predictions against the same reference. Each process receives whole
+    predictions (as file name and output prefix) and compares them one after the other, loading the positions
+    of the reference genes only once."""
+
+    def __init__(self, index: str, args: Namespace, queue, log_queue, counter, model=None):
+
+        super().__init__()
+        self.index = index
+        self.model = model
+        self.queue = queue
+        self.args = args
+        self.log_queue = log_queue
+        self.__counter = counter
+
+    def __jobs(self):
+        while True:
+            job = self.queue.get()
+            self.queue.task_done()
+            if job == "EXIT":
+                break
+            yield job
+
+    def run(self):
+        from ..prediction_parsers import compare_predictions
+        self.args.__dict__["log_queue"] = self.log_queue
+        logger = logging.getLogger("PredictionAssigners-{}".format(self.__counter))
+        logger.addHandler(log_handlers.QueueHandler(self.log_queue))
+        logger.setLevel(logging.DEBUG if self.args.verbose else logging.INFO)
+        logger.propagate = False
+        compare_predictions(self.args, self.index, self.__jobs(), logger, model=self.model)
@@ -0,0 +1,165 @@
+# coding: utf-8
+
+"""
+This module contains the assigner used by mikado compare when the predictions are sorted by coordinates.
+Rather than indexing the whole reference, it holds in memory only a sliding window of reference genes,
+read from the index in coordinate order together with the predictions.
+"""
+
+import argparse
+import sqlite3
+from ...transcripts.transcript import Transcript
+from ...utilities import IntervalTree
+from ..reference_preparation.gene_dict import load_gene
+from ..reference_preparation.reference_model import ReferenceModel
+from ..reference_preparation.binary_index import BinaryIndex
+from .assigner import Assigner
+
+
+__author__ = 'Luca Venturini'
+
+
+class SweepAssigner(Assigner):
+
+    """
+    Assigner for predictions sorted by coordinates (ie grouped by chromosome, and sorted by start within
+    each chromosome). The reference genes are read from the index in the same order, and kept in a window
+    which extends up to args.distance on either side of the current prediction. Once a gene falls behind
+    the window it cannot be reached by any later prediction, so it is retired: its RefMap rows are
+    calculated and its matches and decoded transcripts are dropped.
+    """
+
+    def __init__(self,
+                 index: str,
+                 args: argparse.Namespace,
+                 printout_tmap=True,
+                 fuzzymatch=0,
+                 counter=None,
+                 model=None):
+
+        """
+        :param index: the SQLite index of the reference.
+        :param args: the parameters passed through the command line.
+        :param printout_tmap: boolean value. If set to True, the object will print each row.
+        :param fuzzymatch: leniency in determining whether two introns are related.
+        :param counter: optional number of the assigner, for the logger.
+        :param model: optional reference model of the index. If provided, the Accountant will read the
+        reference transcripts from it rather than decoding all the genes in the index.
+        """
+
+        super().__init__(index, args, printout_tmap=printout_tmap, fuzzymatch=fuzzymatch,
+                         counter=counter, model=model)
+        # From now on, self.genes contains only the genes in the window; the full reference is
+        # still needed for the location of the genes never loaded, in the RefMap.
+        self.__reference = self.genes
+        self.genes = dict()
+        if isinstance(self.__reference, BinaryIndex):
+            # The binary index has the genes of each chromosome already sorted by start
+            self.__connection = None
+        else:
+            self.__connection = sqlite3.connect("file:{}?mode=ro".format(self.dbname), uri=True)
+        self.__chrom = None
+        self.__cursor = None
+        self.__next = None
+        self.__finished_chroms = set()
+        self.__retired_end = None
+        self.__retired = dict()
+
+    def _load_positions(self):
+        """The positions are loaded chromosome by chromosome, as the predictions come in."""
+        return
+
+    def __open_chromosome(self, chrom):
+        """Private method to retire all the genes of the current chromosome, and start reading the
+        genes of the next one from the index."""
+
+        if chrom in self.__finished_chroms:
+            raise ValueError(
+                "The predictions are not sorted by coordinates: chromosome {} is found in two separate blocks. \
+Please sort the predictions, or run mikado compare without --sorted.".format(chrom))
+        if self.__chrom is not None:
+            for key in list(self.positions[self.__chrom].keys()):
+                self.__retire(self.__chrom, key)
+            self.positions.pop(self.__chrom, None)
+            self.indexer.pop(self.__chrom, None)
+            self.__finished_chroms.add(self.__chrom)
+
+        self.__chrom = chrom
+        self.__retired_end = None
+        if self.__connection is None:
+            self.__cursor = self.__reference.iter_chromosome(chrom)
+        else:
+            self.__cursor = self.__connection.execute(
+                " ".join(["SELECT positions.start, positions.end, positions.gid, genes.json FROM positions",
+                          "JOIN genes ON positions.gid = genes.gid WHERE positions.chrom = ?",
+                          "ORDER BY positions.start, positions.rowid"]), (chrom,))
+        self.__next = next(self.__cursor, None)
+
+    def __retire(self, chrom, key):
+        """Private method to remove a position from the window, storing the RefMap rows of its genes."""
+
+        for gid in self.positions[chrom].pop(key):
+            if gid in self.gene_matches:
+                self.__retired[gid] = self._refmap_rows(gid)
+                del self.gene_matches[gid]
+            self.genes.pop(gid, None)
+        if self.__retired_end is None or key[1] > self.__retired_end:
+            self.__retired_end = key[1]
+
+    def _prefetch(self, prediction: Transcript):
+        """Method to move the window of reference genes to the prediction: the genes starting up to
+        args.distance downstream of the prediction are loaded from the index, and those ending more
+        than args.distance upstream of it are retired.
+        A ValueError is raised if the prediction needs any gene which has already been retired."""
+
+        # noinspection PyUnresolvedReferences
+        distance = self.args.distance
+        if prediction.chrom != self.__chrom:
+            self.__open_chromosome(prediction.chrom)
+        elif self.__retired_end is not None and prediction.start - distance <= self.__retired_end:
+            raise ValueError(
+                "The predictions are not sorted by coordinates: {} ({}) is upstream of reference genes already \
+retired. Please sort the predictions, or run mikado compare without --sorted.".format(
+                    prediction.id, prediction.location))
+
+        positions = self.positions[self.__chrom]
+        changed = False
+        while self.__next is not None and self.__next[0] <= prediction.end + distance:
+            start, end, gid, blob = self.__next
+            self.genes[gid] = load_gene(blob, logger=self.logger,
+                                        exclude_utr=self.args.exclude_utr, protein_coding=self.args.protein_coding)
+            positions.setdefault((start, end), []).append(gid)
+            changed = True
+            self.__next = next(self.__cursor, None)
+
+        for key in [key for key in positions if key[1] < prediction.start - distance]:
+            self.__retire(self.__chrom, key)
+            changed = True
+
+        if changed is True:
+            self.indexer[self.__chrom] = IntervalTree.from_tuples(positions.keys())
+
+    def _reference_location(self, gid, tid):
+        """Method to retrieve the location of a reference transcript, for the RefMap. Genes outside
+        the window are looked up in the full reference."""
+
+        if gid in self.genes:
+            return self.genes[gid][tid].location
+        elif isinstance(self.__reference, (ReferenceModel, BinaryIndex)):
+            return self.__reference.location(gid, tid)
+        return self.__reference[gid][tid].location
+
+    def _refmap(self):
+        """Method to iterate over the rows of the RefMap, sorted by reference gene, merging those of the
+        retired genes with those of the genes still in the window or never loaded."""
+
+        for gid in sorted(set(self.__retired.keys()) | set(self.gene_matches.keys())):
+            if gid in self.__retired:
+                yield from self.__retired.pop(gid)
+            else:
+                yield from self._refmap_rows(gid)
+
+    def finish(self):
+        super().finish()
+        if self.__connection is not None:
+            self.__connection.close()
@@ -77,10 +77,13 @@ def _shutdown(args, index_name, logger, handler, queue_logger: logging.Logger, l
     handler.flush()
     handler.close()
     args.reference.close()
-    if hasattr(args.prediction, "close"):
-        args.prediction.close()
+    for prediction in (args.prediction if isinstance(args.prediction, list) else [args.prediction]):
+        if hasattr(prediction, "close"):
+            prediction.close()
     if args.no_save_index is True:
         os.remove(index_name)
+        if os.path.exists("{}.model".format(index_name)):
+            os.remove("{}.model".format(index_name))
     [_.close() for _ in queue_logger.handlers]
     return
 
@@ -97,6 +100,9 @@ def compare(args):
     # multiprocessing.set_start_method(method="spawn", force=True)
     # pylint: enable=no-member
 
+    if isinstance(args.prediction, list) and len(args.prediction) == 1:
+        args.prediction = args.prediction[0]
+
     if isinstance(args.out, str):
         _out_folder = os.path.dirname(args.out)
         if _out_folder:
@@ -128,8 +134,10 @@ def compare(args):
         if hasattr(args, "internal") and args.internal is True:
             # raise NotImplementedError()
             from .prediction_parsers import parse_self
-            from .reference_preparation.gene_dict import GeneDict
-            parse_self(args, GeneDict(index_name), queue_logger)
+            parse_self(args, index_name, queue_logger)
+        elif isinstance(args.prediction, list):
+            from .prediction_parsers import parse_predictions
+            parse_predictions(args, index_name, queue_logger)
         else:
             from .prediction_parsers import parse_prediction
             parse_prediction(args, index_name, queue_logger)
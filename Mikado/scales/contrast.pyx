@@ -234,6 +234,38 @@ cdef str __assign_multiexonic_ccode(prediction, reference, long nucl_overlap, do
     return ccode
 
 
+cdef class _PredictionData:
+
+    """Private class to hold the data of a prediction needed by __compare, so that it is calculated
+    only once when comparing the prediction against multiple references."""
+
+    cdef:
+        list exons, introns
+        set splices
+        object first_exon, last_exon
+        long start, end, exon_num
+        double cdna_length
+        str strand, parent, tid
+
+    def __init__(self, prediction):
+        self.exons = list(prediction.exons)
+        self.introns = list(prediction.introns)
+        self.splices = prediction.splices
+        self.first_exon, self.last_exon = self.exons[0], self.exons[-1]
+        self.start, self.end = prediction.start, prediction.end
+        self.exon_num = prediction.exon_num
+        self.cdna_length = prediction.cdna_length
+        if prediction.strand is None:
+            self.strand = ""
+        else:
+            self.strand = prediction.strand
+        if prediction.parent == [] or prediction.parent is None:
+            self.parent = "NA"
+        else:
+            self.parent = ",".join([str(_) for _ in prediction.parent])
+        self.tid = prediction.id
+
+
 @cython.profile(True)
 @cython.cdivision(True)
 cpdef tuple compare(prediction, reference, bint lenient=False, bint strict_strandedness=False, int fuzzymatch=0):
@@ -286,8 +318,53 @@ cpdef tuple compare(prediction, reference, bint lenient=False, bint strict_stran
     """
 
     prediction.finalize()
-    reference.finalize()
     fuzzymatch = abs(fuzzymatch)
+    return __compare(_PredictionData(prediction), prediction, reference, lenient, strict_strandedness, fuzzymatch)
+
+
+@cython.profile(True)
+cpdef list compare_many(prediction, references, bint lenient=False, bint strict_strandedness=False,
+                        int fuzzymatch=0):
+
+    """Cython function to compare a prediction against multiple reference transcripts in a single call,
+    eg all the isoforms of a reference gene. The data of the prediction (exons, introns, length, parent)
+    is extracted only once, and then reused for each reference.
+
+    :param prediction: the transcript query
+    :type prediction: Transcript
+
+    :param references: the reference transcripts against which we desire to calculate the ccode and other stats.
+    :type references: list[Transcript]
+
+    :param lenient: a boolean flag that indicates whether the exon-level features should be calculated leniently or not.
+    :type lenient: bool
+
+    :returns: a list with, for each reference in order, the same (ResultStorer, reference exon) tuple
+    that would be returned by compare.
+    :rtype list
+    """
+
+    cdef:
+        _PredictionData data
+        list results = []
+
+    prediction.finalize()
+    fuzzymatch = abs(fuzzymatch)
+    data = _PredictionData(prediction)
+    for reference in references:
+        results.append(__compare(data, prediction, reference, lenient, strict_strandedness, fuzzymatch))
+    return results
+
+
+@cython.profile(True)
+@cython.cdivision(True)
+cdef tuple __compare(_PredictionData pred, prediction, reference, bint lenient, bint strict_strandedness,
+                     int fuzzymatch):
+
+    """Private function with the actual comparison of a prediction, whose data has already been extracted,
+    against a reference transcript. See compare for the details."""
+
+    reference.finalize()
 
     cdef:
         long nucl_overlap, distance
@@ -312,9 +389,9 @@ cpdef tuple compare(prediction, reference, bint lenient=False, bint strict_stran
         double stats[9]
         str r_strand, p_strand
 
-    p_cdna_length, r_cdna_length = prediction.cdna_length, reference.cdna_length
-    p_exon_num, r_exon_num = prediction.exon_num, reference.exon_num
-    p_start, p_end, r_start, r_end = (prediction.start, prediction.end,
+    p_cdna_length, r_cdna_length = pred.cdna_length, reference.cdna_length
+    p_exon_num, r_exon_num = pred.exon_num, reference.exon_num
+    p_start, p_end, r_start, r_end = (pred.start, pred.end,
                                       reference.start, reference.end)
 
     if reference.strand is None:
@@ -322,10 +399,7 @@ cpdef tuple compare(prediction, reference, bint lenient=False, bint strict_stran
     else:
         r_strand = reference.strand
 
-    if prediction.strand is None:
-        p_strand = ""
-    else:
-        p_strand = prediction.strand
+    p_strand = pred.strand
 
     nucl_overlap = 0
 
@@ -333,7 +407,7 @@ cpdef tuple compare(prediction, reference, bint lenient=False, bint strict_stran
     __ref_exons = set()
     r_tree = reference.segmenttree
 
-    for exon in prediction.exons:
+    for exon in pred.exons:
         exon_a, exon_b = exon[0], exon[1] + 1
         __pred_exons.add(exon)
                     # self, int start, int end, bint strict=0, bint contained_check=0, int max_distance=0,
@@ -354,12 +428,12 @@ cpdef tuple compare(prediction, reference, bint lenient=False, bint strict_stran
     if lenient is True:
         if len(__pred_exons) > 1 and len(__ref_exons) > 1:
             # If both are multiexonic, consider only the internal boundary
-            if prediction.exons[0] in __pred_exons:
-                __pred_exons.remove(prediction.exons[0])
-                __pred_exons.add(prediction.exons[0][1])
-            if prediction.exons[-1] in __pred_exons:
-                __pred_exons.remove(prediction.exons[-1])
-                __pred_exons.add(prediction.exons[-1][0])
+            if pred.first_exon in __pred_exons:
+                __pred_exons.remove(pred.first_exon)
+                __pred_exons.add(pred.first_exon[1])
+            if pred.last_exon in __pred_exons:
+                __pred_exons.remove(pred.last_exon)
+                __pred_exons.add(pred.last_exon[0])
             if reference.exons[0] in __ref_exons:
                 __ref_exons.remove(reference.exons[0])
                 __ref_exons.add(reference.exons[0][1])
@@ -381,8 +455,8 @@ cpdef tuple compare(prediction, reference, bint lenient=False, bint strict_stran
     junction_overlap = 0
     c_splices = set()
     if p_exon_num > 1 and r_exon_num > 1:
-        r_splices, p_splices = reference.splices, prediction.splices
-        for p_intron in prediction.introns:
+        r_splices, p_splices = reference.splices, pred.splices
+        for p_intron in pred.introns:
             p_splice_start, p_splice_end = p_intron
             found = r_tree.find(p_splice_start - 1, p_splice_start + 1, 0, 0, fuzzymatch, 1000, "intron")
             curr_distance = 10000000
@@ -470,24 +544,19 @@ cpdef tuple compare(prediction, reference, bint lenient=False, bint strict_stran
         reference_exon = None
 
     location = "{}:{}..{}".format(reference.chrom,
-                                  min(reference.start, prediction.start),
-                                  max(reference.end, prediction.end))
+                                  min(r_start, p_start),
+                                  max(r_end, p_end))
 
     if reference.parent == [] or reference.parent is None:
         ref_parent = "NA"
     else:
         ref_parent = ",".join([str(_) for _ in reference.parent])
 
-    if prediction.parent == [] or prediction.parent is None:
-        pred_parent = "NA"
-    else:
-        pred_parent = ",".join([str(_) for _ in prediction.parent])
-
     result = ResultStorer(reference.id,
                           ref_parent,
-                          ccode, prediction.id,
-                          pred_parent,
-                          len(prediction.exons),
+                          ccode, pred.tid,
+                          pred.parent,
+                          p_exon_num,
                           len(reference.exons),
                           # Nucleotide stats
                           round(nucl_precision * 100, 2),
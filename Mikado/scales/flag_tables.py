@@ -0,0 +1,185 @@
+# coding: utf-8
+
+"""
+This module contains the array-backed tables used by the Accountant to store the bit flags of the features
+(exons, splice sites, transcripts) found in the reference and in the prediction.
+Each feature is interned to a consecutive integer ID, in order of insertion; its flags are kept in a bytearray,
+which can be updated quickly one feature at a time while storing the results, and is viewed as a numpy uint8 array
+for merging tables and calculating the statistics.
+"""
+
+import numpy as np
+
+
+__author__ = 'Luca Venturini'
+
+
+class FlagTable:
+
+    """Table of bit flags, with one byte per feature. It behaves like a dictionary of features to integer flags;
+    additionally, the flags of all the features can be retrieved at once as a numpy array (see values), and
+    whole tables can be merged with vectorised operations (see merge)."""
+
+    __slots__ = ("default", "_ids", "_flags")
+
+    def __init__(self, default=0):
+        """
+        :param default: the flags of a feature when it is first inserted into the table.
+        :type default: int
+        """
+
+        self.default = default
+        self._ids = dict()
+        self._flags = bytearray()
+
+    def intern(self, key, default=None) -> int:
+        """Method to retrieve the ID of a feature, adding it to the table if it is missing.
+        :param key: the feature.
+        :param default: optional initial flags of the feature, if it is missing. By default, self.default.
+        """
+
+        idx = self._ids.get(key, None)
+        if idx is None:
+            idx = len(self._flags)
+            self._ids[key] = idx
+            self._flags.append(self.default if default is None else default)
+        return idx
+
+    def __contains__(self, key):
+        return key in self._ids
+
+    def __len__(self):
+        return len(self._flags)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def keys(self):
+        return self._ids.keys()
+
+    def items(self):
+        for key, idx in self._ids.items():
+            yield key, self._flags[idx]
+
+    def __getitem__(self, key):
+        return self._flags[self._ids[key]]
+
+    def __setitem__(self, key, value):
+        self._flags[self.intern(key)] = value
+
+    def __eq__(self, other):
+        if not isinstance(other, FlagTable):
+            return NotImplemented
+        return len(self) == len(other) and all(key in other and other[key] == value for key, value in self.items())
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, dict(self.items()))
+
+    def set_bits(self, key, bits):
+        """Method to switch on the given bits for a feature, adding it to the table if necessary."""
+        idx = self.intern(key)
+        self._flags[idx] |= bits
+
+    def clear_bits(self, key, bits):
+        """Method to switch off the given bits for a feature, adding it to the table if necessary."""
+        idx = self.intern(key)
+        self._flags[idx] &= ~bits & 0xFF
+
+    @property
+    def values(self) -> np.ndarray:
+        """A copy of the flags of all the features, in order of insertion, as a numpy uint8 array."""
+        return np.array(self._flags, dtype=np.uint8)
+
+    @property
+    def state(self) -> list:
+        """The table as a list of plain, serialisable types: the features in order of insertion and their flags."""
+        return [list(self._ids.keys()), bytes(self._flags)]
+
+    def merge(self, other, intersection=0):
+        """Method to merge another table (or its state) into this one. For each feature, the bits in the
+        intersection mask are kept only if set in both tables; all the others are set if they are in either.
+        Features missing from this table are added with the flags of the other one.
+        :param other: the table to merge, either as a FlagTable or as its state.
+        :param intersection: the mask of the bits to combine with an AND rather than an OR.
+        """
+
+        keys, flags = self._unpack_state(other)
+        if len(keys) == 0:
+            return
+        # New features start with all the intersection bits set, so that they end up with the flags of the other table
+        ids = np.fromiter((self.intern(key, default=intersection) for key in keys), dtype=np.int64, count=len(keys))
+        mine = np.frombuffer(self._flags, dtype=np.uint8)
+        theirs = np.frombuffer(flags, dtype=np.uint8)
+        current = mine[ids]
+        mine[ids] = ((current | theirs) & (~intersection & 0xFF)) | (current & theirs & intersection)
+        # Release the buffer, otherwise the bytearray could not grow anymore
+        del mine
+
+    def _unpack_state(self, other):
+        if isinstance(other, FlagTable):
+            other = other.state
+        return other[-2], other[-1]
+
+
+class TranscriptFlags(FlagTable):
+
+    """Table of bit flags for transcripts, keyed by (gene ID, transcript ID). The genes are tracked as well,
+    including those without any transcript, so that the flags can be aggregated gene by gene."""
+
+    __slots__ = ("_genes", "_gene_ids")
+
+    def __init__(self, default=0):
+        super().__init__(default=default)
+        self._genes = dict()
+        self._gene_ids = []
+
+    def add_gene(self, gid) -> int:
+        """Method to add a gene to the table, even if it has no transcripts."""
+        gene_idx = self._genes.get(gid, None)
+        if gene_idx is None:
+            gene_idx = self._genes[gid] = len(self._genes)
+        return gene_idx
+
+    def intern(self, key, default=None) -> int:
+        idx = self._ids.get(key, None)
+        if idx is None:
+            self._gene_ids.append(self.add_gene(key[0]))
+            idx = super().intern(key, default=default)
+        return idx
+
+    @property
+    def gene_num(self) -> int:
+        return len(self._genes)
+
+    @property
+    def genes(self):
+        return self._genes.keys()
+
+    def __eq__(self, other):
+        if not isinstance(other, TranscriptFlags):
+            return NotImplemented
+        return set(self._genes.keys()) == set(other.genes) and super().__eq__(other)
+
+    @property
+    def state(self) -> list:
+        return [list(self._genes.keys())] + super().state
+
+    def merge(self, other, intersection=0):
+        genes = other.genes if isinstance(other, TranscriptFlags) else other[0]
+        for gid in genes:
+            self.add_gene(gid)
+        super().merge(other, intersection=intersection)
+
+    def gene_flags(self):
+        """Method to aggregate the flags by gene.
+        :returns: two numpy arrays with, for each gene in order of insertion, the OR and the AND of the flags of
+        its transcripts. Genes without transcripts have all the bits unset in the former and set in the latter.
+        """
+
+        values = self.values
+        gene_ids = np.array(self._gene_ids, dtype=np.int64)
+        gene_or = np.zeros(self.gene_num, dtype=np.uint8)
+        gene_and = np.full(self.gene_num, 0xFF, dtype=np.uint8)
+        np.bitwise_or.at(gene_or, gene_ids, values)
+        np.bitwise_and.at(gene_and, gene_ids, values)
+        return gene_or, gene_and
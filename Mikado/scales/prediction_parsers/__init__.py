@@ -1,10 +1,14 @@
 import multiprocessing as mp
 from ...utilities.namespace import Namespace
-from .transmission import transmit_transcript
+from .transmission import transmit_transcript, RegionSharder
+from .sharding import find_shards
 from ..assignment.assigner import Assigner
-from ..assignment.distributed import Assigners, FinalAssigner
+from ..assignment.distributed import Assigners, FinalAssigner, PredictionAssigners, ShardAssigners
+from ..assignment.sweep import SweepAssigner
 from .transmission import get_best_result
-from ..reference_preparation.gene_dict import GeneDict
+from ..reference_preparation.binary_index import open_index
+from ..reference_preparation.reference_model import prepare_model
+from ..contrast import compare_many as c_compare_many
 from ..resultstorer import ResultStorer
 from ...transcripts import Gene
 from ...parsers.GFF import GFF3
@@ -16,9 +20,30 @@ from .parse_gff3_prediction import parse_prediction_gff3
 from .parse_gtf_prediction import parse_prediction_gtf
 from .parse_bed12 import parse_prediction_bed12
 from ...parsers import to_gff
+import collections
 import gzip
+import copy
 import csv
-import itertools
+import functools
+import io
+import os
+
+
+def get_annotator(prediction):
+    """Function to select the parsing function appropriate for the format of the prediction.
+    :param prediction: the prediction file, as returned by to_gff.
+    """
+
+    if prediction.__annot_type__ == BamParser.__annot_type__:
+        return parse_prediction_bam
+    elif prediction.__annot_type__ == Bed12Parser.__annot_type__:
+        return parse_prediction_bed12
+    elif prediction.__annot_type__ == GFF3.__annot_type__:
+        return parse_prediction_gff3
+    elif prediction.__annot_type__ == GTF.__annot_type__:
+        return parse_prediction_gtf
+    else:
+        raise ValueError("Unsupported input file format")
 
 
 def parse_prediction(args, index, queue_logger):
@@ -39,22 +64,13 @@ def parse_prediction(args, index, queue_logger):
     if hasattr(args, "self") and args.self is True:
         args.prediction = to_gff(args.reference.name)
     __found_with_orf = set()
-    queue = mp.JoinableQueue(100)
-    returnqueue = mp.JoinableQueue(100)
 
     queue_logger.info("Starting to parse the prediction")
-    if args.prediction.__annot_type__ == BamParser.__annot_type__:
-        annotator = parse_prediction_bam
-    elif args.prediction.__annot_type__ == Bed12Parser.__annot_type__:
-        annotator = parse_prediction_bed12
-    elif args.prediction.__annot_type__ == GFF3.__annot_type__:
-        annotator = parse_prediction_gff3
-    elif args.prediction.__annot_type__ == GTF.__annot_type__:
-        annotator = parse_prediction_gtf
-    else:
-        raise ValueError("Unsupported input file format")
+    annotator = get_annotator(args.prediction)
 
     if args.processes > 1:
+        if getattr(args, "sorted", False) is True:
+            queue_logger.warning("The sorted mode is available only with a single process; ignoring it.")
         log_queue = args.log_queue
         dargs = dict()
         doself = False
@@ -67,30 +83,57 @@ def parse_prediction(args, index, queue_logger):
                 dargs[key] = item
         nargs = Namespace(default=False, **dargs)
         nargs.self = doself
-        procs = [Assigners(index, nargs, queue, returnqueue, log_queue, counter)
-                 for counter in range(args.processes)]
-        [proc.start() for proc in procs]
-        final_proc = FinalAssigner(index, nargs, returnqueue, log_queue=log_queue, nprocs=len(procs))
+        # Build (or retrieve) the reference model once, so that the children can share it
+        model, temporary_model = prepare_model(index, args, queue_logger)
+        returnqueue = mp.JoinableQueue(100)
+        shards = find_shards(args.prediction, args.processes)
+        if shards is not None:
+            # The workers parse the shards of the prediction on their own, the largest first
+            queue_logger.info("Distributing %d shards of the prediction to the workers", len(shards))
+            queue = mp.JoinableQueue()
+            procs = [ShardAssigners(index, nargs, queue, returnqueue, log_queue, counter, model=model)
+                     for counter in range(args.processes)]
+            for shard in shards:
+                queue.put(shard)
+            [queue.put("EXIT") for _ in procs]
+            [proc.start() for proc in procs]
+        else:
+            # Each worker has its own queue, and receives the transcripts of the regions it owns
+            queues = [mp.JoinableQueue(100) for _ in range(args.processes)]
+            procs = [Assigners(index, nargs, queues[counter], returnqueue, log_queue, counter, model=model)
+                     for counter in range(args.processes)]
+            [proc.start() for proc in procs]
+        final_proc = FinalAssigner(index, nargs, returnqueue, log_queue=log_queue, nprocs=len(procs), model=model)
         final_proc.start()
-        done = 0
-        lastdone = 1
-        rows = []
-        for transcript in annotator(args, queue_logger):
-            rows, done, lastdone, __found_with_orf = transmit_transcript(
-                transcript, done=done, lastdone=lastdone, rows=rows, queue=queue, queue_logger=queue_logger,
-                __found_with_orf=__found_with_orf)
+        if shards is None:
+            done = 0
+            lastdone = 1
+            rows = []
+            sharder = RegionSharder(queues)
+            for transcript in annotator(args, queue_logger):
+                rows, done, lastdone, __found_with_orf = transmit_transcript(
+                    transcript, done=done, lastdone=lastdone, rows=rows, queue=sharder, queue_logger=queue_logger,
+                    __found_with_orf=__found_with_orf)
 
-        rows, done, lastdone, __found_with_orf = transmit_transcript(
-            None, done=done, lastdone=lastdone, rows=rows, queue=queue, queue_logger=queue_logger,
-            __found_with_orf=__found_with_orf, send_all=True)
+            rows, done, lastdone, __found_with_orf = transmit_transcript(
+                None, done=done, lastdone=lastdone, rows=rows, queue=sharder, queue_logger=queue_logger,
+                __found_with_orf=__found_with_orf, send_all=True)
 
-        queue_logger.info("Finished parsing, %s transcripts in total", done)
-        queue.join()
-        queue.put("EXIT")
+            queue_logger.info("Finished parsing, %s transcripts in total", done)
+            [queue.join() for queue in queues]
+            [queue.put("EXIT") for queue in queues]
         [proc.join() for proc in procs]
         final_proc.join()
+        if temporary_model is True:
+            os.remove(model)
     else:
-        assigner_instance = Assigner(index, args, printout_tmap=True, )
+        if getattr(args, "sorted", False) is True:
+            # The model spares decoding all the reference genes to prepare the statistics
+            model, temporary_model = prepare_model(index, args, queue_logger)
+            assigner_instance = SweepAssigner(index, args, printout_tmap=True, model=model)
+        else:
+            model, temporary_model = None, False
+            assigner_instance = Assigner(index, args, printout_tmap=True, )
         done = 0
         for transcript in annotator(args, queue_logger):
             if transcript is None:
@@ -99,15 +142,67 @@ def parse_prediction(args, index, queue_logger):
             assigner_instance.get_best(transcript)
         queue_logger.info("Finished parsing, %s transcripts in total", done + 1)
         assigner_instance.finish()
+        if temporary_model is True:
+            os.remove(model)
+
+
+def compare_isoforms(gene: Gene, fuzzymatch=0):
+    """Function to compare all the pairs of transcripts of a gene, in the order of itertools.combinations.
+    Each transcript is compared against all those following it with a single call to the batch comparison kernel.
+    :param gene: the gene.
+    :param fuzzymatch: leniency in determining whether two introns are related.
+    :returns: an iterator over the ResultStorer of each pair.
+    """
+
+    transcripts = [gene.transcripts[tid] for tid in gene.transcripts.keys()]
+    for num, transcript in enumerate(transcripts[:-1]):
+        for result, _ in c_compare_many(transcript, transcripts[num + 1:], fuzzymatch=fuzzymatch):
+            yield result
 
 
-def parse_self(args, gdict: GeneDict, queue_logger):
+# Index opened by each worker of a parallel self-comparison, see _init_self_worker
+_self_index = None
+
+
+def _init_self_worker(index):
+    global _self_index
+    _self_index = open_index(index)
+
+
+def _self_compare_genes(gids, gdict=None, fuzzymatch=0) -> str:
+    """Function to perform the self-comparison of a batch of genes.
+    :param gids: the IDs of the genes.
+    :param gdict: the opened index. If None, the index opened by the worker process is used.
+    :param fuzzymatch: leniency in determining whether two introns are related.
+    :returns: the TMAP rows of the batch, already formatted.
+    """
+
+    if gdict is None:
+        gdict = _self_index
+    out = io.StringIO()
+    tmap_rower = csv.DictWriter(out, ResultStorer.__slots__, delimiter="\t")
+    for gid in gids:
+        gene = gdict[gid]
+        assert isinstance(gene, Gene)
+        if len(gene.transcripts) == 1:
+            continue
+        tmap_rower.writerows(result.as_dict() for result in compare_isoforms(gene, fuzzymatch=fuzzymatch))
+    # Each batch is decoded only once; do not keep its genes in memory
+    gdict.clear_cache()
+    return out.getvalue()
+
+
+def parse_self(args, index: str, queue_logger, batch_size=100):
 
     """
-    This function is called when we desire to compare a reference against itself.
-    :param args:
-    :param gdict: gene MIDX database
-    :param queue_logger:
+    This function is called when we desire to compare a reference against itself, ie compare all the isoforms
+    of each gene against each other. The genes are analysed in batches; with multiple processes, the batches are
+    distributed to a pool of workers, each with its own connection to the index. The TMAP rows are written one
+    batch at a time, in the order of the genes in the index.
+    :param args: the Namespace with the necessary parameters
+    :param index: the index of the reference
+    :param queue_logger: Logger
+    :param batch_size: number of genes in each batch.
     :return:
     """
 
@@ -120,16 +215,120 @@ def parse_self(args, gdict: GeneDict, queue_logger):
     tmap_rower = csv.DictWriter(tmap_out, ResultStorer.__slots__, delimiter="\t")
     tmap_rower.writeheader()
 
-    for gid, gene in gdict.items():
-        assert isinstance(gene, Gene)
-        if len(gene.transcripts) == 1:
-            continue
-
-        combinations = itertools.combinations(gene.transcripts.keys(), 2)
-        for combination in combinations:
-            result, _ = Assigner.compare(gene.transcripts[combination[0]],
-                                         gene.transcripts[combination[1]],
-                                         fuzzy_match=args.fuzzymatch)
-            tmap_rower.writerow(result.as_dict())
+    gdict = open_index(index)
+    gids = list(gdict)
+    batches = [gids[start:start + batch_size] for start in range(0, len(gids), batch_size)]
+    processes = min(getattr(args, "processes", 1) or 1, len(batches))
+    if processes > 1:
+        queue_logger.info("Comparing the isoforms of %d genes using %d processes", len(gids), processes)
+        comparer = functools.partial(_self_compare_genes, fuzzymatch=args.fuzzymatch)
+        with mp.Pool(processes, initializer=_init_self_worker, initargs=(index,)) as pool:
+            # imap preserves the order of the batches, so that the result is identical to a sequential run
+            for rows in pool.imap(comparer, batches):
+                tmap_out.write(rows)
+    else:
+        for batch in batches:
+            tmap_out.write(_self_compare_genes(batch, gdict=gdict, fuzzymatch=args.fuzzymatch))
+    tmap_out.close()
+    if hasattr(gdict, "close"):
+        gdict.close()
 
     queue_logger.info("Finished.")
+
+
+def prediction_labels(predictions) -> list:
+    """Function to derive the labels of the outputs of a multi-prediction comparison from the names of the
+    prediction files: the base name of each file, without its extension (and without the .gz suffix, if present).
+    Repeated labels get the position of the file in the command line appended.
+    :param predictions: the prediction files, as returned by to_gff.
+    """
+
+    labels = []
+    for prediction in predictions:
+        label = os.path.basename(prediction.name)
+        if label.endswith(".gz"):
+            label = label[:-3]
+        label = os.path.splitext(label)[0] or label
+        labels.append(label)
+    counts = collections.Counter(labels)
+    return [label if counts[label] == 1 else "{}.{}".format(label, num) for num, label in enumerate(labels, 1)]
+
+
+def compare_predictions(args, index, jobs, queue_logger, model=None):
+
+    """
+    This function compares, one after the other, multiple predictions against the reference. Unless the
+    predictions are sorted, the reference genes and their positions are loaded only once and shared by all the
+    comparisons.
+    :param args: the Namespace with the necessary parameters
+    :param index: the index of the reference
+    :param jobs: an iterable of (prediction, output prefix) pairs. The prediction can be given as its file name.
+    :param queue_logger: Logger
+    :param model: optional reference model of the index.
+    """
+
+    reference = None
+    for prediction, out in jobs:
+        if isinstance(prediction, str):
+            prediction = to_gff(prediction)
+        pargs = copy.copy(args)
+        pargs.prediction, pargs.out = prediction, out
+        queue_logger.info("Comparing %s against the reference, output: %s", prediction.name, out)
+        if getattr(args, "sorted", False) is True:
+            assigner_instance = SweepAssigner(index, pargs, printout_tmap=True, model=model)
+        else:
+            assigner_instance = Assigner(index, pargs, printout_tmap=True, model=model, reference=reference)
+            reference = assigner_instance
+        done = 0
+        for transcript in get_annotator(prediction)(pargs, queue_logger):
+            if transcript is None:
+                continue
+            done += 1
+            assigner_instance.get_best(transcript)
+        queue_logger.info("Finished parsing %s, %s transcripts in total", prediction.name, done)
+        assigner_instance.finish()
+        if hasattr(prediction, "close"):
+            prediction.close()
+
+
+def parse_predictions(args, index, queue_logger):
+
+    """
+    This function compares multiple predictions against the same reference. The index (and, if necessary, the
+    reference model) is prepared only once; each prediction has its own TMAP, RefMap and stats files, with
+    prefix <args.out>.<label> (see prediction_labels).
+    With multiple processes, the predictions are distributed to the workers, each comparing whole predictions
+    against the shared, memory-mapped reference.
+    :param args: the Namespace with the necessary parameters; args.prediction is the list of predictions.
+    :param index: the index of the reference
+    :param queue_logger: Logger
+    """
+
+    predictions = list(args.prediction)
+    jobs = [(prediction, "{}.{}".format(args.out, label))
+            for prediction, label in zip(predictions, prediction_labels(predictions))]
+    queue_logger.info("Comparing %d predictions against the reference", len(jobs))
+    model, temporary_model = prepare_model(index, args, queue_logger)
+
+    procs = min(args.processes, len(jobs))
+    if procs > 1:
+        dargs = dict((key, item) for key, item in args.__dict__.items()
+                     if key not in ("log_queue", "queue_handler", "prediction", "self"))
+        nargs = Namespace(default=False, **dargs)
+        nargs.self = getattr(args, "self", False)
+        queue = mp.JoinableQueue()
+        for prediction, out in jobs:
+            # The workers open the files on their own
+            queue.put((prediction.name, out))
+            if hasattr(prediction, "close"):
+                prediction.close()
+        workers = [PredictionAssigners(index, nargs, queue, args.log_queue, counter, model=model)
+                   for counter in range(procs)]
+        [queue.put("EXIT") for _ in workers]
+        [worker.start() for worker in workers]
+        [worker.join() for worker in workers]
+    else:
+        compare_predictions(args, index, jobs, queue_logger, model=model)
+
+    if temporary_model is True:
+        os.remove(model)
@@ -0,0 +1,159 @@
+"""
+This module contains the functions used by a multi-process mikado compare to let the workers parse the prediction
+on their own, rather than receiving the transcripts already parsed by the main process.
+The prediction file is split in shards, ie byte ranges each containing all the lines of a chromosome (or, for large
+chromosomes, of a run of whole genes on it); each worker opens its shards with a parser of the same type as the
+prediction, so that every transcript is parsed and finalised only once, and the main process only needs to scan
+the first field of each line.
+"""
+
+import io
+import os
+import re
+from ...parsers.GFF import GFF3
+from ...parsers.GTF import GTF
+from ...parsers.bed12 import Bed12Parser
+from .transmission import orf_pattern
+
+
+__author__ = 'Luca Venturini'
+
+
+# Magic numbers of the compressed formats accepted by the parsers, which cannot be read by byte range
+_compressed = (b"\x1f\x8b", b"BZh")
+_gene_id = re.compile(rb'gene_id "?([^";]+)')
+
+
+def _record_key(fields: list, annot_type: str):
+    """Function to retrieve the record a GTF or BED12 line belongs to: the gene for GTF files, the transcript
+    (regardless of its ORF suffix) for BED12 files."""
+
+    if annot_type == GTF.__annot_type__:
+        found = _gene_id.search(fields[8]) if len(fields) > 8 else None
+        return found.group(1) if found is not None else None
+    return orf_pattern.sub("", fields[3].rstrip().decode()) if len(fields) > 3 else None
+
+
+def _next_record(handle, position: int, end: int, annot_type: str):
+    """Function to find the first record starting after a given position of a prediction file, so that a shard
+    can be split without breaking the genes (or, for BED12 files, the transcripts) it contains. In GFF3 files,
+    records start with the lines without a parent.
+
+    :returns: the position where the record starts, or None if there is none before the end of the shard.
+    """
+
+    handle.seek(position - 1)
+    handle.readline()
+    previous = None
+    while handle.tell() < end:
+        start = handle.tell()
+        line = handle.readline()
+        fields = line.split(b"\t")
+        if line.startswith(b"#") or len(fields) < 4:
+            continue
+        elif annot_type == GFF3.__annot_type__:
+            if len(fields) > 8 and b"Parent=" not in fields[8]:
+                return start
+            continue
+        key = _record_key(fields, annot_type)
+        if previous is not None and key != previous:
+            return start
+        previous = key
+    return None
+
+
+def find_shards(prediction, processes=2):
+    """Function to split a prediction file in shards, one per chromosome. Comment, header and track lines belong
+    to the shard of the chromosome preceding them (or to the first shard, if at the beginning of the file).
+    Chromosomes larger than the file size divided by the number of processes are further split between genes,
+    so that all the processes can be kept busy.
+
+    :param prediction: the prediction, as returned by to_gff.
+    :param processes: number of processes which will parse the shards, ie the minimum number of shards.
+    :returns: the list of the shards, as (chromosome, start, end) tuples, sorted from the largest to the smallest;
+    or None if the prediction cannot be sharded. This is the case for BAM files, compressed files, streams,
+    files where the lines of a chromosome are not all contiguous, and files which cannot be split in enough shards.
+    """
+
+    if prediction.__annot_type__ not in (GTF.__annot_type__, GFF3.__annot_type__, Bed12Parser.__annot_type__):
+        return None
+    elif not isinstance(prediction.name, str) or not os.path.isfile(prediction.name):
+        return None
+
+    shards = []
+    with open(prediction.name, "rb") as handle:
+        if handle.read(3).startswith(_compressed):
+            return None
+        handle.seek(0)
+        found = set()
+        chrom, start, position = None, 0, 0
+        for line in handle:
+            tab = line.find(b"\t")
+            if tab > 0 and not line.startswith(b"#") and line[:tab] != chrom:
+                if line[:tab] in found:
+                    return None
+                if chrom is not None:
+                    shards.append((chrom.decode(), start, position))
+                    start = position
+                chrom = line[:tab]
+                found.add(chrom)
+            position += len(line)
+        if chrom is not None:
+            shards.append((chrom.decode(), start, position))
+
+        max_size = position / max(processes, 1)
+        split = []
+        for chrom, block_start, end in shards:
+            pieces = int((end - block_start) // max_size) + 1 if end - block_start > max_size else 1
+            start = block_start
+            for num in range(1, pieces):
+                boundary = _next_record(handle, max(int(block_start + num * (end - block_start) / pieces), start + 1),
+                                        end, prediction.__annot_type__)
+                if boundary is not None:
+                    split.append((chrom, start, boundary))
+                    start = boundary
+            split.append((chrom, start, end))
+        shards = split
+
+    if len(shards) < max(processes, 2):
+        return None
+    return sorted(shards, key=lambda shard: shard[1] - shard[2])
+
+
+class _ByteRange(io.RawIOBase):
+
+    """Read-only, unbuffered view of a range of bytes of a file."""
+
+    def __init__(self, filename: str, start: int, end: int):
+        super().__init__()
+        self.name = filename
+        self.__handle = open(filename, "rb", buffering=0)
+        self.__handle.seek(start)
+        self.__remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.__remaining)
+        if size <= 0:
+            return 0
+        read = self.__handle.readinto(memoryview(buffer)[:size])
+        self.__remaining -= read
+        return read
+
+    def close(self):
+        self.__handle.close()
+        super().close()
+
+
+def open_shard(prediction, start: int, end: int):
+    """Function to open a shard of a prediction file.
+
+    :param prediction: the prediction, as returned by to_gff.
+    :param start: the first byte of the shard.
+    :param end: the end of the shard (excluded).
+    :returns: a parser of the same type as the prediction, reading only the lines of the shard.
+    """
+
+    return prediction.__class__(io.TextIOWrapper(io.BufferedReader(_ByteRange(prediction.name, start, end))))
@@ -8,7 +8,7 @@ from logging import Logger
 from typing import Union
 
 
-def send_transcripts(transcript: Union[None,Transcript], rows: list, queue: Queue, maxsize=1000):
+def send_transcripts(transcript: Union[None,Transcript], rows: list, queue: Queue, maxsize=1000, region=None):
     if transcript is not None:
         transcript.finalize()
         d = transcript.as_dict(remove_attributes=False)
@@ -18,21 +18,116 @@ def send_transcripts(transcript: Union[None,Transcript], rows: list, queue: Queu
         send_all = True
     if len(rows) >= maxsize or send_all is True:
         to_write = msgpack.dumps(rows)
-        queue.put(to_write)
+        if region is not None:
+            queue.put((region, to_write))
+        else:
+            queue.put(to_write)
         rows = []
     return rows
 
 
+class RegionSharder:
+
+    """Class to distribute the prediction transcripts among the workers by genomic region. The genome is
+    divided in windows of region_size bps; each window is assigned, when first seen, to the worker which has
+    received the fewest transcripts so far, and all the transcripts starting in it are sent to that worker,
+    in batches which contain transcripts from a single region. Each worker therefore sees only a subset of
+    the genome, and needs to load only the reference genes of its own regions.
+    A batch is sent when it is full, or, as long as the input is sorted, as soon as the input moves past its
+    region. In any case, no more than max_buffered transcripts are kept waiting in the main process."""
+
+    def __init__(self, queues: list, region_size=1000000, maxsize=1000, max_buffered=None):
+
+        self.queues = queues
+        self.region_size = region_size
+        self.maxsize = maxsize
+        self.max_buffered = maxsize * len(queues) if max_buffered is None else max_buffered
+        self.__owners = dict()
+        self.__loads = [0] * len(queues)
+        self.__rows = dict()
+        self.__buffered = 0
+        self.__last = None
+        self.__sorted = True
+        self.__finished = set()
+
+    @property
+    def buffered(self) -> int:
+        """Number of transcripts waiting to be sent."""
+        return self.__buffered
+
+    def owner(self, region) -> int:
+        """Method to retrieve the worker owning a region, assigning it to the least loaded one if necessary."""
+
+        if region not in self.__owners:
+            self.__owners[region] = self.__loads.index(min(self.__loads))
+        return self.__owners[region]
+
+    def __move(self, chrom, start):
+        """Private method to send the batches of the regions the input has moved past, as long as the input
+        is sorted by coordinates."""
+
+        if self.__last is not None and self.__sorted is True:
+            last_chrom, last_start = self.__last
+            if chrom != last_chrom:
+                self.__finished.add(last_chrom)
+                if chrom in self.__finished:
+                    self.__sorted = False
+                else:
+                    self.flush()
+            elif start < last_start:
+                self.__sorted = False
+            elif start // self.region_size > last_start // self.region_size:
+                self.__send((chrom, last_start // self.region_size))
+        self.__last = (chrom, start)
+
+    def __send(self, region):
+        rows = self.__rows.pop(region, [])
+        if rows:
+            self.__buffered -= len(rows)
+            send_transcripts(None, rows, self.queues[self.__owners[region]], region=region)
+
+    def send(self, transcript: Transcript):
+        """Method to send a transcript to the worker owning its region."""
+
+        transcript.finalize()
+        self.__move(transcript.chrom, transcript.start)
+        region = (transcript.chrom, transcript.start // self.region_size)
+        owner = self.owner(region)
+        self.__loads[owner] += 1
+        rows = self.__rows.get(region, [])
+        waiting = len(rows)
+        self.__rows[region] = send_transcripts(transcript, rows, self.queues[owner],
+                                               maxsize=self.maxsize, region=region)
+        self.__buffered += len(self.__rows[region]) - waiting
+        if self.__buffered >= self.max_buffered:
+            self.flush()
+
+    def flush(self):
+        """Method to send all the transcripts still waiting to be sent."""
+
+        for region in list(self.__rows.keys()):
+            self.__send(region)
+        self.__rows = dict()
+        self.__buffered = 0
+
+
 def get_best_result(transcript, assigner_instance: Assigner):
     transcript.finalize()
     assigner_instance.get_best(transcript)
 
 
+def _send(transcript: Transcript, rows: list, queue: Union[Queue,RegionSharder]):
+    if isinstance(queue, RegionSharder):
+        queue.send(transcript)
+        return rows
+    return send_transcripts(transcript, rows, queue)
+
+
 orf_pattern = re.compile(r"\.orf[0-9]+$", re.IGNORECASE)
 
 
 def transmit_transcript(transcript: Union[None,Transcript], done: int, lastdone: int,
-                         rows: list, queue: Queue,
+                         rows: list, queue: Union[Queue,RegionSharder],
                          queue_logger: Logger,
                          __found_with_orf: set, send_all=False):
 
@@ -45,7 +140,7 @@ def transmit_transcript(transcript: Union[None,Transcript], done: int, lastdone:
                 if done and done % 10000 == 0:
                     queue_logger.info("Parsed %s transcripts", done)
                     lastdone = done
-                rows = send_transcripts(transcript, rows, queue)
+                rows = _send(transcript, rows, queue)
             else:
                 pass
         else:
@@ -54,11 +149,14 @@ def transmit_transcript(transcript: Union[None,Transcript], done: int, lastdone:
                 queue_logger.info("Parsed %s transcripts", done)
                 lastdone = done
             try:
-                rows = send_transcripts(transcript, rows, queue)
+                rows = _send(transcript, rows, queue)
             except AssertionError:
                 raise AssertionError((transcript.id, ))
 
-    if send_all is True:
+    if send_all is True and isinstance(queue, RegionSharder):
+        queue.flush()
+    elif send_all is True:
         send_transcripts(None, rows, queue)
 
     return rows, done, lastdone, __found_with_orf
+
@@ -1,5 +1,6 @@
 from ...parsers.GFF import GFF3
 from .indexing import create_index, check_index
+from .binary_index import index_version
 from ...exceptions import CorruptIndex
 import os
 import tempfile
@@ -8,10 +9,11 @@ import tempfile
 def prepare_index(args, queue_logger):
     index_name = os.path.abspath("{0}.midx".format(args.reference.name))
     ref_gff = isinstance(args.reference, GFF3)
+    version = getattr(args, "index_version", 1) or 1
     if args.index is True:
         create_index(args.reference, queue_logger=queue_logger, index_name=index_name,
                      ref_gff=ref_gff,
-                     exclude_utr=False, protein_coding=False)
+                     exclude_utr=False, protein_coding=False, version=version)
         assert os.path.exists(index_name), \
             "Index {} should have been created but is now absent! File system problems?".format(index_name)
         return index_name
@@ -28,12 +30,15 @@ def prepare_index(args, queue_logger):
 
         ref_gff = isinstance(args.reference, GFF3)
         create_index(args.reference, queue_logger, index_name, ref_gff=ref_gff,
-                     protein_coding=args.protein_coding, exclude_utr=args.exclude_utr)
+                     protein_coding=args.protein_coding, exclude_utr=args.exclude_utr, version=version)
     elif os.path.exists(index_name):
         # queue_logger.info("Starting loading the indexed reference")
         queue_logger.info("Index found")
         try:
             check_index(args.reference.name, queue_logger)
+            if index_version(index_name) != version:
+                raise CorruptIndex("Reference index in format version {}, rather than {}".format(
+                    index_version(index_name), version))
             queue_logger.info("Index valid, proceeding.")
         except CorruptIndex as exc:
             queue_logger.warning(exc)
@@ -46,13 +51,13 @@ def prepare_index(args, queue_logger):
                 __index = tempfile.NamedTemporaryFile(suffix=".midx")
                 index_name = __index.name
             create_index(args.reference, queue_logger, index_name, ref_gff=ref_gff,
-                         protein_coding=args.protein_coding, exclude_utr=args.exclude_utr)
+                         protein_coding=args.protein_coding, exclude_utr=args.exclude_utr, version=version)
     else:
         if args.no_save_index is True:
             __index = tempfile.NamedTemporaryFile(suffix=".midx", delete=False)
             index_name = __index.name
         create_index(args.reference, queue_logger, index_name, ref_gff=ref_gff,
-                     protein_coding=args.protein_coding, exclude_utr=args.exclude_utr)
+                     protein_coding=args.protein_coding, exclude_utr=args.exclude_utr, version=version)
         assert os.path.exists(index_name), "Index file {} should have been created but is now absent!".format(
             index_name)
 
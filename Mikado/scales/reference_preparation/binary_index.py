@@ -0,0 +1,340 @@
+"""
+This module contains the functions to write the binary (version 2) reference index of mikado compare, and the class
+to read it back. Contrary to the SQLite index (version 1), the binary index stores the structure of the reference in
+columnar arrays, which are memory-mapped and therefore shared by all the processes reading the index; the positions of
+the genes, the coordinates of the exons, CDS segments and introns of the transcripts and the locations used in the
+RefMap are all available without decoding the genes. The serialised genes are still stored, for the comparisons.
+
+The layout of the file is the following:
+
+- a header, with a magic string and the position and length of the index;
+- the serialised genes, sorted by ID, in the same format used by the SQLite index;
+- the string table, with the IDs of the genes and transcripts;
+- the arrays, aligned to 8 bytes: for the genes, the offsets of their serialised form and of their transcripts;
+  for the transcripts, chromosome, strand, start, end, coding flag and the offsets of their exons, CDS segments
+  and introns (the intron chain, sorted); the positions of the genes, in the same order as in the SQLite index;
+  for each chromosome, the positions sorted by start, with their starts, ends and the running maximum of the ends;
+- the index, a msgpack dictionary with the position, type and length of each array, and the chromosome names.
+"""
+
+import logging
+import mmap
+import struct
+import msgpack
+import numpy as np
+from ...utilities.log_utils import create_null_logger
+from .gene_dict import load_gene, GeneCache, GeneDict
+from .reference_model import ReferenceTranscript
+
+
+__author__ = 'Luca Venturini'
+
+
+magic = b"MIKIDX02"
+_header = struct.Struct("<8sQQ")
+_strands = {"+": 1, "-": -1, None: 0}
+_strand_codes = {1: "+", -1: "-", 0: None}
+
+
+def index_version(filename: str) -> int:
+    """Function to determine the version of a reference index: 2 for the binary index, 1 otherwise.
+    :param filename: the index file.
+    """
+
+    try:
+        with open(filename, "rb") as handle:
+            found = handle.read(len(magic))
+    except OSError:
+        return 1
+    return 2 if found == magic else 1
+
+
+def write_binary_index(genes: dict, positions: dict, filename: str, logger=None):
+    """Function to write the binary index of a reference.
+
+    :param genes: dictionary of the finalised reference genes, keyed by ID.
+    :param positions: dictionary of the positions of the genes, of the form dict[chrom][(start, end)] = [gene IDs].
+    :param filename: the index file to write.
+    :param logger: optional logger.
+    """
+
+    if logger is None:
+        logger = create_null_logger()
+
+    gids = sorted(genes)
+    gene_index = dict((gid, num) for num, gid in enumerate(gids))
+    chroms = sorted(positions)
+    chrom_index = dict((chrom, num) for num, chrom in enumerate(chroms))
+    arrays = dict((key, []) for key in (
+        "gene_blobs", "gene_transcripts", "transcript_chrom", "transcript_strand", "transcript_start",
+        "transcript_end", "transcript_coding", "transcript_exons", "exon_start", "exon_end", "transcript_cds",
+        "cds_start", "cds_end", "transcript_introns", "intron_start", "intron_end"))
+    dtypes = {"transcript_chrom": "<i4", "transcript_strand": "i1", "transcript_coding": "i1",
+              "position_chrom": "<i4"}
+    index = {"version": 2, "chroms": chroms, "sections": dict()}
+
+    with open(filename, "wb") as out:
+        out.write(_header.pack(magic, 0, 0))
+        transcript_ids = []
+        for gid in gids:
+            gene = genes[gid]
+            arrays["gene_blobs"].append(out.tell())
+            out.write(msgpack.dumps(gene.as_dict()))
+            arrays["gene_transcripts"].append(len(transcript_ids))
+            for transcript in gene:
+                transcript_ids.append(transcript.id)
+                arrays["transcript_chrom"].append(chrom_index.setdefault(transcript.chrom, len(chrom_index)))
+                arrays["transcript_strand"].append(_strands.get(transcript.strand, 0))
+                arrays["transcript_start"].append(transcript.start)
+                arrays["transcript_end"].append(transcript.end)
+                arrays["transcript_coding"].append(int(transcript.is_coding))
+                for offsets, key, segments in (("transcript_exons", "exon", transcript.exons),
+                                               ("transcript_cds", "cds", transcript.combined_cds),
+                                               ("transcript_introns", "intron", sorted(transcript.introns))):
+                    arrays[offsets].append(len(arrays[key + "_start"]))
+                    arrays[key + "_start"].extend(segment[0] for segment in segments)
+                    arrays[key + "_end"].extend(segment[1] for segment in segments)
+        arrays["gene_blobs"].append(out.tell())
+        arrays["gene_transcripts"].append(len(transcript_ids))
+        for offsets, key in (("transcript_exons", "exon"), ("transcript_cds", "cds"),
+                             ("transcript_introns", "intron")):
+            arrays[offsets].append(len(arrays[key + "_start"]))
+        # Chromosomes with transcripts but without positions (eg genes dropped for lack of coding transcripts)
+        index["chroms"] = sorted(chrom_index, key=chrom_index.get)
+
+        # String table
+        strings_offsets = [out.tell()]
+        for string in gids + transcript_ids:
+            out.write(string.encode())
+            strings_offsets.append(out.tell())
+        arrays["strings"] = strings_offsets
+
+        # Positions, in the same order as in the SQLite index
+        position_rows = [(chrom_index[chrom], start, end, gene_index[gid])
+                         for chrom in positions for (start, end), pos_gids in positions[chrom].items()
+                         for gid in pos_gids]
+        position_rows = np.array(position_rows, dtype="<i8").reshape(-1, 4)
+        arrays["position_chrom"] = position_rows[:, 0]
+        arrays["position_start"] = position_rows[:, 1]
+        arrays["position_end"] = position_rows[:, 2]
+        arrays["position_gene"] = position_rows[:, 3]
+
+        # Positions of each chromosome, sorted by start (keeping the original order for the same start)
+        order = np.lexsort((np.arange(position_rows.shape[0]), position_rows[:, 1], position_rows[:, 0]))
+        arrays["sorted_positions"] = order
+        arrays["sorted_starts"] = position_rows[order, 1]
+        arrays["sorted_ends"] = position_rows[order, 2]
+        arrays["chrom_offsets"] = np.searchsorted(position_rows[order, 0], np.arange(len(index["chroms"]) + 1))
+        max_ends = position_rows[order, 2].copy()
+        for start, end in zip(arrays["chrom_offsets"][:-1], arrays["chrom_offsets"][1:]):
+            if end > start:
+                max_ends[start:end] = np.maximum.accumulate(max_ends[start:end])
+        arrays["sorted_max_ends"] = max_ends
+
+        for key, values in arrays.items():
+            values = np.asarray(values, dtype=dtypes.get(key, "<i8"))
+            out.write(b"\0" * (-out.tell() % 8))
+            index["sections"][key] = [out.tell(), values.dtype.str, values.shape[0]]
+            out.write(values.tobytes())
+
+        packed = msgpack.packb(index, use_bin_type=True)
+        index_start = out.tell()
+        out.write(packed)
+        out.seek(0)
+        out.write(_header.pack(magic, index_start, len(packed)))
+    logger.info("Created the binary index %s, with %d genes and %d transcripts",
+                filename, len(gids), len(transcript_ids))
+
+
+class BinaryIndex:
+
+    """Class to read a binary reference index, created by write_binary_index. It exposes the same interface as
+    GeneDict (positions, item retrieval, iteration) and, like ReferenceModel, the reference transcripts in a
+    lightweight form. The file is memory-mapped, so that all the processes reading it share the same pages."""
+
+    def __init__(self, filename: str, logger=None, exclude_utr=False, protein_coding=False, cache_size=None):
+
+        self.filename = filename
+        self.__logger = create_null_logger()
+        self.logger = logger
+        self.__exclude_utr = exclude_utr
+        self.__protein_coding = protein_coding
+        self.__cache = GeneCache(cache_size)
+        self.__handle = open(self.filename, "rb")
+        self.__map = mmap.mmap(self.__handle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            found_magic, index_start, index_length = _header.unpack_from(self.__map, 0)
+        except struct.error:
+            found_magic = None
+        if found_magic != magic:
+            self.close()
+            raise ValueError("{} is not a valid Mikado binary index".format(self.filename))
+        index = msgpack.unpackb(self.__map[index_start:index_start + index_length], raw=False)
+        self.chroms = index["chroms"]
+        self.arrays = dict()
+        for key, (offset, dtype, count) in index["sections"].items():
+            self.arrays[key] = np.frombuffer(self.__map, dtype=dtype, count=count, offset=offset)
+        self.__num_genes = self.arrays["gene_transcripts"].shape[0] - 1
+        self.__chrom_index = dict((chrom, num) for num, chrom in enumerate(self.chroms))
+        self.__gene_index = dict((self.__string(num), num) for num in range(self.__num_genes))
+
+    @property
+    def logger(self):
+        return self.__logger
+
+    @logger.setter
+    def logger(self, logger):
+        if logger is None:
+            self.__logger = create_null_logger()
+        elif not isinstance(logger, logging.Logger):
+            raise TypeError("Invalid logger")
+        else:
+            self.__logger = logger
+
+    def close(self):
+        """Method to close the memory map and the underlying file."""
+        self.arrays = dict()
+        self.__map.close()
+        self.__handle.close()
+
+    def __string(self, num):
+        start, end = self.arrays["strings"][num:num + 2]
+        return self.__map[start:end].decode()
+
+    def __gene_id(self, num):
+        return self.__string(num)
+
+    def __transcript_id(self, num):
+        return self.__string(self.__num_genes + num)
+
+    @property
+    def positions(self):
+        chroms, starts = self.arrays["position_chrom"].tolist(), self.arrays["position_start"].tolist()
+        ends, genes = self.arrays["position_end"].tolist(), self.arrays["position_gene"].tolist()
+        return iter((self.chroms[chrom], start, end, self.__gene_id(gene))
+                    for chrom, start, end, gene in zip(chroms, starts, ends, genes))
+
+    def get_position(self, chrom, start, end):
+        low, high = self.__chromosome_range(chrom)
+        first = low + int(np.searchsorted(self.arrays["sorted_starts"][low:high], start, "left"))
+        last = low + int(np.searchsorted(self.arrays["sorted_starts"][low:high], start, "right"))
+        for position in self.arrays["sorted_positions"][first:last].tolist():
+            if self.arrays["position_end"][position] == end:
+                yield self.__gene_id(int(self.arrays["position_gene"][position]))
+
+    def __chromosome_range(self, chrom):
+        num = self.__chrom_index.get(chrom, None)
+        if num is None:
+            return 0, 0
+        return tuple(self.arrays["chrom_offsets"][num:num + 2].tolist())
+
+    def overlapping(self, chrom, start, end) -> list:
+        """Method to find the genes overlapping a region, from the sorted arrays of the chromosome.
+        :returns: the IDs of the genes, sorted by start."""
+
+        low, high = self.__chromosome_range(chrom)
+        starts = self.arrays["sorted_starts"][low:high]
+        last = int(np.searchsorted(starts, end, "right"))
+        first = int(np.searchsorted(self.arrays["sorted_max_ends"][low:high], start, "left"))
+        if first >= last:
+            return []
+        found = np.flatnonzero(self.arrays["sorted_ends"][low + first:low + last] >= start) + low + first
+        return [self.__gene_id(gene)
+                for gene in self.arrays["position_gene"][self.arrays["sorted_positions"][found]].tolist()]
+
+    def iter_chromosome(self, chrom):
+        """Method to iterate over the genes of a chromosome, sorted by start, as tuples of start, end, ID
+        and serialised gene."""
+
+        low, high = self.__chromosome_range(chrom)
+        for position in self.arrays["sorted_positions"][low:high].tolist():
+            gene = int(self.arrays["position_gene"][position])
+            yield (int(self.arrays["position_start"][position]), int(self.arrays["position_end"][position]),
+                   self.__gene_id(gene), self.__blob(gene))
+
+    def __blob(self, gene):
+        start, end = self.arrays["gene_blobs"][gene:gene + 2].tolist()
+        return self.__map[start:end]
+
+    def __getitem__(self, item):
+
+        if item in self.__cache:
+            return self.__cache[item]
+        num = self.__gene_index.get(item, None)
+        if num is None:
+            return None
+        gene = load_gene(self.__blob(num), logger=self.logger,
+                         exclude_utr=self.__exclude_utr, protein_coding=self.__protein_coding)
+        self.__cache[item] = gene
+        return gene
+
+    def clear_cache(self):
+        """Method to drop all the decoded genes kept in memory."""
+        self.__cache.clear()
+
+    def __iter__(self):
+        return iter(self.__gene_index)
+
+    def __len__(self):
+        return self.__num_genes
+
+    def items(self):
+
+        for gid in self:
+            yield (gid, self[gid])
+
+    def __reference_transcript(self, num):
+        arrays = self.arrays
+        segments = dict()
+        for key, offsets in (("exon", "transcript_exons"), ("intron", "transcript_introns")):
+            start, end = arrays[offsets][num:num + 2].tolist()
+            segments[key] = list(zip(arrays["{}_start".format(key)][start:end].tolist(),
+                                     arrays["{}_end".format(key)][start:end].tolist()))
+        return ReferenceTranscript(self.__transcript_id(num), self.chroms[int(arrays["transcript_chrom"][num])],
+                                   _strand_codes[int(arrays["transcript_strand"][num])],
+                                   segments["exon"], segments["intron"],
+                                   int(arrays["transcript_start"][num]), int(arrays["transcript_end"][num]))
+
+    def reference_transcripts(self):
+        """Method to iterate over the genes, with the list of their transcripts as ReferenceTranscript
+        instances. Unless the UTRs have to be removed, the genes are not decoded."""
+
+        if self.__exclude_utr is True:
+            for gid, gene in self.__gene_index.items():
+                yield gid, list(load_gene(self.__blob(gene), logger=self.logger, exclude_utr=True,
+                                          protein_coding=self.__protein_coding))
+            return
+
+        coding = self.arrays["transcript_coding"]
+        for gid, gene in self.__gene_index.items():
+            transcripts = range(*self.arrays["gene_transcripts"][gene:gene + 2].tolist())
+            yield gid, [self.__reference_transcript(num) for num in transcripts
+                        if self.__protein_coding is False or coding[num] == 1]
+
+    def location(self, gid, tid):
+        """Method to retrieve the location of a reference transcript, without decoding its gene."""
+
+        gene = self.__gene_index[gid]
+        for num in range(*self.arrays["gene_transcripts"][gene:gene + 2].tolist()):
+            if self.__transcript_id(num) == tid:
+                return "{}:{}..{}".format(self.chroms[int(self.arrays["transcript_chrom"][num])],
+                                          int(self.arrays["transcript_start"][num]),
+                                          int(self.arrays["transcript_end"][num]))
+        raise KeyError((gid, tid))
+
+
+def open_index(index: str, logger=None, exclude_utr=False, protein_coding=False, cache_size=None):
+    """Function to open a reference index, whatever its version.
+    :param index: the index file.
+    :param logger: optional logger.
+    :param exclude_utr: boolean flag. If set, the UTRs will be removed from the reference transcripts.
+    :param protein_coding: boolean flag. If set, only coding transcripts will be kept.
+    :param cache_size: maximum number of decoded genes to keep in memory.
+    :rtype: (BinaryIndex|GeneDict)
+    """
+
+    if index_version(index) == 2:
+        return BinaryIndex(index, logger=logger, exclude_utr=exclude_utr, protein_coding=protein_coding,
+                           cache_size=cache_size)
+    return GeneDict(index, logger=logger, exclude_utr=exclude_utr, protein_coding=protein_coding,
+                    cache_size=cache_size)
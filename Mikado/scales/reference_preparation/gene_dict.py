@@ -3,6 +3,7 @@ from ...exceptions import CorruptIndex
 from ...utilities.log_utils import create_null_logger
 import sqlite3
 import json
+import collections
 from time import sleep
 import msgpack
 import logging
@@ -19,9 +20,60 @@ if not hasattr(json, "decoder"):
     json.decoder = Decoder
 
 
+class GeneCache:
+
+    """Size-bounded LRU cache for the decoded genes. When full, the least recently used gene is dropped.
+    A maxsize of None or 0 makes the cache unbounded."""
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.__data = collections.OrderedDict()
+
+    def __contains__(self, item):
+        return item in self.__data
+
+    def __getitem__(self, item):
+        self.__data.move_to_end(item)
+        return self.__data[item]
+
+    def __setitem__(self, item, value):
+        self.__data[item] = value
+        self.__data.move_to_end(item)
+        if self.maxsize and len(self.__data) > self.maxsize:
+            self.__data.popitem(last=False)
+
+    def __len__(self):
+        return len(self.__data)
+
+    def clear(self):
+        self.__data.clear()
+
+
+def load_gene(jdict, logger=None, exclude_utr=False, protein_coding=False):
+    """Function to load a finalised gene from its serialised form in the index.
+    :param jdict: the msgpack (or, for old indices, JSON) blob, or the already decoded dictionary.
+    :param logger: optional logger for the gene.
+    :param exclude_utr: boolean flag. If set, the UTRs will be removed from the transcripts.
+    :param protein_coding: boolean flag. If set, only coding transcripts will be kept.
+    :rtype: Gene
+    """
+
+    gene = Gene(None, logger=logger)
+    if not isinstance(jdict, dict):
+        try:
+            jdict = msgpack.loads(jdict, raw=False)
+        except TypeError:
+            jdict = json.loads(jdict)
+
+    gene.load_dict(jdict, exclude_utr=exclude_utr, protein_coding=protein_coding)
+    gene.finalize()
+    return gene
+
+
 class GeneDict:
 
-    def __init__(self, dbname: str, logger=None, exclude_utr=False, check=True, protein_coding=False):
+    def __init__(self, dbname: str, logger=None, exclude_utr=False, check=True, protein_coding=False,
+                 cache_size=None):
 
         self.__dbname = dbname
         self.__logger = create_null_logger()
@@ -35,7 +87,8 @@ class GeneDict:
         self.__protein_coding = protein_coding
         self.__db = sqlite3.connect("file:{}?mode=ro".format(self.__dbname), uri=True)
         self.__cursor = self.__db.cursor()
-        self.__cache = dict()
+        self.__cache = GeneCache(cache_size)
+        self.__prefetched = dict()
 
     @property
     def logger(self):
@@ -63,6 +116,10 @@ class GeneDict:
 
         if item in self.__cache:
             return self.__cache[item]
+        elif item in self.__prefetched:
+            gene = self.__load_gene(self.__prefetched[item])
+            self.__cache[item] = gene
+            return gene
 
         failed = 0
         while True:
@@ -86,16 +143,34 @@ class GeneDict:
             return None
 
     def __load_gene(self, jdict):
-        gene = Gene(None, logger=self.logger)
-        if not isinstance(jdict, dict):
-            try:
-                jdict = msgpack.loads(jdict, raw=False)
-            except TypeError:
-                jdict = json.loads(jdict)
-
-        gene.load_dict(jdict, exclude_utr=self.__exclude_utr, protein_coding=self.__protein_coding)
-        gene.finalize()
-        return gene
+        return load_gene(jdict, logger=self.logger,
+                         exclude_utr=self.__exclude_utr, protein_coding=self.__protein_coding)
+
+    def is_loaded(self, gid):
+        """Method to check whether a gene can be retrieved without querying the index, ie whether it is
+        in the cache or among the prefetched genes.
+        :param gid: the ID of the gene.
+        """
+
+        return gid in self.__cache or gid in self.__prefetched
+
+    def prefetch(self, chrom, start, end):
+        """Method to retrieve with a single query the genes overlapping a window of the genome, replacing
+        those previously prefetched. The genes are decoded only when requested.
+        :param chrom: chromosome of the window.
+        :param start: start of the window.
+        :param end: end of the window.
+        """
+
+        self.__prefetched = dict(self.__cursor.execute(
+            " ".join(["SELECT genes.gid, genes.json FROM positions JOIN genes ON positions.gid = genes.gid",
+                      "WHERE positions.chrom = ? AND positions.start <= ? AND positions.end >= ?"]),
+            (chrom, end, start)))
+
+    def clear_cache(self):
+        """Method to drop all the genes kept in memory."""
+        self.__cache.clear()
+        self.__prefetched = dict()
 
     def load_all(self):
 
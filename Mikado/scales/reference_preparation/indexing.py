@@ -1,4 +1,5 @@
 import sqlite3
+import struct
 from ...utilities.file_type import filetype
 from ...exceptions import CorruptIndex
 import collections
@@ -98,6 +99,18 @@ def check_index(reference, queue_logger):
         queue_logger.warning("Old index format detected. Starting to generate a new one.")
         raise CorruptIndex("Invalid index file")
 
+    from .binary_index import index_version, BinaryIndex
+    if index_version(reference) == 2:
+        try:
+            index = BinaryIndex(reference)
+            gid = next(iter(index), None)
+            if gid is None or len(index[gid].transcripts) == 0:
+                raise CorruptIndex("Invalid value for genes, indicating a corrupt index. Deleting and rebuilding.")
+            index.close()
+        except (ValueError, KeyError, TypeError, IndexError, struct.error, msgpack.UnpackException):
+            raise CorruptIndex("Invalid binary index file")
+        return
+
     try:
         conn = sqlite3.connect(reference)
         cursor = conn.cursor()
@@ -125,9 +138,10 @@ def check_index(reference, queue_logger):
 
 
 def create_index(reference, queue_logger, index_name, ref_gff=False,
-                 exclude_utr=False, protein_coding=False):
+                 exclude_utr=False, protein_coding=False, version=1):
 
-    """Method to create the simple indexed database for features."""
+    """Method to create the simple indexed database for features.
+    With version 2, the index will be a binary file (see binary_index) rather than a SQLite database."""
 
     temp_db = tempfile.mktemp(suffix=".db")
     queue_logger.info("Starting to create an index for %s", reference.name)
@@ -141,9 +155,6 @@ def create_index(reference, queue_logger, index_name, ref_gff=False,
                 "I cannot delete the old index, due to permission errors. Please investigate and relaunch.")
             sys.exit(1)
 
-    conn = sqlite3.connect(temp_db)
-    cursor = conn.cursor()
-    cursor.execute("CREATE TABLE positions (chrom text, start integer, end integer, gid text)")
     try:
         genes, positions = prepare_reference(reference, queue_logger, ref_gff=ref_gff,
                                              exclude_utr=exclude_utr, protein_coding=protein_coding)
@@ -153,6 +164,18 @@ def create_index(reference, queue_logger, index_name, ref_gff=False,
         queue_logger.critical(exc)
         raise
 
+    if version == 2:
+        from .binary_index import write_binary_index
+        write_binary_index(genes, positions, temp_db, logger=queue_logger)
+        shutil.copy(temp_db, index_name)
+        os.remove(temp_db)
+        queue_logger.info("Finished to create an index for %s in %s", reference.name, index_name)
+        return
+
+    conn = sqlite3.connect(temp_db)
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE positions (chrom text, start integer, end integer, gid text)")
+
     gid_vals = []
     for chrom in positions:
         for key in positions[chrom]:
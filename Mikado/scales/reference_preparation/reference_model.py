@@ -0,0 +1,257 @@
+"""
+This module contains the functions to build a read-only model of an indexed reference, and the class to read it back.
+The model is built once for each index (and combination of the exclude_utr/protein_coding flags) and saved next to it;
+all the processes of a multi-process mikado compare then memory-map it, sharing its pages, instead of each opening
+the SQLite index and, for the process printing the RefMap and statistics, decoding every reference gene.
+
+The layout of the file is the following:
+
+- a header, with a magic string and the position and length of the index;
+- for each gene, the serialised gene as stored in the SQLite index;
+- the positions of the genes, as in the "positions" table of the index;
+- for each gene, the ID, chromosome, strand, exons, introns, start and end of its transcripts, after applying the
+  exclude_utr/protein_coding flags: this is all the Accountant needs to build its reference tables;
+- the index, a msgpack dictionary with the position of each gene and section, and the parameters of the model.
+"""
+
+import collections
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import msgpack
+from ...utilities.log_utils import create_null_logger
+from .gene_dict import load_gene, GeneCache
+
+
+__author__ = 'Luca Venturini'
+
+
+magic = b"MIKREFM1"
+_header = struct.Struct("<8sQQ")
+
+
+class ReferenceTranscript(collections.namedtuple(
+        "ReferenceTranscript", ["id", "chrom", "strand", "exons", "introns", "start", "end"])):
+
+    """Lightweight, read-only version of a reference transcript, with the attributes used by the Accountant."""
+
+    __slots__ = ()
+
+    @property
+    def exon_num(self):
+        return len(self.exons)
+
+    @property
+    def location(self):
+        """Web-apollo compatible string for the location of the transcript."""
+        return "{}:{}..{}".format(self.chrom, self.start, self.end)
+
+
+def model_params(index: str, exclude_utr=False, protein_coding=False) -> dict:
+    """Function to retrieve the parameters which identify a reference model: the size and modification time
+    of the index it derives from, and the flags used to load the genes.
+    :param index: the SQLite index of the reference.
+    :param exclude_utr: boolean flag, whether the UTRs are removed from the reference transcripts.
+    :param protein_coding: boolean flag, whether only coding transcripts are kept.
+    """
+
+    stat = os.stat(index)
+    return {"index_size": stat.st_size,
+            "index_mtime": stat.st_mtime_ns,
+            "exclude_utr": bool(exclude_utr),
+            "protein_coding": bool(protein_coding)}
+
+
+def build_model(index: str, filename: str, exclude_utr=False, protein_coding=False, logger=None):
+    """Function to build the reference model of an index. Each gene is decoded and finalised only once.
+
+    :param index: the SQLite index of the reference.
+    :param filename: the model file to write.
+    :param exclude_utr: boolean flag. If set, the UTRs will be removed from the reference transcripts.
+    :param protein_coding: boolean flag. If set, only coding transcripts will be kept.
+    :param logger: optional logger.
+    """
+
+    if logger is None:
+        logger = create_null_logger()
+    model_index = {"params": model_params(index, exclude_utr=exclude_utr, protein_coding=protein_coding),
+                   "genes": []}
+    transcripts = []
+    conn = sqlite3.connect("file:{}?mode=ro".format(index), uri=True)
+    temp_name = "{}.{}.tmp".format(filename, os.getpid())
+    try:
+        with open(temp_name, "wb") as out:
+            out.write(_header.pack(magic, 0, 0))
+            # Same order as the iteration over GeneDict, which goes through the index on the gene IDs
+            for gid, blob in conn.execute("SELECT gid, json FROM genes ORDER BY gid, rowid"):
+                model_index["genes"].append([gid, out.tell(), len(blob)])
+                out.write(blob)
+                gene = load_gene(blob, logger=logger, exclude_utr=exclude_utr, protein_coding=protein_coding)
+                transcripts.append([gid, [[transcr.id, transcr.chrom, transcr.strand,
+                                           [list(exon) for exon in transcr.exons],
+                                           sorted(list(intron) for intron in transcr.introns),
+                                           transcr.start, transcr.end] for transcr in gene]])
+            positions = [list(row) for row in conn.execute("SELECT chrom, start, end, gid FROM positions")]
+            for key, section in (("positions", positions), ("transcripts", transcripts)):
+                packed = msgpack.packb(section, use_bin_type=True)
+                model_index[key] = [out.tell(), len(packed)]
+                out.write(packed)
+            packed = msgpack.packb(model_index, use_bin_type=True)
+            index_start = out.tell()
+            out.write(packed)
+            out.seek(0)
+            out.write(_header.pack(magic, index_start, len(packed)))
+        os.replace(temp_name, filename)
+    finally:
+        conn.close()
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+    logger.info("Created the reference model %s, with %d genes", filename, len(model_index["genes"]))
+
+
+def prepare_model(index: str, args, logger=None):
+    """Function to retrieve the reference model of an index, building it if it is missing or obsolete.
+    The model is saved as <index>.model; if that is not possible, a temporary one is created instead.
+
+    :param index: the SQLite index of the reference.
+    :param args: the Namespace with the parameters of mikado compare (exclude_utr, protein_coding).
+    :param logger: optional logger.
+    :returns: the name of the model file, and a boolean flag indicating whether it is temporary. A binary index
+    can be shared as it is, so for it the name will be None.
+    """
+
+    if logger is None:
+        logger = create_null_logger()
+    from .binary_index import index_version
+    if index_version(index) == 2:
+        logger.info("The reference index is binary, no model needed.")
+        return None, False
+    exclude_utr, protein_coding = getattr(args, "exclude_utr", False), getattr(args, "protein_coding", False)
+    filename = "{}.model".format(index)
+    if os.path.exists(filename):
+        try:
+            model = ReferenceModel(filename)
+            params = model.params
+            model.close()
+        except (ValueError, OSError, struct.error, msgpack.UnpackException):
+            params = None
+        if params == model_params(index, exclude_utr=exclude_utr, protein_coding=protein_coding):
+            logger.info("Reference model found, proceeding.")
+            return filename, False
+        logger.info("Reference model obsolete, rebuilding.")
+
+    try:
+        build_model(index, filename, exclude_utr=exclude_utr, protein_coding=protein_coding, logger=logger)
+        return filename, False
+    except OSError as exc:
+        logger.warning(exc)
+        logger.warning("I cannot save the reference model next to the index. I will create a temporary one instead.")
+        handle, filename = tempfile.mkstemp(suffix=".model")
+        os.close(handle)
+        build_model(index, filename, exclude_utr=exclude_utr, protein_coding=protein_coding, logger=logger)
+        return filename, True
+
+
+class ReferenceModel:
+
+    """Class to read a reference model, created by build_model. It exposes the same interface as GeneDict
+    (positions, item retrieval, iteration) and, additionally, the reference transcripts in a lightweight form.
+    The file is memory-mapped, so that all the processes reading it share the same pages."""
+
+    def __init__(self, filename: str, logger=None, cache_size=None):
+
+        self.filename = filename
+        self.__logger = create_null_logger()
+        self.logger = logger
+        self.__cache = GeneCache(cache_size)
+        self.__transcripts = None
+        self.__handle = open(self.filename, "rb")
+        self.__map = mmap.mmap(self.__handle.fileno(), 0, access=mmap.ACCESS_READ)
+        found_magic, index_start, index_length = _header.unpack_from(self.__map, 0)
+        if found_magic != magic:
+            self.close()
+            raise ValueError("{} is not a valid Mikado reference model".format(self.filename))
+        index = msgpack.unpackb(self.__map[index_start:index_start + index_length], raw=False)
+        self.params = index["params"]
+        self.__genes = dict((gid, (start, length)) for gid, start, length in index["genes"])
+        self.__sections = {"positions": index["positions"], "transcripts": index["transcripts"]}
+
+    @property
+    def logger(self):
+        return self.__logger
+
+    @logger.setter
+    def logger(self, logger):
+        if logger is None:
+            self.__logger = create_null_logger()
+        elif not isinstance(logger, logging.Logger):
+            raise TypeError("Invalid logger")
+        else:
+            self.__logger = logger
+
+    def close(self):
+        """Method to close the memory map and the underlying file."""
+        self.__map.close()
+        self.__handle.close()
+
+    def __section(self, key):
+        start, length = self.__sections[key]
+        return msgpack.unpackb(self.__map[start:start + length], raw=False)
+
+    @property
+    def positions(self):
+        return iter(tuple(row) for row in self.__section("positions"))
+
+    def __getitem__(self, item):
+
+        if item in self.__cache:
+            return self.__cache[item]
+        position = self.__genes.get(item, None)
+        if position is None:
+            return None
+        start, length = position
+        gene = load_gene(self.__map[start:start + length], logger=self.logger,
+                         exclude_utr=self.params["exclude_utr"], protein_coding=self.params["protein_coding"])
+        self.__cache[item] = gene
+        return gene
+
+    def clear_cache(self):
+        """Method to drop all the decoded genes kept in memory."""
+        self.__cache.clear()
+
+    def __iter__(self):
+        return iter(self.__genes)
+
+    def __len__(self):
+        return len(self.__genes)
+
+    def items(self):
+
+        for gid in self:
+            yield (gid, self[gid])
+
+    def reference_transcripts(self):
+        """Method to iterate over the genes, with the list of their transcripts as ReferenceTranscript
+        instances, without decoding the genes."""
+
+        if self.__transcripts is None:
+            self.__transcripts = dict()
+            for gid, transcripts in self.__section("transcripts"):
+                self.__transcripts[gid] = [
+                    ReferenceTranscript(tid, chrom, strand, [tuple(exon) for exon in exons],
+                                        [tuple(intron) for intron in introns], start, end)
+                    for tid, chrom, strand, exons, introns, start, end in transcripts]
+        return iter(self.__transcripts.items())
+
+    def location(self, gid, tid):
+        """Method to retrieve the location of a reference transcript, without decoding its gene."""
+
+        if self.__transcripts is None:
+            self.reference_transcripts()
+        for transcript in self.__transcripts[gid]:
+            if transcript.id == tid:
+                return transcript.location
+        raise KeyError((gid, tid))
@@ -6,7 +6,7 @@ import os
 import logging.handlers as logging_handlers
 import logging
 from sqlalchemy.orm.session import Session
-from ...utilities.dbutils import DBBASE
+from ...utilities.dbutils import DBBASE, Inspector
 import pysam
 from ...utilities.dbutils import connect
 from ...utilities.log_utils import create_null_logger, check_logger
@@ -87,6 +87,8 @@ class BlastSerializer:
 
         self._max_target_seqs = configuration.serialise.max_target_seqs
         self.maxobjects = configuration.serialise.max_objects
+        self.compact_match = configuration.serialise.compact_match
+        self.tabular_chunk_size = configuration.serialise.tabular_chunk_size
         target_seqs = configuration.serialise.files.blast_targets
         query_seqs = configuration.serialise.files.transcripts
 
@@ -241,12 +243,13 @@ class BlastSerializer:
         self.logger.info("Started to serialise the targets")
         for target in self.target_seqs:
             for record, length in zip(target.references, target.lengths):
-                if record in targets and targets[record][1] is True:
+                if record in targets and targets[record][1] == length:
+                    # Already loaded, eg by mikado serialise --pipeline before starting the stages
                     continue
                 elif record in targets:
                     self.session.query(Target).filter(Target.target_name == record).update(
                         {"target_length": length})
-                    targets[record] = (targets[record][0], True)
+                    targets[record] = (targets[record][0], length)
                     continue
 
                 objects.append({
@@ -351,13 +354,17 @@ class BlastSerializer:
         """
         Alias for serialize
         """
-        [idx.drop(bind=self.engine) for idx in Hit.__table__.indexes]
-        [idx.drop(bind=self.engine) for idx in Hsp.__table__.indexes]
+        # Indexes missing from the database (eg in bulk-load mode) are left to be built at the end
+        inspector = Inspector.from_engine(self.engine)
+        indexes = []
+        for table in (Hit.__table__, Hsp.__table__):
+            present = set(index["name"] for index in inspector.get_indexes(table.name))
+            indexes.extend(idx for idx in table.indexes if idx.name in present)
+        [idx.drop(bind=self.engine) for idx in indexes]
         self.engine.execute("PRAGMA foreign_keys=OFF")
         self.serialize()
         # Recreate the indices
-        [idx.create(bind=self.engine) for idx in Hit.__table__.indexes]
-        [idx.create(bind=self.engine) for idx in Hsp.__table__.indexes]
+        [idx.create(bind=self.engine) for idx in indexes]
         self.engine.execute("PRAGMA foreign_keys=ON")
 
 # pylint: enable=too-many-instance-attributes
@@ -92,3 +92,78 @@ cpdef parse_btop(str btop, Py_ssize_t qpos, Py_ssize_t spos,
     fmatch = fmatch.decode()
 
     return query_array, target_array, aln_span, fmatch
+
+
+@cython.wraparound(False)
+@cython.cdivision(True)
+@cython.boundscheck(False)
+cpdef parse_btop_intervals(str btop, long qpos, long spos, dict matrix, long qmult=3, long tmult=1):
+
+    """Parse the BTOP line of a tabular BLASTX/DIAMOND HSP without materialising per-position arrays.
+    The aligned stretches on the query and on the target are always contiguous, so only their end
+    is reported; identical and positive positions on the query are reported as lists of half-open
+    intervals, with contiguous intervals merged.
+
+    :returns: aln_span, match, query end, target end, identical intervals, positive intervals
+    :rtype: (int, str, int, int, list, list)
+    """
+
+    cdef str pos
+    cdef long ipos
+    cdef long aln_span = 0
+    cdef long step = min(qmult, tmult)
+    cdef string match
+    cdef Py_ssize_t idx
+    cdef list identical = []
+    cdef list positives = []
+
+    for pos in btop_pattern.findall(btop):
+        try:
+            ipos = int(pos)
+        except ValueError:
+            if len(pos) != 2:
+                raise ValueError(pos)
+            ipos = - 1
+        if ipos >= 0:
+            aln_span += step * ipos
+            for idx in range(step * ipos):
+                match.push_back(b"|")
+            if ipos > 0:
+                _add_interval(identical, qpos, qpos + ipos * qmult)
+                _add_interval(positives, qpos, qpos + ipos * qmult)
+            qpos += ipos * qmult
+            spos += ipos * tmult
+        else:
+            aln_span += step
+            if pos[0] == "-":  # Gap in query
+                spos += tmult
+                match.push_back(b"-")
+            elif pos[1] == "-":  # Gap in target
+                qpos += qmult
+                if pos[0] == "*":
+                    match.push_back(b"*")
+                else:
+                    match.push_back(b"_")
+            else:
+                if matrix.get(pos, -1) > 0:
+                    _add_interval(positives, qpos, qpos + qmult)
+                    match.push_back(b"+")
+                else:
+                    if pos[0] == "*" or pos[1] == "*":
+                        match.push_back(b"*")
+                    else:
+                        match.push_back(b"/")
+                qpos += qmult
+                spos += tmult
+
+    fmatch = <bytes>match
+    fmatch = fmatch.decode()
+
+    return aln_span, fmatch, qpos, spos, identical, positives
+
+
+cdef inline void _add_interval(list intervals, long start, long end):
+    if intervals and intervals[-1][1] == start:
+        intervals[-1] = (intervals[-1][0], end)
+    else:
+        intervals.append((start, end))
@@ -10,11 +10,40 @@ from sqlalchemy.ext.hybrid import hybrid_property  # hybrid_method
 from ...utilities.dbutils import DBBASE
 from . import Query, Target
 from .aln_string_parser import prepare_aln_strings
+import re
 
 
 __author__ = 'Luca Venturini'
 
 
+_match_runs = re.compile(r"(.)\1+")
+_encoded_runs = re.compile(r"(\d+)(\D)")
+_digit = re.compile(r"\d")
+
+
+def encode_match(match):
+    """Function to run-length encode a match line for compact storage, eg "|||||+/||" becomes "5|+/2|".
+    Match lines never contain digits, so encoded and plain lines can be told apart.
+    :param match: the match line, as created by prepare_hsp or by the BTOP parser.
+    :rtype: str
+    """
+
+    if not match:
+        return match
+    return _match_runs.sub(lambda run: "{}{}".format(len(run.group(0)), run.group(1)), match)
+
+
+def decode_match(match):
+    """Function to restore a match line stored in run-length encoded form. Plain match lines
+    are returned unchanged.
+    :rtype: str
+    """
+
+    if not match or _digit.search(match) is None:
+        return match
+    return _encoded_runs.sub(lambda run: run.group(2) * int(run.group(1)), match)
+
+
 class Hsp(DBBASE):
 
     r"""
@@ -182,7 +211,8 @@ class Hsp(DBBASE):
 
         state = dict().fromkeys(keys)
         for key in keys:
-            state[key] = getattr(state_obj, key)
+            state[key] = getattr(state_obj, key, None)
+        state["match"] = decode_match(state["match"])
         return state
 
     def as_dict(self):
@@ -203,7 +233,7 @@ class Hsp(DBBASE):
         state["target"] = self.target
         state["query_hsp_cov"] = self.query_hsp_cov
         state["target_hsp_cov"] = self.target_hsp_cov
-        state["match"] = self.match
+        state["match"] = decode_match(self.match)
 
         return state
 
@@ -3,23 +3,23 @@ import copy
 from typing import Union
 
 from Bio.Align import substitution_matrices
-from functools import partial
-from .btop_parser import parse_btop
+from .btop_parser import parse_btop, parse_btop_intervals
 import re
 import numpy as np
 import pandas as pd
 import multiprocessing as mp
-from .utils import load_into_db
-from collections import defaultdict
+from .utils import load_into_db, compact_hsps
 import logging
 import logging.handlers
 
 from ...configuration import MikadoConfiguration, DaijinConfiguration
 from ...utilities.log_utils import create_null_logger, create_queue_logger
+from ...exceptions import InvalidSerialization
 from sqlalchemy.orm.session import Session
-from ...utilities.dbutils import connect as db_connect
+from ...utilities.dbutils import connect as db_connect, merge_databases
 from . import Hit, Hsp
 import os
+import sqlite3
 import tempfile
 import msgpack
 from ...utilities import blast_keys
@@ -256,6 +256,150 @@ def prepare_tab_hit(key: tuple,
     return hit_list, hsps
 
 
+def _union_lengths(codes: np.ndarray, starts: np.ndarray, ends: np.ndarray, size: int) -> np.ndarray:
+    """Function to calculate, for each group, the total length covered by the union of its half-open
+    intervals, without looping over the groups.
+    :param codes: group of each interval, as an integer between 0 and size - 1
+    :param starts: start of each interval
+    :param ends: end of each interval
+    :param size: number of groups
+    :return: array with the covered length of each group
+    """
+
+    if codes.shape[0] == 0:
+        return np.zeros(size, dtype=int)
+    order = np.lexsort((starts, codes))
+    codes, starts, ends = codes[order], starts[order], ends[order]
+    # Furthest point reached by the previous intervals of the same group
+    reach = pd.Series(ends).groupby(codes).cummax().values
+    previous = np.roll(reach, 1)
+    first = np.r_[True, codes[1:] != codes[:-1]]
+    previous[first] = starts[first]
+    covered = np.maximum(0, ends - np.maximum(starts, previous))
+    return np.bincount(codes, weights=covered, minlength=size).astype(int)
+
+
+def prepare_tab_data(data: pd.DataFrame, matrix_name=None, qmult=3, tmult=1):
+    """Function to prepare all the hits and HSPs of a sanitised tabular BLAST table for loading into the DB.
+    Only the BTOP strings are parsed one by one; all the per-hit aggregates (coverage, identity,
+    boundaries) are calculated with array operations over the merged intervals of the HSPs.
+    :param data: the table, as produced by sanitize_blast_data
+    :param matrix_name: name of the substitution matrix used to calculate the positives
+    :param qmult: query multiplier
+    :param tmult: target multiplier
+    :return: the hits and the HSPs, as lists of values in the order of the columns of the tables
+    :rtype: (list[list], list[list])
+    """
+
+    if data.shape[0] == 0:
+        return [], []
+    matrix = matrices.get(matrix_name, matrices["blosum62"])
+    codes = data.groupby([data["qid"].values, data["sid"].values], sort=False).ngroup().values
+    order = np.argsort(codes, kind="stable")
+    data, codes = data.iloc[order], codes[order]
+    num_hits = int(codes.max()) + 1
+    qstarts, sstarts = data["qstart"].values.astype(int), data["sstart"].values.astype(int)
+    qlengths, slengths = data["qlength"].values.astype(int), data["slength"].values.astype(int)
+    if (qstarts < 0).any():
+        raise ValueError(qstarts[qstarts < 0])
+
+    spans = np.zeros(data.shape[0], dtype=int)
+    qends, sends = np.zeros(data.shape[0], dtype=int), np.zeros(data.shape[0], dtype=int)
+    matches = []
+    intervals = {"identical": ([], [], []), "positives": ([], [], [])}
+    for row, (btop, qpos, spos) in enumerate(zip(data["btop"].values, qstarts.tolist(), sstarts.tolist())):
+        spans[row], match, qends[row], sends[row], identical, positives = parse_btop_intervals(
+            str(btop), qpos, spos, matrix, qmult, tmult)
+        matches.append(match)
+        for key, found in (("identical", identical), ("positives", positives)):
+            rows, starts, ends = intervals[key]
+            rows.extend([row] * len(found))
+            for start, end in found:
+                starts.append(start)
+                ends.append(end)
+
+    # Positions beyond the end of the sequences are not counted
+    qends, sends = np.minimum(qends, qlengths), np.minimum(sends, slengths)
+    if (qends <= qstarts).any():
+        raise ValueError(data["btop"].values[qends <= qstarts])
+    lengths = data["length"].values.astype(int)
+    if (spans != lengths).any():
+        raise ValueError((spans[spans != lengths], lengths[spans != lengths]))
+
+    counts, unions = dict(), dict()
+    for key, (rows, starts, ends) in intervals.items():
+        rows = np.array(rows, dtype=int)
+        starts = np.minimum(np.array(starts, dtype=int), qlengths[rows])
+        ends = np.minimum(np.array(ends, dtype=int), qlengths[rows])
+        counts[key] = np.bincount(rows, weights=ends - starts, minlength=data.shape[0])
+        unions[key] = _union_lengths(codes[rows], starts, ends, num_hits)
+
+    hsp_identity = counts["identical"] / (spans * qmult) * 100
+    hsp_positives = counts["positives"] / (spans * qmult) * 100
+    q_aligned = _union_lengths(codes, qstarts, qends, num_hits)
+    t_aligned = _union_lengths(codes, sstarts, sends, num_hits)
+    by_hit = pd.DataFrame({"code": codes, "qstart": qstarts, "qend": qends, "sstart": sstarts, "send": sends,
+                           "qend_ok": qends == data["qend"].values.astype(int),
+                           "send_ok": sends == data["send"].values.astype(int)}).groupby("code").agg(
+        query_start=pd.NamedAgg("qstart", "min"), query_end=pd.NamedAgg("qend", "max"),
+        target_start=pd.NamedAgg("sstart", "min"), target_end=pd.NamedAgg("send", "max"),
+        qend_ok=pd.NamedAgg("qend_ok", "any"), send_ok=pd.NamedAgg("send_ok", "any"))
+    # As in prepare_tab_hit, the end of the hit must coincide with the declared end of one of its HSPs
+    if not by_hit.qend_ok.all():
+        raise ValueError("Invalid end point for {} hits".format((~by_hit.qend_ok).sum()))
+    if not by_hit.send_ok.all():
+        raise ValueError("Invalid target end point for {} hits".format((~by_hit.send_ok).sum()))
+
+    first = np.unique(codes, return_index=True)[1]
+    hit_values = {
+        "query_id": data["qid"].values[first].astype(int),
+        "target_id": data["sid"].values[first].astype(int),
+        "evalue": data["min_evalue"].values[first],
+        "bits": data["max_bitscore"].values[first],
+        "global_identity": unions["identical"] * 100 / q_aligned,
+        "global_positives": unions["positives"] * 100 / q_aligned,
+        "query_start": by_hit.query_start.values,
+        "query_end": by_hit.query_end.values,
+        "target_start": by_hit.target_start.values,
+        "target_end": by_hit.target_end.values,
+        "hit_number": data["hit_num"].values[first].astype(int),
+        "query_multiplier": np.repeat(int(qmult), num_hits),
+        "target_multiplier": np.repeat(int(tmult), num_hits),
+        "query_aligned_length": np.minimum(qlengths[first], q_aligned),
+        "target_aligned_length": np.minimum(slengths[first], t_aligned)}
+    hsp_values = {
+        "counter": data["hsp_num"].values.astype(int),
+        "query_id": data["qid"].values.astype(int),
+        "target_id": data["sid"].values.astype(int),
+        "query_hsp_start": qstarts,
+        "query_hsp_end": data["qend"].values.astype(int),
+        "query_frame": data["query_frame"].values.astype(int),
+        "target_hsp_start": sstarts,
+        "target_hsp_end": data["send"].values.astype(int),
+        "target_frame": data["target_frame"].values.astype(int),
+        "match": matches,
+        "hsp_evalue": data["evalue"].values,
+        "hsp_bits": data["bitscore"].values,
+        "hsp_identity": hsp_identity,
+        "hsp_positives": hsp_positives,
+        "hsp_length": lengths}
+    hits = [list(hit) for hit in zip(*[np.asarray(hit_values[col]).tolist() for col in hit_cols])]
+    hsps = [list(hsp) for hsp in zip(*[np.asarray(hsp_values[col]).tolist() for col in hsp_cols])]
+    return hits, hsps
+
+
+def split_tab_data(data: pd.DataFrame, chunks: int):
+    """Generator to split a sanitised tabular BLAST table, sorted by query and target, into (at most) the
+    requested number of consecutive chunks of similar size, without breaking any hit across chunks."""
+
+    keys = data[["qid", "sid"]].values
+    starts = np.r_[np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]).any(axis=1)]), data.shape[0]]
+    cuts = np.linspace(0, data.shape[0], max(chunks, 1) + 1)[1:-1]
+    bounds = np.unique(np.r_[0, starts[np.searchsorted(starts, cuts)], data.shape[0]])
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        yield data.iloc[start:end]
+
+
 id_pattern = re.compile(r"^[^\|]*\|([^\|]*)\|.*")
 
 
@@ -324,16 +468,16 @@ class Preparer(mp.Process):
     def __init__(self,
                  index_file: str,
                  identifier: int,
-                 params_file: str,
                  lock: mp.RLock,
                  conf: Union[MikadoConfiguration,DaijinConfiguration],
                  maxobjects: int,
                  logging_queue=None,
                  log_level="DEBUG",
                  sql_level="DEBUG",
-                 matrix_name=None, qmult=3, tmult=1, **kwargs):
+                 matrix_name=None, qmult=3, tmult=1, staging_db=None, **kwargs):
 
         super().__init__()
+        self.staging_db = staging_db
         self.matrix_name = matrix_name
         self.qmult, self.tmult = qmult, tmult
         self.identifier = identifier
@@ -341,20 +485,24 @@ class Preparer(mp.Process):
         self.lock = lock
         self.maxobjects = maxobjects
         self.conf = conf
-        self.params_file, self.index_file = params_file, index_file
+        self.compact_match = conf.serialise.compact_match
+        self.index_file = index_file
         if logging_queue is None:
             self.logger = create_null_logger("preparer-{}".format(self.identifier))  # create_null_logger
             self.logging_queue = None
         else:
             self.logging_queue = logging_queue
 
+    def __prepared_batches(self):
+        """Private generator to read the chunk of the table assigned to the process and yield the
+        hits and HSPs ready for serialisation, in batches of approximately maxobjects rows."""
+
+        with open(self.index_file, "rb") as index_handle:
+            data = pd.DataFrame(msgpack.load(index_handle, raw=False, strict_map_key=False))
+        for batch in split_tab_data(data, int(np.ceil(data.shape[0] / self.maxobjects))):
+            yield prepare_tab_data(batch, matrix_name=self.matrix_name, qmult=self.qmult, tmult=self.tmult)
+
     def run(self):
-        with open(self.params_file, "rb") as pfile:
-            params = msgpack.loads(pfile.read(), raw=False, strict_map_key=False)
-        self.columns = params["columns"]
-        prep_hit = partial(prepare_tab_hit,
-                           columns=self.columns, qmult=self.qmult, tmult=self.tmult,
-                           matrix_name=self.matrix_name)
         if self.logging_queue is not None:
             create_queue_logger(self)
             sql_logger = logging.getLogger("sqlalchemy.engine")
@@ -362,22 +510,122 @@ class Preparer(mp.Process):
             sql_logger.addHandler(self.logger.handlers[0])
         else:
             sql_logger = None
-        self.engine = db_connect(self.conf, logger=sql_logger)
         self.logger.debug("Started %s", self.identifier)
-        session = Session(bind=self.engine)
-        self.session = session
-        hits, hsps = [], []
-        with open(self.index_file, "rb") as index_handle:
-            for key, rows in msgpack.Unpacker(index_handle, raw=False, strict_map_key=False):
-                curr_hit, curr_hsps = prep_hit(key, rows)
-                hits.append(curr_hit)
-                hsps += curr_hsps
-                hits, hsps = load_into_db(self, hits, hsps, force=False, raw=True)
-        _, _ = load_into_db(self, hits, hsps, force=True, raw=True)
+        if self.staging_db is not None:
+            self.__load_into_staging()
+        else:
+            self.engine = db_connect(self.conf, logger=sql_logger)
+            session = Session(bind=self.engine)
+            self.session = session
+            for hits, hsps in self.__prepared_batches():
+                load_into_db(self, hits, hsps, force=True, raw=True)
         self.logger.debug("Finished %s", self.identifier)
         os.remove(self.index_file)  # Clean it up
         return True
 
+    def __load_into_staging(self):
+        """Private method to write the hits and HSPs into a private staging SQLite database, without
+        any locking. The staging tables have no types nor constraints; the main process will copy
+        their contents into the main database at the end."""
+
+        connection = sqlite3.connect(self.staging_db)
+        connection.execute("PRAGMA synchronous=OFF")
+        connection.execute("PRAGMA journal_mode=OFF")
+        statements = dict()
+        for table, cols in (("hit", hit_cols), ("hsp", hsp_cols)):
+            connection.execute("CREATE TABLE {} ({})".format(table, ", ".join('"{}"'.format(col) for col in cols)))
+            statements[table] = "INSERT INTO {} VALUES ({})".format(table, ", ".join("?" for _ in cols))
+        for hits, hsps in self.__prepared_batches():
+            connection.executemany(statements["hit"], hits)
+            connection.executemany(statements["hsp"], compact_hsps(hsps) if self.compact_match else hsps)
+        connection.commit()
+        connection.close()
+
+
+def query_grouped_chunks(reader, seen=None):
+    """Generator to regroup the chunks of a tabular BLAST file, as read by pandas, so that each of them
+    contains only complete queries: the rows of the last query of each chunk are carried over to the next.
+    The file must be grouped by query (as BLAST and DIAMOND produce it); if a query is found again after
+    its rows have been already processed, an InvalidSerialization exception will be raised.
+    :param reader: iterable of DataFrames, eg pd.read_csv(..., chunksize=...)
+    :param seen: optional set of the queries already processed, updated in place
+    """
+
+    seen = set() if seen is None else seen
+    carry = None
+    for chunk in reader:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if chunk.shape[0] == 0:
+            continue
+        qids = chunk["qseqid"].values
+        found = pd.unique(qids)
+        if 1 + (qids[1:] != qids[:-1]).sum() != found.shape[0] or seen.intersection(found):
+            raise InvalidSerialization(
+                "The tabular BLAST file is not grouped by query, it cannot be read in chunks. \
+Please sort it by query (eg sort -s -k1,1) or disable the chunked reading.")
+        last = (qids == qids[-1])
+        carry = chunk[last]
+        if (~last).any():
+            seen.update(found[:-1])
+            yield chunk[~last]
+    if carry is not None:
+        seen.add(carry["qseqid"].values[0])
+        yield carry
+
+
+def _serialise_tab_data_parallel(self, data: pd.DataFrame, bname: str, procs: int, **kwargs):
+    """Private function to serialise a sanitised tabular BLAST table through multiple Preparer processes."""
+
+    conf = self.configuration.copy()
+    index_files = dict((idx, tempfile.mktemp(suffix=".mgp")) for idx in range(procs))
+    if conf.db_settings.dbtype == "sqlite":
+        # With SQLite, each worker writes into its own staging database, merged at the end:
+        # this avoids serialising all the writes through a lock.
+        lock = None
+        staging = dict((idx, tempfile.mktemp(suffix=".staging.db",
+                                             dir=os.path.dirname(os.path.abspath(conf.db_settings.db))))
+                       for idx in range(procs))
+    else:
+        lock = mp.RLock()
+        staging = dict((idx, None) for idx in range(procs))
+    kwargs.update({"conf": conf,
+                   "maxobjects": max(int(self.maxobjects / procs), 1),
+                   "lock": lock,
+                   "sql_level": self.configuration.log_settings.sql_level,
+                   "log_level": self.configuration.log_settings.log_level,
+                   "logging_queue": self.logging_queue})
+    processes = [Preparer(index_files[idx], idx, staging_db=staging[idx], **kwargs) for idx in range(procs)]
+
+    # Now we have to write down everything inside the temporary files, one chunk of whole hits per process
+    chunks = list(split_tab_data(data, procs))
+    for idx in range(procs):
+        with open(index_files[idx], "wb") as index:
+            if idx < len(chunks):
+                msgpack.dump(dict((col, chunks[idx][col].tolist()) for col in chunks[idx].columns), index)
+            else:
+                msgpack.dump(dict((col, []) for col in data.columns), index)
+        assert os.path.exists(index_files[idx])
+        processes[idx].start()
+
+    try:
+        res = [proc.join() for proc in processes]
+        failed = [proc.identifier for proc in processes if proc.exitcode != 0]
+        if failed:
+            self.logger.critical("Failed to serialise %s: worker(s) %s crashed.", bname,
+                                 ", ".join(str(_) for _ in failed))
+            raise InvalidSerialization("Failed to serialise {}".format(bname))
+        for idx in range(procs):
+            if staging[idx] is not None:
+                merge_databases(conf.db_settings.db, staging[idx], ["hit", "hsp"], logger=self.logger)
+    except KeyboardInterrupt:
+        raise KeyboardInterrupt
+    except Exception:
+        raise
+    finally:
+        [os.remove(staging_db) for staging_db in staging.values()
+         if staging_db is not None and os.path.exists(staging_db)]
+
 
 def parse_tab_blast(self,
                     bname: str,
@@ -386,6 +634,9 @@ def parse_tab_blast(self,
                     procs: int,
                     matrix_name="blosum62", qmult=3, tmult=1):
     """This function will use `pandas` to quickly parse, subset and analyse tabular BLAST files.
+    If the serialiser has a positive "tabular_chunk_size" attribute, the file will be streamed in chunks
+    of (approximately) that many rows, each containing only complete queries, so that the memory usage
+    does not depend on the size of the file.
     """
 
     matrix_name = matrix_name.lower()
@@ -393,26 +644,6 @@ def parse_tab_blast(self,
     if matrix_name not in matrices:
         raise KeyError("Matrix {} is not valid. Please specify a valid name.".format(matrix_name))
 
-    if procs > 1:
-        # We have to set up the processes before the forking.
-        lock = mp.RLock()
-        conf = self.configuration.copy()
-        params_file = tempfile.mktemp(suffix=".mgp")
-
-        index_files = dict((idx, tempfile.mktemp(suffix=".csv")) for idx in
-                           range(procs))
-        kwargs = {"conf": conf,
-                  "maxobjects": max(int(self.maxobjects / procs), 1),
-                  "lock": lock,
-                  "matrix_name": matrix_name,
-                  "qmult": qmult,
-                  "tmult": tmult,
-                  "sql_level": self.configuration.log_settings.sql_level,
-                  "log_level": self.configuration.log_settings.log_level,
-                  "logging_queue": self.logging_queue,
-                  "params_file": params_file}
-        processes = [Preparer(index_files[idx], idx, **kwargs) for idx in range(procs)]
-
     self.logger.info("Reading %s data", bname)
     # Compatibility with ASN files
     if isinstance(bname, str) and bname.endswith(("asn", "asn.gz", "asn.bz2")):
@@ -426,66 +657,40 @@ def parse_tab_blast(self,
 
         if bash is not None:
             formatter = sp.Popen('blast_formatter -outfmt "6 {blast_keys}" -archive <({catter} {bname})"'.format(
-                blast_keys=blast_keys, catter=catter, bname=bname), shell=True, executable=bash, stdout=sp.STDOUT)
+                blast_keys=blast_keys, catter=catter, bname=bname), shell=True, executable=bash, stdout=sp.PIPE)
         else:
             if catter != "cat":
                 temp = tempfile.NamedTemporaryFile(mode="wt", suffix=".asn")
                 sp.call("{catter} {bname}".format(bname=bname, catter=catter), shell=True, stdout=temp)
                 temp.flush()
             formatter = sp.Popen('blast_formatter -outfmt "6 {blast_keys}" -archive {temp}'.format(
-                blast_keys=blast_keys, catter=catter, bname=bname), shell=True, stdout=sp.STDOUT)
-        data = pd.read_csv(formatter.stdout, delimiter="\t", names=blast_keys)
+                blast_keys=blast_keys, catter=catter, bname=bname), shell=True, stdout=sp.PIPE)
+        source = formatter.stdout
     elif isinstance(bname, str) and bname.endswith("daa"):
         formatter = sp.Popen("diamond view -a {bname} --outfmt 6 {blast_keys}".format(
-            bname=bname, blast_keys=blast_keys), shell=True, stdout=sp.STDOUT)
-        data = pd.read_csv(formatter.stdout, delimiter="\t", names=blast_keys)
+            bname=bname, blast_keys=blast_keys), shell=True, stdout=sp.PIPE)
+        source = formatter.stdout
     else:
-        data = pd.read_csv(bname, delimiter="\t", names=blast_keys)
-
-    data = sanitize_blast_data(data, queries, targets, qmult=qmult, tmult=tmult)
-    columns = dict((col, idx) for idx, col in enumerate(data.columns))
-    groups = defaultdict(list)
-    [groups[val].append(idx) for idx, val in enumerate(data.index)]
-    values = data.values
-
-    if procs == 1:
-        prep_hit = partial(prepare_tab_hit, columns=columns, qmult=qmult, tmult=tmult,
-                           matrix_name=matrix_name)
-        hits, hsps = [], []
-        self.logger.info("Finished reading %s data, starting serialisation in single-threaded mode", bname)
-        for key, group in groups.items():
-            curr_hit, curr_hsps = prep_hit(key, values[group, :])
-            hits.append(curr_hit)
-            hsps += curr_hsps
-            hits, hsps = load_into_db(self, hits, hsps, force=False, raw=True)
-        hits, hsps = load_into_db(self, hits, hsps, force=True, raw=True)
-        assert len(hits) == 0 or isinstance(hits[0], dict), (hits[0], type(hits[0]))
-        assert len(hsps) >= len(hits), (len(hits), len(hsps), hits[0], hsps[0])
+        source = bname
+
+    chunk_size = getattr(self, "tabular_chunk_size", 0)
+    if chunk_size > 0:
+        self.logger.info("Reading %s in chunks of %d rows", bname, chunk_size)
+        # Fix the type of the identifier columns, as inferring it chunk by chunk could give inconsistent results
+        chunks = query_grouped_chunks(pd.read_csv(source, delimiter="\t", names=blast_keys, chunksize=chunk_size,
+                                                  dtype={"qseqid": str, "sseqid": str, "btop": str}))
     else:
-        self.logger.info("Finished reading %s data, starting serialisation with %d processors", bname, procs)
-        # Now we have to write down everything inside the temporary files.
-        # Params_name must contain: shape of the array, dtype of the array, columns
-        params = {"columns": columns}
-        with open(params_file, "wb") as pfile:
-            pfile.write(msgpack.dumps(params))
-        assert os.path.exists(params_file)
-        # Split the indices
-        for idx, split in enumerate(np.array_split(np.array(list(groups.items()),
-                                                            dtype=object), procs)):
-            with open(index_files[idx], "wb") as index:
-                for item in split:
-                    vals = (tuple(item[0]), values[item[1], :].tolist())
-                    msgpack.dump(vals, index)
-            assert os.path.exists(index_files[idx])
-            processes[idx].start()
-
-        try:
-            res = [proc.join() for proc in processes]
-        except KeyboardInterrupt:
-            raise KeyboardInterrupt
-        except Exception:
-            raise
-        finally:
-            os.remove(params_file)
+        chunks = [pd.read_csv(source, delimiter="\t", names=blast_keys)]
+
+    for data in chunks:
+        data = sanitize_blast_data(data, queries, targets, qmult=qmult, tmult=tmult)
+        if procs == 1:
+            self.logger.info("Finished reading %s data, starting serialisation in single-threaded mode", bname)
+            for batch in split_tab_data(data, int(np.ceil(data.shape[0] / self.maxobjects))):
+                hits, hsps = prepare_tab_data(batch, matrix_name=matrix_name, qmult=qmult, tmult=tmult)
+                load_into_db(self, hits, hsps, force=True, raw=True)
+        else:
+            self.logger.info("Finished reading %s data, starting serialisation with %d processors", bname, procs)
+            _serialise_tab_data_parallel(self, data, bname, procs, matrix_name=matrix_name, qmult=qmult, tmult=tmult)
 
     return
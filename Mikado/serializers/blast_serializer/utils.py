@@ -1,7 +1,25 @@
 from . import Hsp, Hit
+from .hsp import encode_match
+from ...utilities.dbutils import bulk_insert
 import sqlalchemy.exc
 
 
+_match_index = [column.name for column in Hsp.__table__.columns].index("match")
+
+
+def compact_hsps(hsps):
+    """Function to run-length encode, in place, the match lines of a list of HSPs, either dictionaries
+    or lists with the values of the columns in the order of the table."""
+
+    if hsps and isinstance(hsps[0], dict):
+        for hsp in hsps:
+            hsp["match"] = encode_match(hsp["match"])
+    else:
+        for hsp in hsps:
+            hsp[_match_index] = encode_match(hsp[_match_index])
+    return hsps
+
+
 def load_into_db(self, hits, hsps, force=False, raw=False):
     """
     :param hits:
@@ -11,6 +29,10 @@ def load_into_db(self, hits, hsps, force=False, raw=False):
     To be used at the end of the serialisation to load the final batch of data.
     :type force: bool
 
+    :param raw: boolean flag. If set, the data will be inserted without type processing (through
+    executemany on a raw cursor, for SQLite). The values must be already of the correct type.
+    :type raw: bool
+
     :return:
     """
 
@@ -24,10 +46,8 @@ def load_into_db(self, hits, hsps, force=False, raw=False):
     if tot_objects >= self.maxobjects or force:
         # Bulk load
         self.logger.debug("Loading %d BLAST objects into database", tot_objects)
-
-        if not hasattr(self, "hit_i_string"):
-            self.hit_i_string = str(Hit.__table__.insert(bind=self.engine).compile())
-            self.hsp_i_string = str(Hsp.__table__.insert(bind=self.engine).compile())
+        if getattr(self, "compact_match", False) is True:
+            compact_hsps(hsps)
 
         try:
             # pylint: disable=no-member
@@ -35,8 +55,8 @@ def load_into_db(self, hits, hsps, force=False, raw=False):
             if hasattr(self, "lock") and self.lock is not None:
                 self.lock.acquire()
             if raw is True:
-                self.engine.execute(self.hit_i_string, hits)
-                self.engine.execute(self.hsp_i_string, hsps)
+                bulk_insert(self.engine, Hit.__table__, hits)
+                bulk_insert(self.engine, Hsp.__table__, hsps)
             else:
                 self.engine.execute(Hit.__table__.insert(), hits)
                 self.engine.execute(Hsp.__table__.insert(), hsps)
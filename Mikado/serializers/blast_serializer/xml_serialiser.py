@@ -19,18 +19,144 @@ from .xml_utils import get_multipliers, get_off_by_one
 from .utils import load_into_db
 import multiprocessing as mp
 from ...utilities.log_utils import create_null_logger
+from ...exceptions import InvalidSerialization
 import pandas as pd
 import zlib
 import struct
+import gzip
+import io
+import mmap
+import shutil
+from ...parsers.blast_utils import xparser
 
 
 struct_row = struct.Struct(">LLL")
+# Minimum size of the byte ranges in which a single XML file is split for parallel parsing
+min_chunk_size = 2 ** 20
+_xml_footer = b"</BlastOutput_iterations>\n</BlastOutput>\n"
+
+
+def split_xml(filename: str, chunks: int, min_size=min_chunk_size):
+    """
+    Function to split an uncompressed BLAST XML file into byte ranges, at <Iteration> boundaries,
+    so that its records can be parsed by multiple processes.
+
+    :param filename: the uncompressed XML file.
+    :param chunks: the maximum number of ranges to create.
+    :param min_size: the minimum size of each range, in bytes.
+    :returns: the end of the XML header (ie the start of the first <Iteration>) and the list of byte ranges.
+    :rtype: (int, list)
+    """
+
+    with open(filename, "rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        header_end = mapped.find(b"<Iteration>")
+        end = mapped.rfind(b"</BlastOutput_iterations>")
+        if header_end < 0 or end < header_end:
+            return header_end, []
+        chunks = max(1, min(chunks, (end - header_end) // max(min_size, 1)))
+        step = (end - header_end) / chunks
+        boundaries = [header_end]
+        for num in range(1, chunks):
+            boundary = mapped.find(b"<Iteration>", max(int(header_end + num * step), boundaries[-1] + 1), end)
+            if boundary < 0:
+                break
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+        boundaries.append(end)
+    return header_end, list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _uncompressed_xml(filename: str):
+    """Function to decompress a gzipped XML file next to the original (or in the temporary directory),
+    so that it can be split in byte ranges. Returns the name of the uncompressed file and whether
+    it is a temporary file."""
+
+    if filename.endswith(".xml"):
+        return filename, False
+    directory = os.path.dirname(filename)
+    try:
+        handle = tempfile.NamedTemporaryFile(suffix=".xml", dir=directory, delete=False)
+    except (OSError, PermissionError):
+        handle = tempfile.NamedTemporaryFile(suffix=".xml", delete=False)
+    with gzip.open(filename, "rb") as compressed, handle:
+        shutil.copyfileobj(compressed, handle)
+    return handle.name, True
+
+
+def _uncompressed_size(filename: str) -> int:
+    """Function to estimate the uncompressed size of an XML file. For gzipped files, this is the larger
+    of the compressed size and the size stored in the gzip trailer (which is modulo 4 GB)."""
+
+    size = os.stat(filename).st_size
+    if filename.endswith(".gz") and size >= 4:
+        with open(filename, "rb") as handle:
+            handle.seek(-4, os.SEEK_END)
+            size = max(size, struct.unpack("<I", handle.read(4))[0])
+    return size
+
+
+def _xml_tasks(filenames, procs, min_size=min_chunk_size):
+    """Function to create the parsing tasks for the XML files: plain or gzipped XML files large enough
+    to be split are split into byte ranges at <Iteration> boundaries (gzipped ones after decompressing
+    them); all other files (eg ASN, or small XML files) are parsed as a whole.
+    :returns: a list of (filename, byte_range, header_end) tuples, and the list of temporary files created.
+    """
+
+    tasks, temporary = [], []
+    for filename in filenames:
+        if procs > 1 and filename.endswith((".xml", ".xml.gz")) and _uncompressed_size(filename) >= 2 * min_size:
+            plain, is_temporary = _uncompressed_xml(filename)
+            if is_temporary:
+                temporary.append(plain)
+            header_end, ranges = split_xml(plain, procs * 2, min_size=min_size)
+            if len(ranges) > 1:
+                tasks.extend((plain, byte_range, header_end) for byte_range in ranges)
+                continue
+        tasks.append((filename, None, None))
+    return tasks, temporary
+
+
+def _gather_results(tasks, pending, logger):
+    """Function to retrieve the results of the parsing tasks. Files parsed as a whole which fail are
+    skipped, as in the single-process mode; a failure in a byte range would instead leave out an arbitrary
+    part of its file, so an InvalidSerialization exception is raised.
+    :param tasks: the tasks, as created by _xml_tasks.
+    :param pending: the AsyncResult objects of the tasks, in the same order.
+    :returns: the list of the results.
+    """
+
+    results, failed = [], []
+    for (filename, byte_range, _), result in zip(tasks, pending):
+        try:
+            results.append(result.get())
+        except Exception as exc:
+            if byte_range is None:
+                logger.error("Failed to parse %s: %s", filename, exc)
+                continue
+            logger.critical("Failed to parse %s (bytes %d-%d): %s", filename, byte_range[0], byte_range[1], exc)
+            failed.append(filename)
+    if failed:
+        [os.remove(dbfile) for dbfile, _ in results if os.path.exists(dbfile)]
+        raise InvalidSerialization("Failed to parse {}".format(", ".join(sorted(set(failed)))))
+    return results
 
 
 def xml_pickler(configuration, filename, default_header,
                 cache=None,
-                max_target_seqs=10):
-    valid, _, exc = BlastOpener(filename).sniff(default_header=default_header)
+                max_target_seqs=10, byte_range=None, header_end=None):
+    """
+    Function to parse a BLAST XML file, or a byte range of it, and store the resulting hits and HSPs into
+    a temporary file, together with an index of the records.
+
+    :param byte_range: optional (start, end) tuple of the range of <Iteration> records to parse. If given,
+    the file must be an uncompressed XML file and header_end must indicate the end of its header.
+    :param header_end: end of the XML header of the file (ie start of the first <Iteration>).
+    """
+
+    if byte_range is None:
+        valid, _, exc = BlastOpener(filename).sniff(default_header=default_header)
+    else:
+        valid = True
     engine = connect(configuration, strategy="threadlocal")
     session = Session(bind=engine)
 
@@ -51,8 +177,12 @@ def xml_pickler(configuration, filename, default_header,
         cache["target"] = dict((item.target_name, item.target_id) for item in session.query(Target))
 
     rows = b""
+    if byte_range is not None:
+        opened = BlastChunk(filename, header_end, byte_range)
+    else:
+        opened = BlastOpener(filename)
     try:
-        with BlastOpener(filename) as opened:
+        with opened:
             try:
                 qmult, tmult = None, None
                 for query_counter, record in enumerate(opened, start=1):
@@ -84,6 +214,62 @@ def xml_pickler(configuration, filename, default_header,
     return dbname, zlib.compress(rows)
 
 
+class _XMLRange(io.RawIOBase):
+
+    """Read-only, unbuffered view of a byte range of a BLAST XML file, preceded by the header of the file
+    and followed by its closing tags, so that it can be parsed as a self-contained XML file."""
+
+    def __init__(self, filename: str, header_end: int, byte_range: tuple):
+        super().__init__()
+        self.name = filename
+        self.__handle = open(filename, "rb", buffering=0)
+        self.__pieces = [(0, header_end), tuple(byte_range)]
+        self.__remaining = 0
+        self.__footer = _xml_footer
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        view = memoryview(buffer)
+        while self.__remaining <= 0 and self.__pieces:
+            start, end = self.__pieces.pop(0)
+            self.__handle.seek(start)
+            self.__remaining = end - start
+        if self.__remaining > 0:
+            read = self.__handle.readinto(view[:min(len(view), self.__remaining)])
+            # A truncated file: move on to the next piece rather than looping forever
+            self.__remaining = self.__remaining - read if read else 0
+            return read if read else self.readinto(buffer)
+        size = min(len(view), len(self.__footer))
+        view[:size] = self.__footer[:size]
+        self.__footer = self.__footer[size:]
+        return size
+
+    def close(self):
+        self.__handle.close()
+        super().close()
+
+
+class BlastChunk:
+
+    """Minimal counterpart of BlastOpener for a byte range of a BLAST XML file, streamed from disk
+    together with the header and the closing tags of the file."""
+
+    def __init__(self, filename: str, header_end: int, byte_range: tuple):
+        self.__handle = io.BufferedReader(_XMLRange(filename, header_end, byte_range))
+        self.parser = xparser(self.__handle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.__handle.close()
+
+    def __iter__(self):
+        return iter(self.parser)
+
+
 def _serialise_xmls(self):
     # Load sequences in DB, precache IDs
 
@@ -135,23 +321,32 @@ def _serialise_xmls(self):
                 self.logger.error("%s is an invalid BLAST file, saving what's available", filename)
         _, _ = load_into_db(self, hits, hsps, force=True)
     elif self._xml_debug is True or self.procs > 1:
-        self.logger.debug("Creating a pool with %d processes",
-                          min(self.procs, len(self.xml)))
+        # Large XML files are split at <Iteration> boundaries, so that each is parsed by multiple processes.
+        tasks, temporary = _xml_tasks(self.xml, self.procs)
+        self.logger.debug("Creating a pool with %d processes for %d parsing tasks",
+                          min(self.procs, len(tasks)), len(tasks))
         results = []
-        if self._xml_debug is True:
-            for num, filename in enumerate(self.xml):
-                results.append(xml_pickler(self.configuration,
-                                           filename, self.header,
-                                           cache=None,
-                                           max_target_seqs=self._max_target_seqs))
-        else:
-            pool = mp.Pool(self.procs)
-            for num, filename in enumerate(self.xml):
-                args = (self.configuration, filename, self.header)
-                kwds = {"max_target_seqs": self._max_target_seqs, "cache": None}
-                pool.apply_async(xml_pickler, args=args, kwds=kwds, callback=results.append)
-            pool.close()
-            pool.join()
+        try:
+            if self._xml_debug is True:
+                for filename, byte_range, header_end in tasks:
+                    results.append(xml_pickler(self.configuration,
+                                               filename, self.header,
+                                               cache=None,
+                                               max_target_seqs=self._max_target_seqs,
+                                               byte_range=byte_range, header_end=header_end))
+            else:
+                pool = mp.Pool(self.procs)
+                pending = []
+                for filename, byte_range, header_end in tasks:
+                    args = (self.configuration, filename, self.header)
+                    kwds = {"max_target_seqs": self._max_target_seqs, "cache": None,
+                            "byte_range": byte_range, "header_end": header_end}
+                    pending.append(pool.apply_async(xml_pickler, args=args, kwds=kwds))
+                pool.close()
+                pool.join()
+                results = _gather_results(tasks, pending, self.logger)
+        finally:
+            [os.remove(plain) for plain in temporary if os.path.exists(plain)]
 
         for dbfile, rows in results:
             with open(dbfile, "rb") as dbhandle:
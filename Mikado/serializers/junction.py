@@ -20,8 +20,11 @@ from sqlalchemy import select
 from sqlalchemy.orm import relationship, column_property
 from sqlalchemy.orm.session import Session
 from sqlalchemy.ext.hybrid import hybrid_method
-from ..utilities.dbutils import DBBASE, Inspector, connect
+from ..utilities.dbutils import DBBASE, Inspector, connect, bulk_insert
 from ..parsers import bed12
+import itertools
+import numpy as np
+import pandas as pd
 from ..utilities.log_utils import check_logger, create_default_logger
 import pyfaidx
 from copy import deepcopy as copy
@@ -127,6 +130,58 @@ class Junction(DBBASE):
 # pylint: enable=too-many-instance-attributes
 
 
+def parse_junction_lines(lines: list) -> pd.DataFrame:
+    """
+    Function to parse a batch of lines of a junction BED12 file into the columns of the junctions table
+    (with the chromosome name in place of its ID), without creating a BED12 object per line.
+    Header lines (ie comments, track lines and any line without 12 or 13 fields) are discarded.
+    Lines whose name or 13th column contains attributes are delegated to the BED12 class, to be parsed
+    exactly as Mikado would.
+
+    :param lines: the lines to parse.
+    :type lines: list[str]
+
+    :returns: a DataFrame with the columns chrom, start, end, name, strand, junction_start, junction_end
+    and score, in the order of the lines in the input.
+    :rtype: pd.DataFrame
+    """
+
+    columns = ["chrom", "start", "end", "name", "strand", "junction_start", "junction_end", "score"]
+    lines = pd.Series(lines, dtype=object).str.rstrip()
+    num_fields = lines.str.count("\t") + 1
+    lines = lines[(lines.str.len() > 0) & ~lines.str.startswith("#") & num_fields.isin((12, 13))]
+    if lines.shape[0] == 0:
+        return pd.DataFrame([], columns=columns)
+    fields = lines.str.split("\t", expand=True).reindex(columns=range(13)).fillna("")
+    complex_rows = fields[3].str.contains("=", regex=False) | (fields[12] != "")
+
+    simple = fields[~complex_rows]
+    strands = simple[5]
+    if not strands.isin(("+", "-", ".", "?")).all():
+        raise ValueError("Erroneous strand provided: {0}".format(
+            strands[~strands.isin(("+", "-", ".", "?"))].iloc[0]))
+    parsed = pd.DataFrame({
+        "chrom": simple[0].values,
+        "start": simple[1].astype(int).values + 1,
+        "end": simple[2].astype(int).values,
+        "name": simple[3].values,
+        "strand": np.where(strands.isin(("+", "-")), strands, None),
+        "junction_start": simple[6].astype(int).values + 1,
+        "junction_end": simple[7].astype(int).values,
+        "score": pd.to_numeric(simple[4], errors="coerce").values}, index=simple.index, columns=columns)
+
+    if complex_rows.any():
+        others = []
+        for index, line in lines[complex_rows].items():
+            row = bed12.BED12(line)
+            others.append([row.chrom, row.start, row.end, row.name, row.strand,
+                           row.thick_start, row.thick_end, row.score])
+        others = pd.DataFrame(others, index=lines[complex_rows].index, columns=columns)
+        parsed = pd.concat([parsed, others]).sort_index()
+
+    return parsed
+
+
 class JunctionSerializer:
 
     """
@@ -191,61 +246,81 @@ class JunctionSerializer:
                     logger.critical(msg)
                     raise TypeError(msg)
 
-    def serialize(self):
+    def __load_chroms(self):
         """
-        Workhorse of the class. It parses the input file and loads it into the database.
+        Private method to load the chromosomes listed in the FAI index into the database, in bulk.
+        :returns: a dictionary with the ID of each chromosome present in the database.
         """
 
-        sequences = dict()
-        if self.bed12_parser is None:
-            self.logger.warning("No input file specified. Exiting.")
-            return
-
-        self.logger.debug("Starting to serialise junctions.")
+        sequences = dict((name, chrom_id) for name, chrom_id in
+                         self.engine.execute(select([Chrom.name, Chrom.chrom_id])))
         if self.fai is not None:
-            self.session.begin(subtransactions=True)
+            new_chroms = dict()
             for line in self.fai:
                 name, length = line.rstrip().split()[:2]
-                if self.session.query(Chrom).filter(Chrom.name == name).all():
+                if name in sequences:
                     continue
                 try:
-                    current_chrom = Chrom(name, length=int(length))
+                    new_chroms[name] = int(length)
                 except ValueError:
                     raise ValueError(line)
-                self.session.add(current_chrom)
-                sequences[current_chrom.name] = current_chrom.chrom_id
-            self.session.commit()
-            for query in self.session.query(Chrom):
-                sequences[query.name] = query.chrom_id
+            bulk_insert(self.engine, Chrom.__table__,
+                        [{"name": name, "length": length} for name, length in new_chroms.items()])
             self.fai.close()
+            sequences.update((name, chrom_id) for name, chrom_id in
+                             self.engine.execute(select([Chrom.name, Chrom.chrom_id])))
+        return sequences
 
+    def __add_chroms(self, names, sequences):
+        """
+        Private method to insert in bulk the chromosomes which are not present in the FAI index but are
+        found in the junctions file, updating the dictionary of the chromosome IDs in place.
+        """
+
+        names = [name for name in names if name not in sequences]
+        if not names:
+            return
+        bulk_insert(self.engine, Chrom.__table__, [{"name": name, "length": None} for name in names])
+        for start in range(0, len(names), 500):
+            sequences.update((name, chrom_id) for name, chrom_id in self.engine.execute(
+                select([Chrom.name, Chrom.chrom_id]).where(Chrom.name.in_(names[start:start + 500]))))
+
+    def serialize(self):
+        """
+        Workhorse of the class. It parses the input file and loads it into the database.
+        The lines are parsed in batches of max_objects through pandas, the chromosome names are
+        mapped to their IDs in bulk, and the junctions are inserted with executemany.
+        """
+
+        if self.bed12_parser is None:
+            self.logger.warning("No input file specified. Exiting.")
+            return
+
+        self.logger.debug("Starting to serialise junctions.")
+        sequences = self.__load_chroms()
         self.logger.debug("Serialised sequences.")
-        objects = []
 
-        for counter, row in enumerate(self.bed12_parser, 1):
-            if row.header is True:
+        done = 0
+        # Read the underlying text handle directly, without creating a BED12 object per line
+        handle = self.bed12_parser._handle
+        while True:
+            lines = list(itertools.islice(handle, self.maxobjects))
+            if not lines:
+                break
+            junctions = parse_junction_lines(lines)
+            if junctions.shape[0] == 0:
                 continue
-            if row.chrom in sequences:
-                current_chrom = sequences[row.chrom]
-            else:
-                current_chrom = Chrom(row.chrom)
-                self.session.begin(subtransactions=True)
-                self.session.add(current_chrom)
-                self.session.commit()
-                sequences[current_chrom.name] = current_chrom.chrom_id
-                current_chrom = current_chrom.chrom_id
-
-            current_junction = Junction(row, current_chrom)
-            objects.append(current_junction)
-            if len(objects) >= self.maxobjects:
-                self.logger.debug("Serializing %d objects", len(objects))
-                self.session.begin(subtransactions=True)
-                self.session.bulk_save_objects(objects)
-                self.session.commit()
-                objects = []
-
-        self.session.bulk_save_objects(objects)
-        self.logger.debug("Serialised %s junctions into %s.", counter, self.db_settings)
+            self.__add_chroms(pd.unique(junctions["chrom"]).tolist(), sequences)
+            junctions["chrom_id"] = junctions["chrom"].map(sequences)
+            junctions["score"] = junctions["score"].astype(object).where(junctions["score"].notna(), None)
+            self.logger.debug("Serializing %d objects", junctions.shape[0])
+            bulk_insert(self.engine, Junction.__table__, list(zip(
+                itertools.repeat(None),
+                *[junctions[column].tolist() for column in ("chrom_id", "start", "end", "name", "strand",
+                                                             "junction_start", "junction_end", "score")])))
+            done += junctions.shape[0]
+
+        self.logger.debug("Serialised %s junctions into %s.", done, self.db_settings)
         self.session.commit()
         self.close()
 
@@ -13,17 +13,17 @@ import sqlalchemy.exc
 from sqlalchemy.orm import relationship, backref, column_property
 from sqlalchemy.orm.session import sessionmaker
 from sqlalchemy import select
-from ..utilities.dbutils import DBBASE, Inspector, connect
+from ..utilities.dbutils import DBBASE, Inspector, connect, bulk_insert
 from ..parsers import bed12  # , GFF
+from ..parsers.GFF import GffLine
 from .blast_serializer import Query
 from ..utilities.log_utils import create_null_logger, check_logger
 import pandas as pd
 from ..exceptions import InvalidSerialization
-import logging
-import logging.handlers as logging_handlers
 import multiprocessing as mp
-import msgpack
-import zlib
+import functools
+import numpy as np
+from collections import Counter
 from ..configuration import DaijinConfiguration, MikadoConfiguration
 
 
@@ -170,20 +170,74 @@ class Orf(DBBASE):
         return self.as_bed12_static(self, self.query)
 
 
-def line_parser_func(handle, fai, send_queue):
-    fai = pysam.FastaFile(fai)
-    for num, line in enumerate(open(handle)):
-        if line[0] == "#":
-            send_queue.put((num, line, None))
-        else:
-            _f = line.split("\t")
-            if _f[0] not in fai:
-                seq = None
-            else:
-                seq = zlib.compress(fai[line.split("\t")[0]].encode(), 1)
-            send_queue.put_nowait((num, line, seq))
+def split_lines(filename: str, chunks: int) -> list:
+    """Function to split a text file into (at most) the requested number of byte ranges of similar size,
+    each starting at the beginning of a line.
+    :param filename: the file to split
+    :param chunks: the number of ranges to produce
+    :returns: a list of (start, end) byte offsets
+    """
 
-    send_queue.put("EXIT")
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, "rb") as handle:
+        for num in range(1, max(chunks, 1)):
+            position = size * num // chunks
+            if position <= bounds[-1]:
+                continue
+            handle.seek(position - 1)
+            handle.readline()
+            if bounds[-1] < handle.tell() < size:
+                bounds.append(handle.tell())
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def _parse_orf_range(byte_range, filename, fasta_index, is_gff, max_regression, table):
+    """Function to parse the ORFs contained in a byte range of a BED12/GFF3 file, in a worker process.
+    :returns: the valid ORFs as simple dictionaries, the number of invalid entries for each reason,
+    and an example entry for each reason.
+    """
+
+    start, end = byte_range
+    logger = create_null_logger()
+    fai = pysam.FastaFile(fasta_index)
+    orfs, invalid, examples = [], Counter(), dict()
+    with open(filename, "rb") as handle:
+        handle.seek(start)
+        while handle.tell() < end:
+            line = original = handle.readline().decode()
+            if not line:
+                break
+            chrom = line.split("\t")[0]
+            sequence = fai[chrom] if (line[0] != "#" and chrom in fai) else None
+            try:
+                if is_gff:
+                    try:
+                        line = GffLine(line)
+                    except Exception:
+                        raise ValueError("Invalid line:\n{}".format(line))
+                    if line.feature != "CDS":
+                        continue
+                    row = bed12.BED12(line, logger=logger, sequence=sequence, transcriptomic=True,
+                                      max_regression=max_regression, table=table)
+                else:
+                    try:
+                        row = bed12.BED12(line, logger=logger, sequence=sequence, transcriptomic=True,
+                                          max_regression=max_regression, table=table, coding=False)
+                    except Exception:
+                        raise ValueError("Invalid line: {}".format(line))
+            except AttributeError:
+                continue
+            if not row or row.header is True:
+                continue
+            if row.invalid is True:
+                invalid[row.invalid_reason] += 1
+                examples.setdefault(row.invalid_reason, original.rstrip())
+                continue
+            orfs.append(row.as_simple_dict())
+    fai.close()
+    return orfs, invalid, examples
 
 
 class OrfSerializer:
@@ -345,10 +399,7 @@ Please check your input files. Rogue ID: %s", row.id)
                 done += len(objects)
                 self.session.begin(subtransactions=True)
                 # self.session.bulk_save_objects(objects)
-                self.engine.execute(
-                    Orf.__table__.insert(),
-                    objects
-                )
+                bulk_insert(self.engine, Orf.__table__, objects)
                 self.session.commit()
                 self.logger.debug("Loaded %d ORFs into the database", done)
                 objects = []
@@ -356,10 +407,7 @@ Please check your input files. Rogue ID: %s", row.id)
         done += len(objects)
         # self.session.begin(subtransactions=True)
         # self.session.bulk_save_objects(objects, update_changed_only=False)
-        self.engine.execute(
-            Orf.__table__.insert(),
-            objects
-        )
+        bulk_insert(self.engine, Orf.__table__, objects)
         self.session.commit()
         self.session.close()
         self.logger.info("Finished loading %d ORFs into the database", done)
@@ -368,100 +416,70 @@ Please check your input files. Rogue ID: %s", row.id)
         if orfs.shape[0] != done:
             raise ValueError("I should have serialised {} ORFs, but {} are present!".format(done, orfs.shape[0]))
 
-    def __serialize_multiple_threads(self):
-        """"""
-
-        manager = mp.Manager()
-        send_queue = manager.Queue(-1)
-        return_queue = manager.JoinableQueue(-1)
-        self.logging_queue = mp.Queue(-1)
-        self.logger_queue_handler = logging_handlers.QueueHandler(self.logging_queue)
-        self.queue_logger = logging.getLogger("parser")
-        self.queue_logger.addHandler(self.logger_queue_handler)
-        self.queue_logger.setLevel(self.log_level)
-        self.queue_logger.propagate = False
-        self.log_writer = logging_handlers.QueueListener(self.logging_queue, self.logger)
-        self.log_writer.start()
-
-        line_parser = mp.Process(target=line_parser_func,
-                                 args=(self._handle, self.fasta_index.filename, send_queue))
-        line_parser.start()
-
-        parsers = [bed12.Bed12ParseWrapper(
-            identifier=index,
-            rec_queue=send_queue,
-            log_queue=self.logging_queue,
-            level=self.log_level,
-            return_queue=return_queue,
-            fasta_index=None,
-            is_gff=(not self.is_bed12),
-            transcriptomic=True,
-            max_regression=self._max_regression,
-            table=self._table) for index in range(self.procs)]
-        [_.start() for _ in parsers]
-
-        not_found = set()
-        done = 0
-        objects = []
-        procs_done = 0
-        while True:
-            num = return_queue.get()
-            if num in ("FINISHED", b"FINISHED"):
-                procs_done += 1
-                if procs_done == self.procs:
-                    break
-                else:
-                    continue
-            num, obj = num
-            try:
-                loaded_obj = msgpack.loads(obj, raw=False)
-            except TypeError:
-                raise TypeError(obj)
-
-            if loaded_obj["id"] in self.query_cache:
-                current_query = self.query_cache[loaded_obj["id"]]
-            elif not self.initial_cache:
-                current_query = Query(loaded_obj["id"], loaded_obj["end"])
-                not_found.add(loaded_obj["id"])
-                self.session.add(current_query)
-                self.session.commit()
-                self.query_cache[current_query.query_name] = current_query.query_id
-                current_query = current_query.query_id
-            else:
-                self.logger.critical(
-                    "The provided ORFs do not match the transcripts provided and already present in the database.\
+    def __resolve_queries(self, orfs):
+        """Private method to assign their query ID to a batch of ORFs, inserting in bulk any query
+        which is not present yet in the database."""
+
+        missing = dict()
+        for orf in orfs:
+            if orf["id"] not in self.query_cache:
+                missing.setdefault(orf["id"], orf["end"])
+        if missing and self.initial_cache:
+            self.logger.critical(
+                "The provided ORFs do not match the transcripts provided and already present in the database.\
 This could be due to having called the ORFs on a FASTA file different from `mikado_prepared.fasta`, the output of \
 mikado prepare. If this is the case, please use mikado_prepared.fasta to call the ORFs and then restart \
-`mikado serialise` using them as input.")
-                raise InvalidSerialization
+`mikado serialise` using them as input. Rogue ID: %s", next(iter(missing)))
+            raise InvalidSerialization
+        elif missing:
+            bulk_insert(self.engine, Query.__table__,
+                        [{"query_name": name, "query_length": length} for name, length in missing.items()])
+            names = list(missing)
+            for start in range(0, len(names), 500):
+                found = self.engine.execute(select([Query.query_name, Query.query_id]).where(
+                    Query.query_name.in_(names[start:start + 500])))
+                self.query_cache.update((name, query_id) for name, query_id in found)
+        for orf in orfs:
+            orf["query_id"] = self.query_cache[orf["id"]]
+        return orfs
 
-            loaded_obj["query_id"] = current_query
-            objects.append(loaded_obj)
-            if len(objects) >= self.maxobjects:
-                done += len(objects)
-                self.session.begin(subtransactions=True)
-                self.engine.execute(
-                    Orf.__table__.insert(),
-                    objects
-                )
-                self.session.commit()
-                self.logger.debug("Loaded %d ORFs into the database", done)
-                objects = []
+    def __serialize_multiple_threads(self):
+        """Private method to parse the ORFs in parallel. The file is split into byte ranges, each parsed
+        by a worker process; the ORFs of each range are then resolved against the query table in bulk and
+        loaded with large executemany batches. A summary of the invalid entries is logged at the end."""
+
+        ranges = split_lines(self._handle, max(self.procs, int(np.ceil(os.path.getsize(self._handle) / 2 ** 24))))
+        parser = functools.partial(_parse_orf_range,
+                                   filename=self._handle,
+                                   fasta_index=self.fasta_index.filename,
+                                   is_gff=(not self.is_bed12),
+                                   max_regression=self._max_regression,
+                                   table=self._table)
+        done = 0
+        objects = []
+        invalid, examples = Counter(), dict()
+        with mp.Pool(self.procs) as pool:
+            for orfs, range_invalid, range_examples in pool.imap(parser, ranges):
+                invalid.update(range_invalid)
+                for reason, example in range_examples.items():
+                    examples.setdefault(reason, example)
+                objects.extend(self.__resolve_queries(orfs))
+                if len(objects) >= self.maxobjects:
+                    done += len(objects)
+                    bulk_insert(self.engine, Orf.__table__, objects)
+                    self.logger.debug("Loaded %d ORFs into the database", done)
+                    objects = []
 
-        [proc.join() for proc in parsers]
         done += len(objects)
-        # self.session.begin(subtransactions=True)
-        # self.session.bulk_save_objects(objects, update_changed_only=False)
-        if objects:
-            self.engine.execute(
-                Orf.__table__.insert(),
-                objects
-            )
+        bulk_insert(self.engine, Orf.__table__, objects)
         self.session.commit()
         self.session.close()
         self.logger.info("Finished loading %d ORFs into the database", done)
+        if invalid:
+            self.logger.warning("Discarded %d invalid ORFs", sum(invalid.values()))
+            for reason, count in invalid.most_common():
+                self.logger.warning("%d ORF(s) discarded, reason: %s. Example:\n%s", count, reason, examples[reason])
 
-        manager.shutdown()
         orfs = pd.read_sql_table("orf", self.engine, index_col="query_id")
         if orfs.shape[0] != done:
             raise ValueError("I should have serialised {} ORFs, but {} are present!".format(done, orfs.shape[0]))
@@ -491,8 +509,11 @@ mikado prepare. If this is the case, please use mikado_prepared.fasta to call th
         Alias for serialize
         """
 
+        # Indexes missing from the database (eg in bulk-load mode) are left to be built at the end
+        present = set(index["name"] for index in Inspector.from_engine(self.engine).get_indexes(Orf.__tablename__))
+        indexes = [idx for idx in Orf.__table__.indexes if idx.name in present]
         try:
-            [idx.drop(bind=self.engine) for idx in Orf.__table__.indexes]
+            [idx.drop(bind=self.engine) for idx in indexes]
         except (sqlalchemy.exc.IntegrityError, sqlite3.IntegrityError) as exc:
             self.logger.debug("Corrupt table found, deleting and restarting")
             self.session.query(Orf).delete()
@@ -508,4 +529,4 @@ mikado prepare. If this is the case, please use mikado_prepared.fasta to call th
             except InvalidSerialization:
                 raise
         finally:
-            [idx.create(bind=self.engine) for idx in Orf.__table__.indexes]
+            [idx.create(bind=self.engine) for idx in indexes]
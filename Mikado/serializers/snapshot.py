@@ -0,0 +1,328 @@
+# coding: utf-8
+
+"""
+This module contains the functions to export the data of a Mikado database into a read-only binary snapshot,
+and the class to read it back. The snapshot is meant to be memory-mapped by all the processes of mikado pick,
+which will therefore share it through the page cache and retrieve the data of each locus without any SQL.
+
+The layout of the file is the following:
+
+- a header, with a magic string and the position and length of the index;
+- for each query with any ORF, external score or BLAST hit, a msgpack record with the data in the format
+  used by mikado pick;
+- for each chromosome, three arrays (sorted by junction start and end) with the starts, ends and strands of
+  the junctions;
+- the index, a msgpack dictionary with the position of each query record and chromosome array, the
+  BLAST parameters used to filter the hits when exporting, and the identity of the exported database.
+"""
+
+import collections
+import mmap
+import os
+import struct
+import types
+import msgpack
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from ..utilities.dbutils import connect
+from ..utilities.log_utils import create_null_logger
+from .blast_serializer import Query, Target, Hit, Hsp
+from .external import External, ExternalSource
+from .orf import Orf
+
+
+__author__ = 'Luca Venturini'
+
+
+magic = b"MIKSNAP1"
+_header = struct.Struct("<8sQQ")
+_orf_keys = ["start", "end", "orf_name", "score", "strand", "thick_start", "thick_end", "phase",
+             "has_start_codon", "has_stop_codon"]
+_strands = {"+": 1, "-": -1, None: 0}
+_strand_codes = {1: "+", -1: "-", 0: None}
+
+
+def database_identity(configuration) -> list:
+    """Function to identify the database of a configuration, so that a snapshot is not used in place of
+    a database serialised anew: for SQLite, the path, size and modification time of the file; for the
+    other databases, the connection parameters (without the password).
+    :param configuration: a Mikado configuration.
+    """
+
+    settings = configuration.db_settings
+    if settings.dbtype == "sqlite":
+        if not os.path.exists(settings.db):
+            return [settings.dbtype, os.path.realpath(settings.db), None, None]
+        stat = os.stat(settings.db)
+        return [settings.dbtype, os.path.realpath(settings.db), stat.st_size, stat.st_mtime_ns]
+    return [settings.dbtype, settings.dbuser, settings.dbhost, settings.dbport, settings.db]
+
+
+def snapshot_params(configuration) -> dict:
+    """Function to retrieve the parameters which determine the data stored in a snapshot: the BLAST
+    parameters, and the database it is exported from.
+    :param configuration: a Mikado configuration.
+    """
+
+    blast_params = configuration.pick.chimera_split.blast_params
+    return {"evalue": blast_params.evalue,
+            "hsp_evalue": blast_params.hsp_evalue,
+            "max_target_seqs": blast_params.max_target_seqs,
+            "match": configuration.pick.chimera_split.execute,
+            "database": database_identity(configuration)}
+
+
+def _external_score(score, rtype):
+    if rtype == "int":
+        return int(score)
+    elif rtype == "float":
+        return float(score)
+    elif rtype == "bool":
+        return bool(int(score))
+    else:
+        raise ValueError("Invalid rtype: {}".format(rtype))
+
+
+def _query_records(engine, params: dict, query_ids: list, queries: dict, targets: dict, sources: dict):
+    """Private function to retrieve the data of a batch of queries, in the same format used by mikado pick.
+    :returns: a dictionary with a record (orfs, external scores, hits) for each query with any data.
+    """
+
+    start, end = query_ids[0], query_ids[-1]
+    records = collections.defaultdict(lambda: {"orfs": [], "external": [], "hits": []})
+
+    for ext in engine.execute(select([External.__table__]).where(External.query_id.between(start, end))):
+        source, rtype, valid_raw = sources[ext.source_id]
+        records[queries[ext.query_id].query_name]["external"].append(
+            [source, _external_score(ext.score, rtype), valid_raw])
+
+    for orf in engine.execute(select([Orf.__table__]).where(
+            Orf.query_id.between(start, end)).order_by(Orf.orf_id)):
+        records[queries[orf.query_id].query_name]["orfs"].append(dict((key, getattr(orf, key)) for key in _orf_keys))
+
+    hsp_command = " ".join([
+        "select {0} from hsp where",
+        "hsp_evalue <= {1} and query_id between {2} and {3} order by query_id;"]).format(
+        "*" if params["match"] is True else ", ".join(
+            column.name for column in Hsp.__table__.columns if column.name != "match"),
+        params["hsp_evalue"], start, end)
+    hsps = collections.defaultdict(list)
+    for hsp in engine.execute(hsp_command):
+        hsps[(hsp.query_id, hsp.target_id)].append(hsp)
+
+    hit_command = " ".join([
+        "select * from hit where evalue <= {0}",
+        "and hit_number <= {1} and query_id between {2} and {3}",
+        "order by query_id, evalue asc;"]).format(params["evalue"], params["max_target_seqs"], start, end)
+    for hit in engine.execute(hit_command):
+        query = queries[hit.query_id]
+        records[query.query_name]["hits"].append(
+            Hit.as_full_dict_static(hit, hsps[(hit.query_id, hit.target_id)], query, targets[hit.target_id]))
+
+    return records
+
+
+def export_snapshot(configuration, filename: str, logger=None, batch_size=10000):
+    """Function to export the junctions, ORFs, external scores and BLAST hits of a Mikado database
+    into a binary snapshot, to be used by mikado pick in place of the database.
+    The BLAST hits are filtered according to the chimera_split/blast_params section of the configuration.
+
+    :param configuration: the Mikado configuration, with the database to export.
+    :param filename: the snapshot file to write.
+    :param logger: optional logger.
+    :param batch_size: number of queries to retrieve from the database at once.
+    """
+
+    if logger is None:
+        logger = create_null_logger()
+    engine = connect(configuration, logger=logger)
+    params = snapshot_params(configuration)
+    index = {"params": params, "queries": dict(), "chroms": dict()}
+
+    queries = dict((query.query_id, query) for query in engine.execute(select([Query.__table__])))
+    targets = dict((target.target_id, target) for target in engine.execute(select([Target.__table__])))
+    sources = dict((source.source_id, (source.source, source.rtype, bool(source.valid_raw)))
+                   for source in engine.execute(select([ExternalSource.__table__])))
+    query_ids = sorted(queries)
+
+    temp_name = filename + ".tmp"
+    with open(temp_name, "wb") as out:
+        out.write(_header.pack(magic, 0, 0))
+        for batch_start in range(0, len(query_ids), batch_size):
+            records = _query_records(engine, params, query_ids[batch_start:batch_start + batch_size],
+                                     queries, targets, sources)
+            for name, record in records.items():
+                packed = msgpack.packb(record, use_bin_type=True)
+                index["queries"][name] = [out.tell(), len(packed)]
+                out.write(packed)
+        logger.debug("Exported the data of %d queries into %s", len(index["queries"]), filename)
+
+        junctions = pd.read_sql_query(
+            " ".join(["select chrom.name as chrom, junction_start, junction_end, strand from junctions",
+                      "join chrom on junctions.chrom_id = chrom.chrom_id",
+                      "order by chrom.name, junction_start, junction_end, junctions.id"]), engine)
+        for chrom, chrom_junctions in junctions.groupby("chrom", sort=True):
+            # Align the arrays, so that they can be read directly from the memory map
+            out.write(b"\0" * (-out.tell() % 8))
+            index["chroms"][chrom] = [out.tell(), chrom_junctions.shape[0]]
+            out.write(chrom_junctions["junction_start"].values.astype("<i8").tobytes())
+            out.write(chrom_junctions["junction_end"].values.astype("<i8").tobytes())
+            out.write(np.array([_strands.get(strand, 0) for strand in chrom_junctions["strand"]],
+                               dtype="i1").tobytes())
+        logger.debug("Exported %d junctions into %s", junctions.shape[0], filename)
+
+        packed = msgpack.packb(index, use_bin_type=True)
+        index_start = out.tell()
+        out.write(packed)
+        out.seek(0)
+        out.write(_header.pack(magic, index_start, len(packed)))
+    os.replace(temp_name, filename)
+    engine.dispose()
+    logger.info("Finished exporting the database snapshot into %s", filename)
+
+
+class Snapshot:
+
+    """Class to read a binary snapshot of a Mikado database, created by export_snapshot. The file is
+    memory-mapped, so that all the processes reading it share the same pages."""
+
+    def __init__(self, filename: str):
+
+        self.filename = filename
+        self.__open()
+
+    def __open(self):
+        self.__handle = open(self.filename, "rb")
+        self.__map = mmap.mmap(self.__handle.fileno(), 0, access=mmap.ACCESS_READ)
+        found_magic, index_start, index_length = _header.unpack_from(self.__map, 0)
+        if found_magic != magic:
+            self.close()
+            raise ValueError("{} is not a valid Mikado database snapshot".format(self.filename))
+        index = msgpack.unpackb(self.__map[index_start:index_start + index_length], raw=False)
+        self.params = index["params"]
+        self.__queries = index["queries"]
+        self.__chroms = index["chroms"]
+
+    def __getstate__(self):
+        return {"filename": self.filename}
+
+    def __setstate__(self, state):
+        self.filename = state["filename"]
+        self.__open()
+
+    def close(self):
+        """Method to close the memory map and the underlying file."""
+        self.__map.close()
+        self.__handle.close()
+
+    def is_compatible(self, configuration) -> bool:
+        """Method to check whether the snapshot contains all the data required by the given configuration.
+        The hits can be filtered further at retrieval, but the HSPs must have been filtered with the same
+        e-value, and the match lines must be present if transcripts are going to be split."""
+
+        params = snapshot_params(configuration)
+        return (params["hsp_evalue"] == self.params["hsp_evalue"] and
+                params["evalue"] <= self.params["evalue"] and
+                params["max_target_seqs"] <= self.params["max_target_seqs"] and
+                (params["match"] is False or self.params["match"] is True))
+
+    def is_current(self, configuration) -> bool:
+        """Method to check whether the snapshot was exported from the database of the given configuration,
+        in its current state."""
+
+        return self.params.get("database", None) == database_identity(configuration)
+
+    def query_data(self, name: str):
+        """Method to retrieve the record (ORFs, external scores, hits) of a query, or None if the query
+        has no data."""
+
+        position = self.__queries.get(name, None)
+        if position is None:
+            return None
+        start, length = position
+        return msgpack.unpackb(self.__map[start:start + length], raw=False)
+
+    def junctions(self, chrom: str):
+        """Method to retrieve the starts, ends and strand codes of the junctions on a chromosome, as arrays
+        backed directly by the memory map."""
+
+        position = self.__chroms.get(chrom, None)
+        if position is None:
+            empty = np.zeros(0, dtype="<i8")
+            return empty, empty, np.zeros(0, dtype="i1")
+        start, num = position
+        return (np.frombuffer(self.__map, dtype="<i8", count=num, offset=start),
+                np.frombuffer(self.__map, dtype="<i8", count=num, offset=start + 8 * num),
+                np.frombuffer(self.__map, dtype="i1", count=num, offset=start + 16 * num))
+
+    def verified_introns(self, chrom: str, introns) -> dict:
+        """Method to find which of the given introns are confirmed by the junctions.
+        :returns: a dictionary with the strand of each verified intron, keyed by (chrom, start, end)."""
+
+        starts, ends, strands = self.junctions(chrom)
+        verified = dict()
+        for intron_start, intron_end in introns:
+            low, high = np.searchsorted(starts, intron_start, "left"), np.searchsorted(starts, intron_start, "right")
+            if low == high:
+                continue
+            # If a junction is present more than once, the last one prevails, as when reading the database
+            position = low + np.searchsorted(ends[low:high], intron_end, "right") - 1
+            if position >= low and ends[position] == intron_end:
+                verified[(chrom, intron_start, intron_end)] = _strand_codes[int(strands[position])]
+        return verified
+
+    def create_data_dict(self, configuration, chrom: str, introns, tid_keys) -> dict:
+        """Method to create the dictionary of the data of a locus, in the format expected by
+        Superlocus.load_all_transcript_data.
+
+        :param configuration: the configuration of mikado pick, used to filter the hits.
+        :param chrom: the chromosome of the locus.
+        :param introns: the introns of the locus.
+        :param tid_keys: the transcript IDs inside the locus.
+        """
+
+        blast_params = configuration.pick.chimera_split.blast_params
+        data_dict = {"junctions": self.verified_introns(chrom, introns),
+                     "hits": collections.defaultdict(list),
+                     "orfs": collections.defaultdict(list),
+                     "external": collections.defaultdict(dict)}
+        for tid in tid_keys:
+            record = self.query_data(tid)
+            if record is None:
+                continue
+            for source, score, valid_raw in record["external"]:
+                data_dict["external"][tid][source] = (score, valid_raw)
+            for orf in record["orfs"]:
+                data_dict["orfs"][tid].append(Orf.as_bed12_static(types.SimpleNamespace(**orf), tid))
+            for hit in record["hits"]:
+                if hit["evalue"] <= blast_params.evalue and hit["hit_number"] <= blast_params.max_target_seqs:
+                    data_dict["hits"][tid].append(hit)
+        return data_dict
+
+
+def open_snapshot(configuration, logger=None):
+    """Function to open the snapshot indicated in the configuration (db_settings.snapshot), if any.
+    :returns: a Snapshot instance, or None if no snapshot is available, it is not compatible with
+    the configuration, or it was not exported from the current database (in which case the database will be used)."""
+
+    filename = configuration.db_settings.snapshot
+    if not filename:
+        return None
+    if logger is None:
+        logger = create_null_logger()
+    if not os.path.exists(filename):
+        logger.warning("Database snapshot %s not found, using the database instead", filename)
+        return None
+    snapshot = Snapshot(filename)
+    if not snapshot.is_compatible(configuration):
+        logger.warning("The database snapshot %s was created with BLAST parameters (%s) incompatible with the \
+current configuration; using the database instead", filename, snapshot.params)
+        snapshot.close()
+        return None
+    elif not snapshot.is_current(configuration):
+        logger.warning("The database snapshot %s was not exported from the current version of the database %s; \
+using the database instead", filename, configuration.db_settings.db)
+        snapshot.close()
+        return None
+    return snapshot
@@ -41,8 +41,9 @@ def compare_parser():
                              ".midx".""")
     targets = input_files.add_mutually_exclusive_group(required=True)
     targets.add_argument('-p', '--prediction',
-                         type=to_gff,
-                         help='Prediction annotation file.')
+                         type=to_gff, nargs="+",
+                         help="""Prediction annotation file. If multiple files are given, each will be compared
+                         against the same reference, with outputs named <out>.<file name without extension>.""")
     targets.add_argument("--self", default=False,
                          action="store_true",
                          help="""Flag. If set, the reference will be compared with itself. \
@@ -106,6 +107,19 @@ when the reference transcripts have not been clustered properly into genes (e.g.
                         help="Flag. If set, TMAP and REFMAP files will be GZipped.")
     parser.add_argument("-x", "--processes", default=1,
                         type=get_procs)
+    parser.add_argument("--gene-cache-size", dest="gene_cache_size", default=0, type=int,
+                        help="""Maximum number of reference genes each process keeps in memory after decoding them
+                        from the index; when the limit is reached, the least recently used genes are discarded.
+                        Default: %(default)s (no limit).""")
+    parser.add_argument("--index-version", dest="index_version", type=int, choices=[1, 2], default=1,
+                        help="""Format of the reference index. Version 1 is a SQLite database; version 2 is a binary
+                        file with the structure of the reference in columnar arrays, which is memory-mapped and
+                        shared between the processes. An existing index in the other format will be rebuilt.
+                        Default: %(default)s.""")
+    parser.add_argument("--sorted", action="store_true", default=False,
+                        help="""Flag. If set, the predictions are assumed to be sorted by coordinates, and are
+                        compared against a sliding window of reference genes rather than the whole reference.
+                        Available only with a single process.""")
     parser.set_defaults(func=compare)
 
     return parser
@@ -170,6 +170,9 @@ def check_run_options(args, logger=create_null_logger()):
     if args.shm is True:
         args.configuration.pick.run_options.shm = True
 
+    if getattr(args, "snapshot", None) is not None:
+        args.configuration.db_settings.snapshot = args.snapshot
+
     if args.only_reference_update is True:
         args.configuration.pick.run_options.only_reference_update = True
         args.configuration.pick.run_options.reference_update = True
@@ -270,6 +273,9 @@ def pick_parser():
     parser.add_argument("--shm", default=False, action="store_true",
                         help="Flag. If switched, Mikado pick will copy the database to RAM (ie SHM) for faster access \
 during the run.")
+    parser.add_argument("--snapshot", default=None, type=str,
+                        help="Read-only snapshot of the database, created with mikado serialise --export-snapshot. \
+If compatible with the configuration, the data of the loci will be retrieved from the snapshot rather than the database.")
     parser.add_argument("-p", "--procs", type=int, default=None,
                         help="""Number of processors to use. \
 Default: look in the configuration file (1 if undefined)""")
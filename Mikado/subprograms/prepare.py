@@ -116,6 +116,8 @@ def parse_prepare_options(args, mikado_config):
         mikado_config.prepare.max_intron_length = args.max_intron_length
     if getattr(args, "single", None) not in (None, False):
         mikado_config.prepare.single = args.single
+    if getattr(args, "cache_dir", None) not in (None, False):
+        mikado_config.prepare.cache_dir = args.cache_dir
 
     if args.reference is not None:
         if hasattr(args.reference, "close") and hasattr(args.reference, "name"):
@@ -386,6 +388,9 @@ def prepare_parser():
     a valid start codon.""")
     parser.add_argument("--single", "--single-thread", action="store_true", default=False,
                         help="Disable multi-threading. Useful for debugging.")
+    parser.add_argument("--cache-dir", dest="cache_dir", type=str, default=None,
+                        help="""Directory used to cache the parsed and checked inputs across runs.
+                        If provided, only new or modified inputs will be processed again.""")
     parser.add_argument("-od", "--output-dir", dest="output_dir",
                         type=str, default=None,
                         help="Output directory. Default: current working directory")
@@ -9,8 +9,11 @@ necessary during the analysis.
 import argparse
 import functools
 import glob
+import multiprocessing
 import os
+import shutil
 import sys
+import tempfile
 import logging
 import logging.handlers
 from ..utilities import path_join, comma_split
@@ -122,7 +125,12 @@ def load_blast(args, logger):
                 filenames.extend(glob.glob(xml))
 
         if len(filenames) > 0:
-            part_launcher(filenames)
+            try:
+                part_launcher(filenames)
+            except InvalidSerialization:
+                logger.critical("Mikado serialise failed due to problems with the input data. Please check the logs.")
+                os.remove(args.configuration.db_settings.db)
+                sys.exit(1)
             logger.info("Finished to load BLAST data")
         else:
             logger.warning("No valid BLAST file specified, skipping this phase")
@@ -174,6 +182,154 @@ def load_external(args, logger):
         logger.info("Finished loading external data")
 
 
+# Tables written by each loading stage, in order of dependency
+stage_tables = {"orfs": ["orf"],
+                "blast": ["hit", "hsp"],
+                "external": ["external_sources", "external"],
+                "junctions": ["chrom", "junctions"]}
+
+
+def _requested_stages(configuration) -> list:
+    """Function to determine which loading stages have to be executed, given the input files."""
+
+    stages = []
+    if len(configuration.serialise.files.orfs) > 0:
+        stages.append("orfs")
+    if configuration.serialise.files.xml:
+        stages.append("blast")
+    if configuration.serialise.files.external_scores not in (None, ""):
+        stages.append("external")
+    if configuration.serialise.files.junctions:
+        stages.append("junctions")
+    return stages
+
+
+def seed_sequences(configuration, logger, targets=True):
+    """
+    Function to load the transcripts (queries) and the BLAST targets into the database once,
+    before launching the loading stages concurrently. Sequences already present in the
+    database are not loaded again, so that the stages will find all of them in place.
+
+    :param configuration: the configuration object.
+    :param logger: the logging instance.
+    :type logger: logging.Logger
+
+    :param targets: boolean flag. If False, the BLAST targets will not be loaded.
+    """
+
+    from sqlalchemy import select
+    from ..serializers.blast_serializer import Query, Target
+
+    engine = dbutils.connect(configuration, logger=logger)
+    to_load = []
+    if targets is True:
+        to_load.append((Target.__table__, "target_name", "target_length",
+                        configuration.serialise.files.blast_targets))
+    transcripts = configuration.serialise.files.transcripts
+    if transcripts and os.path.exists(transcripts):
+        to_load.insert(0, (Query.__table__, "query_name", "query_length", [transcripts]))
+
+    for table, name_column, length_column, filenames in to_load:
+        present = set(row[0] for row in engine.execute(select([table.c[name_column]])))
+        objects, done = [], 0
+        for filename in filenames:
+            fasta = pysam.FastaFile(filename)
+            for record, length in zip(fasta.references, fasta.lengths):
+                if record in present:
+                    continue
+                present.add(record)
+                objects.append({name_column: record, length_column: length})
+                if len(objects) >= configuration.serialise.max_objects:
+                    engine.execute(table.insert(), objects)
+                    done += len(objects)
+                    objects = []
+            fasta.close()
+        if objects:
+            engine.execute(table.insert(), objects)
+            done += len(objects)
+        logger.info("Loaded %d sequences into the \"%s\" table", done, table.name)
+    engine.dispose()
+
+
+def _stage_worker(stage, configuration, logging_queue, log_level):
+    """Function executed by each of the processes of the pipeline mode."""
+
+    logger = logging.getLogger("serialiser.{}".format(stage))
+    logger.handlers = []
+    logger.addHandler(logging.handlers.QueueHandler(logging_queue))
+    logger.setLevel(log_level)
+    logger.propagate = False
+    loader = {"orfs": load_orfs, "blast": load_blast, "external": load_external, "junctions": load_junctions}[stage]
+    try:
+        loader(argparse.Namespace(configuration=configuration), logger)
+    except Exception as exc:
+        logger.exception(exc)
+        raise
+
+
+def serialise_pipeline(args, logger):
+    """
+    Function to perform the serialisation in pipeline mode. After loading the sequences once,
+    the loading stages (junctions, ORFs, BLAST, external scores) are executed concurrently, each in
+    its own process. With SQLite, which allows a single writer at a time, each stage writes into its
+    own staging copy of the database; the staging databases are merged at the end.
+
+    :param args: the Namespace with all the details from the command line.
+
+    :param logger: the logging instance.
+    :type logger: logging.Logger
+    """
+
+    configuration = args.configuration
+    stages = _requested_stages(configuration)
+    seed_sequences(configuration, logger, targets=("blast" in stages))
+    if len(stages) == 0:
+        return
+
+    is_sqlite = (configuration.db_settings.dbtype == "sqlite")
+    context = multiprocessing.get_context(configuration.multiprocessing_method)
+    logging_queue = context.Queue(-1)
+    log_writer = logging.handlers.QueueListener(logging_queue, logger)
+    log_writer.start()
+    staging, processes = dict(), dict()
+    try:
+        for stage in stages:
+            stage_configuration = configuration.copy()
+            if is_sqlite:
+                handle, staging[stage] = tempfile.mkstemp(suffix=".{}.db".format(stage),
+                                                          dir=os.path.dirname(configuration.db_settings.db))
+                os.close(handle)
+                shutil.copyfile(configuration.db_settings.db, staging[stage])
+                stage_configuration.db_settings.db = staging[stage]
+            processes[stage] = context.Process(target=_stage_worker,
+                                               name="serialise-{}".format(stage),
+                                               args=(stage, stage_configuration, logging_queue,
+                                                     configuration.log_settings.log_level))
+            processes[stage].start()
+            logger.info("Started the loading of %s", stage)
+
+        failed = []
+        for stage, process in processes.items():
+            process.join()
+            if process.exitcode != 0:
+                failed.append(stage)
+        if failed:
+            logger.critical("Mikado serialise failed while loading %s. Please check the logs.", ", ".join(failed))
+            if is_sqlite and os.path.exists(configuration.db_settings.db):
+                os.remove(configuration.db_settings.db)
+            sys.exit(1)
+        if is_sqlite:
+            from .. import serializers  # Necessary to populate the metadata
+            for stage, staging_db in staging.items():
+                # Stages add their own queries and targets when missing from the seeded ones (eg the ORF loader
+                # without a transcript FASTA file); these are matched by name, and their IDs remapped.
+                dbutils.merge_databases(configuration.db_settings.db, staging_db, stage_tables[stage],
+                                        new_rows_only=True, shared_tables=("query", "target"), logger=logger)
+    finally:
+        log_writer.stop()
+        [os.remove(staging_db) for staging_db in staging.values() if os.path.exists(staging_db)]
+
+
 def setup(args):
 
     """
@@ -224,6 +380,13 @@ def setup(args):
     args.configuration.serialise.max_target_seqs = args.max_target_seqs or args.configuration.serialise.max_target_seqs
     args.configuration.threads = args.procs or args.configuration.threads
     args.configuration.serialise.single_thread = args.single_thread or args.configuration.serialise.single_thread
+    args.configuration.serialise.pipeline = getattr(args, "pipeline", None) or args.configuration.serialise.pipeline
+    args.configuration.serialise.bulk_load = (getattr(args, "bulk_load", None) or
+                                              args.configuration.serialise.bulk_load)
+    args.configuration.serialise.compact_match = (getattr(args, "compact_match", None) or
+                                                  args.configuration.serialise.compact_match)
+    if getattr(args, "tabular_chunk_size", None) is not None:
+        args.configuration.serialise.tabular_chunk_size = args.tabular_chunk_size
 
     if args.seed is not None:
         args.configuration.seed = args.seed
@@ -252,6 +415,10 @@ def setup(args):
             args.configuration.serialise.files.output_dir,
             args.configuration.db_settings.db)
 
+    if getattr(args, "export_snapshot", None) is not None:
+        args.configuration.db_settings.snapshot = path_join(
+            args.configuration.serialise.files.output_dir, args.export_snapshot)
+
     if args.log is not None:
         args.configuration.serialise.files.log = args.log
 
@@ -340,7 +507,7 @@ def setup(args):
                         args.configuration.db_settings.db)
             os.remove(args.configuration.db_settings.db)
 
-        engine = dbutils.connect(args.configuration)
+        engine = dbutils.connect(args.configuration, indexes=not args.configuration.serialise.bulk_load)
         meta = sqlalchemy.MetaData(bind=engine)
         meta.reflect(engine)
         for tab in reversed(meta.sorted_tables):
@@ -353,7 +520,9 @@ def setup(args):
         # This would fail in MySQL as it uses the OPTIMIZE TABLE syntax above
         elif args.configuration.db_settings.dbtype != "sqlite":
             engine.execute("VACUUM")
-        dbutils.DBBASE.metadata.create_all(engine)
+        dbutils.create_tables(engine, indexes=not args.configuration.serialise.bulk_load)
+    elif args.configuration.serialise.bulk_load is True:
+        dbutils.connect(args.configuration, indexes=False).dispose()
 
     return args, logger, sql_logger
 
@@ -371,10 +540,23 @@ def serialise(args):
     args, logger, sql_logger = setup(args)
 
     # logger.info("Command line: %s",  " ".join(sys.argv))
-    load_orfs(args, logger)
-    load_blast(args, logger)
-    load_external(args, logger)
-    load_junctions(args, logger)
+    if args.configuration.serialise.pipeline is True:
+        serialise_pipeline(args, logger)
+    else:
+        load_orfs(args, logger)
+        load_blast(args, logger)
+        load_external(args, logger)
+        load_junctions(args, logger)
+    if args.configuration.serialise.bulk_load is True:
+        logger.info("Building the database indexes")
+        engine = dbutils.connect(args.configuration)
+        dbutils.build_indexes(engine, logger=logger)
+        engine.dispose()
+    if getattr(args, "export_snapshot", None) is not None:
+        from ..serializers.snapshot import export_snapshot
+        logger.info("Exporting the database snapshot to %s", args.configuration.db_settings.snapshot)
+        export_snapshot(args.configuration, args.configuration.db_settings.snapshot, logger=logger,
+                        batch_size=args.configuration.serialise.max_objects)
     logger.info("Finished")
     try:
         return 0
@@ -456,6 +638,18 @@ a valid start codon.""")
                        default=None, dest="single_thread",
                        help="""Force serialise to run with a single thread, irrespective of
                        other configuration options.""")
+    blast.add_argument("--compact-match", action="store_true", default=None, dest="compact_match",
+                       help="""Store the match lines of the BLAST HSPs in run-length encoded form,
+                       reducing the size of the database.""")
+    blast.add_argument("--tabular-chunk-size", type=int, default=None, dest="tabular_chunk_size",
+                       help="""Read tabular BLAST/DIAMOND files in chunks of approximately this many rows,
+                       keeping the memory usage bounded. The files must be grouped by query. Default: 0 (disabled).""")
+    blast.add_argument("--bulk-load", action="store_true", default=None, dest="bulk_load",
+                       help="""Create the tables without their secondary indexes, and build the indexes
+                       only once all the data has been loaded. Recommended for very large BLAST/DIAMOND outputs.""")
+    blast.add_argument("--pipeline", action="store_true", default=None,
+                       help="""Load the transcripts and BLAST targets once, and then serialise junctions,
+                       ORFs, BLAST data and external scores concurrently, each in its own process.""")
 
     junctions = parser.add_argument_group()
     junctions.add_argument("--genome_fai", default=None)
@@ -474,6 +668,11 @@ a valid start codon.""")
                          help="""Maximum number of objects to cache in memory before
                          committing to the database. Default: 100,000 i.e.
                          approximately 450MB RAM usage for Drosophila.""")
+    generic.add_argument("--export-snapshot", dest="export_snapshot", type=str, default=None,
+                         help="""At the end of the serialisation, export the junctions, ORFs, external scores
+                         and BLAST hits into a read-only binary snapshot, which mikado pick can use in place of
+                         the database (see the --snapshot option of mikado pick). Relative paths are placed
+                         in the output directory.""")
     generic.add_argument("-f", "--force", action="store_true", default=False,
                          help="""Flag. If set, an existing databse will be deleted (sqlite)
                          or dropped (MySQL/PostGreSQL) before beginning the serialisation.""")
@@ -5,10 +5,30 @@
 Unit tests for the scales library
 """
 
+import gzip
+import itertools
+import os
+import queue
+import random
+import tempfile
 import unittest
+import msgpack
+import pkg_resources
 from .. import loci, utilities
 from .. import scales
 from ..scales.assignment.assigner import Assigner
+from ..scales.assignment.sweep import SweepAssigner
+from ..scales.prediction_parsers import compare_isoforms, get_annotator, parse_self
+from ..scales.prediction_parsers.parse_gtf_prediction import parse_prediction_gtf
+from ..scales.prediction_parsers.sharding import find_shards, open_shard
+from ..scales.prediction_parsers.transmission import RegionSharder
+from ..scales.accountant import Accountant
+from ..scales.flag_tables import FlagTable, TranscriptFlags
+from ..scales.reference_preparation.binary_index import BinaryIndex, index_version, open_index
+from ..scales.reference_preparation.gene_dict import GeneDict, GeneCache
+from ..scales.reference_preparation.indexing import create_index, check_index
+from ..exceptions import CorruptIndex
+from ..parsers import to_gff
 
 
 class AssignerTest(unittest.TestCase):
@@ -1310,6 +1330,433 @@ class AssignerTest(unittest.TestCase):
                 else:
                     self.assertEqual(result.ccode, ("j",), fuzzymatch)
 
+    def test_compare_many(self):
+
+        logger = utilities.log_utils.create_null_logger("test_compare_many")
+        with to_gff(pkg_resources.resource_filename("Mikado.tests", "trinity.gtf")) as reference:
+            references = [transcript for transcript in parse_prediction_gtf(
+                utilities.namespace.Namespace(prediction=reference), logger) if transcript is not None]
+        with to_gff(pkg_resources.resource_filename("Mikado.tests", "mikado_prepared.gtf")) as prediction:
+            predictions = [transcript for transcript in parse_prediction_gtf(
+                utilities.namespace.Namespace(prediction=prediction), logger) if transcript is not None]
+        self.assertGreater(len(references), 1)
+
+        for lenient, strict_strandedness, fuzzymatch in ((False, False, 0), (True, False, 0), (False, True, 10)):
+            with self.subTest(lenient=lenient, strict_strandedness=strict_strandedness, fuzzymatch=fuzzymatch):
+                for prediction in predictions:
+                    expected = [scales.contrast.compare(prediction, reference, lenient=lenient,
+                                                        strict_strandedness=strict_strandedness,
+                                                        fuzzymatch=fuzzymatch)
+                                for reference in references]
+                    found = scales.contrast.compare_many(prediction, references, lenient=lenient,
+                                                         strict_strandedness=strict_strandedness,
+                                                         fuzzymatch=fuzzymatch)
+                    self.assertEqual([(repr(result), exon) for result, exon in expected],
+                                     [(repr(result), exon) for result, exon in found])
+        self.assertEqual(scales.contrast.compare_many(predictions[0], []), [])
+
+    def test_compare_isoforms(self):
+
+        gene = loci.Gene(None)
+        for num, exons in enumerate([[(101, 500), (801, 1000)], [(101, 500), (801, 1200)],
+                                     [(301, 500), (601, 700), (801, 1000)], [(1501, 2000)]]):
+            transcript = loci.Transcript()
+            transcript.chrom, transcript.strand, transcript.id = "Chr1", "+", "t{}".format(num)
+            transcript.add_exons(exons)
+            transcript.finalize()
+            gene.add(transcript)
+        gene.finalize()
+        expected = [Assigner.compare(gene.transcripts[first], gene.transcripts[second])[0]
+                    for first, second in itertools.combinations(gene.transcripts.keys(), 2)]
+        found = list(compare_isoforms(gene))
+        self.assertEqual(len(found), 6)
+        self.assertEqual([repr(result) for result in expected], [repr(result) for result in found])
+
+    def test_prediction_shards(self):
+
+        logger = utilities.log_utils.create_null_logger("test_prediction_shards")
+        with open(pkg_resources.resource_filename("Mikado.tests", "trinity.gtf")) as gtf:
+            lines = [line for line in gtf if line.startswith("Chr5\t")]
+
+        def parse(prediction):
+            return [(transcript.chrom, transcript.id, transcript.exons) for transcript in parse_prediction_gtf(
+                utilities.namespace.Namespace(prediction=prediction), logger) if transcript is not None]
+
+        with tempfile.TemporaryDirectory() as folder:
+            fname = os.path.join(folder, "prediction.gtf")
+            with open(fname, "wt") as out:
+                print("# Comment", file=out)
+                out.write("".join(lines))
+                out.write("".join(line.replace("Chr5", "Chr1", 1) for line in lines[:50]))
+            with to_gff(fname) as prediction:
+                expected = parse(prediction)
+                shards = find_shards(prediction, processes=1)
+                self.assertEqual([shard[0] for shard in shards], ["Chr5", "Chr1"])
+                self.assertEqual(shards[-1][-1], os.stat(fname).st_size)
+                found = []
+                for chrom, start, end in sorted(shards, key=lambda shard: shard[1]):
+                    with open_shard(prediction, start, end) as shard:
+                        self.assertIsInstance(shard, type(prediction))
+                        found.extend(parse(shard))
+            self.assertEqual(found, expected)
+            self.assertEqual(set(row[0] for row in found), {"Chr1", "Chr5"})
+            # Too few shards for the processes
+            with to_gff(fname) as prediction:
+                self.assertIsNone(find_shards(prediction, processes=len(lines)))
+
+            # A chromosome split in two blocks cannot be sharded
+            with open(fname, "at") as out:
+                out.write("".join(lines[:10]))
+            with to_gff(fname) as prediction:
+                self.assertIsNone(find_shards(prediction))
+            # Neither can a compressed file
+            with open(fname, "rb") as gtf, gzip.open(fname + ".gz", "wb") as out:
+                out.write(gtf.read())
+            with to_gff(fname + ".gz") as prediction:
+                self.assertIsNone(find_shards(prediction))
+
+    def test_prediction_shards_split(self):
+
+        logger = utilities.log_utils.create_null_logger("test_prediction_shards_split")
+
+        def parse(prediction):
+            return [(transcript.chrom, transcript.id, transcript.exons) for transcript in get_annotator(prediction)(
+                utilities.namespace.Namespace(prediction=prediction), logger) if transcript is not None]
+
+        # Chromosomes larger than their share of the file are split between genes, so that all processes have work
+        for fname in ("trinity.gtf", "trinity.gff3", "trinity.bed12"):
+            with self.subTest(fname=fname), to_gff(pkg_resources.resource_filename("Mikado.tests", fname)) as prediction:
+                expected = parse(prediction)
+                shards = find_shards(prediction, processes=4)
+                self.assertGreaterEqual(len(shards), 4)
+                found = []
+                for chrom, start, end in sorted(shards, key=lambda shard: shard[1]):
+                    with open_shard(prediction, start, end) as shard:
+                        found.extend(parse(shard))
+                self.assertEqual(found, expected)
+
+    def test_region_sharding(self):
+
+        queues = [queue.Queue() for _ in range(3)]
+        sharder = RegionSharder(queues, region_size=10000, maxsize=2)
+        positions = [("Chr1", 101), ("Chr1", 5001), ("Chr1", 9001), ("Chr1", 15001), ("Chr2", 101),
+                     ("Chr1", 25001), ("Chr2", 3001), ("Chr1", 8001)]
+        for num, (chrom, start) in enumerate(positions):
+            transcript = loci.Transcript()
+            transcript.chrom, transcript.start, transcript.end, transcript.strand = chrom, start, start + 500, "+"
+            transcript.id = "t{}".format(num)
+            transcript.add_exons([(start, start + 500)])
+            sharder.send(transcript)
+        sharder.flush()
+
+        found = dict()
+        for counter, worker_queue in enumerate(queues):
+            while not worker_queue.empty():
+                region, rows = worker_queue.get()
+                rows = msgpack.loads(rows)
+                self.assertLessEqual(len(rows), 2)
+                for row in rows:
+                    self.assertEqual((row["chrom"], row["start"] // 10000), region)
+                    found[row["id"]] = counter
+        self.assertEqual(sorted(found.keys()), sorted("t{}".format(num) for num in range(len(positions))))
+        # All the transcripts of a region go to the same worker; new regions go to the least loaded one
+        self.assertEqual(found["t0"], found["t1"])
+        self.assertEqual(found["t0"], found["t2"])
+        self.assertEqual(found["t0"], found["t7"])
+        self.assertEqual(found["t4"], found["t6"])
+        self.assertEqual(len(set([found["t0"], found["t3"], found["t4"]])), 3)
+
+    def test_region_sharding_streaming(self):
+
+        def transcripts(positions):
+            for num, (chrom, start) in enumerate(positions):
+                transcript = loci.Transcript()
+                transcript.chrom, transcript.start, transcript.end = chrom, start, start + 500
+                transcript.strand, transcript.id = "+", "t{}".format(num)
+                transcript.add_exons([(start, start + 500)])
+                yield transcript
+
+        def received(queues):
+            rows = []
+            for worker_queue in queues:
+                while not worker_queue.empty():
+                    rows.extend(msgpack.loads(worker_queue.get()[1]))
+            return rows
+
+        # Sorted, sparse input: one transcript every 50 kbps, 20 per region. Each region is sent as soon as
+        # the input moves past it, rather than when its batch is full.
+        positions = [(chrom, 1 + 50000 * num) for chrom in ("Chr1", "Chr2") for num in range(100)]
+        queues = [queue.Queue() for _ in range(2)]
+        sharder = RegionSharder(queues)
+        for transcript in transcripts(positions):
+            sharder.send(transcript)
+        self.assertEqual(sharder.buffered, 20)
+        self.assertEqual(len(received(queues)), 180)
+        sharder.flush()
+        self.assertEqual(len(received(queues)), 20)
+
+        # Unsorted input: the batches are sent once too many transcripts are waiting
+        random.seed(10)
+        random.shuffle(positions)
+        sharder = RegionSharder(queues, max_buffered=50)
+        found = []
+        for transcript in transcripts(positions):
+            sharder.send(transcript)
+            self.assertLess(sharder.buffered, 50)
+        found.extend(received(queues))
+        self.assertGreater(len(found), 0)
+        sharder.flush()
+        found.extend(received(queues))
+        self.assertEqual(sorted(row["id"] for row in found), sorted("t{}".format(num) for num in range(200)))
+
+    def test_gene_cache(self):
+
+        cache = GeneCache(2)
+        cache["a"], cache["b"] = 1, 2
+        self.assertEqual(cache["a"], 1)
+        cache["c"] = 3
+        self.assertNotIn("b", cache)
+        self.assertIn("a", cache)
+        self.assertEqual(len(cache), 2)
+        unbounded = GeneCache()
+        for num in range(100):
+            unbounded[num] = num
+        self.assertEqual(len(unbounded), 100)
+
+    def test_flag_tables(self):
+
+        table = FlagTable()
+        table.set_bits((10, 20), 0b01)
+        table.set_bits((30, 40), 0b10)
+        table[(50, 60)] = 0b101
+        table.clear_bits((50, 60), 0b100)
+        self.assertEqual(dict(table.items()), {(10, 20): 0b01, (30, 40): 0b10, (50, 60): 0b1})
+        other = FlagTable()
+        other.set_bits((70, 80), 0b10)
+        other.set_bits((10, 20), 0b10)
+        table.merge(other.state)
+        self.assertEqual(list(table.keys()), [(10, 20), (30, 40), (50, 60), (70, 80)])
+        self.assertEqual(table.values.tolist(), [0b11, 0b10, 0b1, 0b10])
+
+        # The private bit of the reference transcripts is kept only if set in both tables
+        genes = TranscriptFlags(default=0b1000)
+        genes.add_gene("G0")
+        genes.intern(("G1", "T1.1"))
+        genes.intern(("G1", "T1.2"))
+        genes.clear_bits(("G1", "T1.2"), 0b1000)
+        genes.set_bits(("G1", "T1.2"), 0b100)
+        other = TranscriptFlags(default=0b1000)
+        other.set_bits(("G1", "T1.1"), 0b1)
+        other.intern(("G2", "T2.1"))
+        genes.merge(other, intersection=0b1000)
+        self.assertEqual(dict(genes.items()), {("G1", "T1.1"): 0b1001, ("G1", "T1.2"): 0b100,
+                                               ("G2", "T2.1"): 0b1000})
+        self.assertEqual(genes.gene_num, 3)
+        gene_or, gene_and = genes.gene_flags()
+        self.assertEqual(gene_or.tolist(), [0, 0b1101, 0b1000])
+        self.assertEqual((gene_and & 0b1000).tolist(), [0b1000, 0, 0b1000])
+
+
+class IndexedReferenceTest(unittest.TestCase):
+
+    """Tests of the comparison against an indexed reference (trinity.gtf), with the transcripts of
+    mikado_prepared.gtf, sorted by position, as predictions."""
+
+    logger = utilities.log_utils.create_null_logger("indexed_reference")
+
+    @classmethod
+    def setUpClass(cls):
+        cls.index_folder = tempfile.TemporaryDirectory()
+        cls.index = os.path.join(cls.index_folder.name, "trinity.gtf.midx")
+        with to_gff(pkg_resources.resource_filename("Mikado.tests", "trinity.gtf")) as reference:
+            create_index(reference, cls.logger, cls.index)
+        with to_gff(pkg_resources.resource_filename("Mikado.tests", "mikado_prepared.gtf")) as prediction:
+            predictions = [transcript for transcript in parse_prediction_gtf(
+                utilities.namespace.Namespace(prediction=prediction), cls.logger) if transcript is not None]
+        cls.predictions = sorted(predictions, key=lambda transcript: (transcript.chrom, transcript.start))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.index_folder.cleanup()
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def get_args(self, name="out", distance=2000):
+        """Method to create the arguments of an Assigner, with its outputs in the temporary folder of the test."""
+        args = utilities.namespace.Namespace(default=False)
+        args.out = os.path.join(self.folder.name, name)
+        args.log_queue = queue.Queue()
+        args.distance = distance
+        return args
+
+    def test_gene_dict_prefetch(self):
+
+        gdict = GeneDict(self.index, cache_size=5)
+        reference = GeneDict(self.index)
+        positions = sorted(gdict.positions)
+        chrom, start, end, _ = positions[0]
+        window_end = max(position[2] for position in positions[:10])
+        gdict.prefetch(chrom, start, window_end)
+        overlapping = set(position[3] for position in positions
+                          if position[0] == chrom and position[1] <= window_end and position[2] >= start)
+        self.assertGreater(len(overlapping), 5)
+        self.assertEqual(set(gdict._GeneDict__prefetched.keys()), overlapping)
+        for gid in list(gdict):
+            self.assertEqual(gdict[gid].as_dict(), reference[gid].as_dict())
+        self.assertIsNone(gdict["non_existent"])
+
+    def test_assigner_prefetch(self):
+
+        def get_assigner(distance):
+            assigner = Assigner(self.index, self.get_args(distance=distance), printout_tmap=False)
+            self.assertIsInstance(assigner.genes, GeneDict)
+            prefetch, windows = assigner.genes.prefetch, []
+
+            def counter(chrom, start, end):
+                windows.append((chrom, start, end))
+                prefetch(chrom, start, end)
+
+            assigner.genes.prefetch = counter
+            return assigner, windows
+
+        # Sorted predictions: the genes are prefetched once per window
+        assigner, windows = get_assigner(2000)
+        for transcript in self.predictions:
+            assigner._prefetch(transcript)
+        self.assertGreater(len(windows), 0)
+        self.assertLess(len(windows), len(self.predictions))
+
+        # Unsorted predictions: prefetching stops as soon as the input moves backwards
+        assigner, windows = get_assigner(2000)
+        for transcript in reversed(self.predictions):
+            assigner._prefetch(transcript)
+        self.assertLessEqual(len(windows), 1)
+
+        # A prediction closer than the distance to the start of the chromosome reuses the clamped window
+        chrom, start, _, _ = min(GeneDict(self.index).positions)
+        assigner, windows = get_assigner(start + 1000)
+        assigner.genes.is_loaded = lambda gid: False
+        for position in (100, 200):
+            assigner._prefetch(utilities.namespace.Namespace(chrom=chrom, start=position, end=500))
+        self.assertEqual(len(windows), 1)
+        self.assertEqual(windows[0][1], 0)
+
+    def test_sweep_assigner(self):
+
+        outputs = dict()
+        for name, assigner_class in (("standard", Assigner), ("sweep", SweepAssigner)):
+            args = self.get_args(name)
+            args.report_fusions = True
+            assigner = assigner_class(self.index, args, printout_tmap=True)
+            window = 0
+            for transcript in self.predictions:
+                assigner.get_best(transcript.deepcopy())
+                if assigner_class is SweepAssigner:
+                    window = max(window, len(assigner.genes))
+            assigner.finish()
+            outputs[name] = dict()
+            for suffix in ("tmap", "refmap"):
+                with open("{}.{}".format(args.out, suffix)) as output:
+                    outputs[name][suffix] = output.read()
+            if assigner_class is SweepAssigner:
+                self.assertLess(window, len(list(GeneDict(self.index))))
+                self.assertGreater(window, 0)
+        self.assertEqual(outputs["standard"], outputs["sweep"])
+
+        # Predictions out of order are refused, rather than compared against an incomplete window
+        args = self.get_args("unsorted")
+        args.report_fusions = True
+        assigner = SweepAssigner(self.index, args, printout_tmap=True)
+        with self.assertRaises(ValueError):
+            for transcript in reversed(self.predictions):
+                assigner.get_best(transcript.deepcopy())
+        assigner.tmap_out.close()
+
+    def test_parse_self(self):
+
+        # All the genes of trinity.gtf have a single transcript, so there would be nothing to compare
+        index = os.path.join(self.folder.name, "cufflinks.gtf.midx")
+        with to_gff(pkg_resources.resource_filename("Mikado.tests", "cufflinks.gtf")) as reference:
+            create_index(reference, self.logger, index)
+        tmaps = dict()
+        for processes in (1, 2):
+            args = self.get_args("self{}".format(processes))
+            args.processes = processes
+            args.fuzzymatch = 0
+            # Small batches, so that each process analyses several of them
+            parse_self(args, index, self.logger, batch_size=2)
+            with open("{}.tmap".format(args.out)) as tmap:
+                tmaps[processes] = tmap.read()
+        self.assertGreater(len(tmaps[1].split("\n")), 5)
+        self.assertEqual(tmaps[1], tmaps[2])
+
+    def test_binary_index(self):
+
+        indices = {1: self.index, 2: os.path.join(self.folder.name, "trinity.v2.midx")}
+        with to_gff(pkg_resources.resource_filename("Mikado.tests", "trinity.gtf")) as reference:
+            create_index(reference, self.logger, indices[2], version=2)
+        for version in (1, 2):
+            self.assertEqual(index_version(indices[version]), version)
+        check_index(indices[2], self.logger)
+        gdict, bindex = GeneDict(indices[1]), open_index(indices[2])
+        self.assertIsInstance(bindex, BinaryIndex)
+        self.assertEqual(list(gdict), list(bindex))
+        self.assertEqual(list(gdict.positions), list(bindex.positions))
+        for gid in gdict:
+            self.assertEqual(gdict[gid].as_dict(), bindex[gid].as_dict())
+            for transcript in gdict[gid]:
+                self.assertEqual(transcript.location, bindex.location(gid, transcript.id))
+        positions = list(gdict.positions)
+        for chrom, start, end, gid in positions:
+            self.assertEqual(list(gdict.get_position(chrom, start, end)),
+                             list(bindex.get_position(chrom, start, end)))
+            window = (start - 1000, start + 1000)
+            self.assertEqual(set(bindex.overlapping(chrom, *window)),
+                             set(position[3] for position in positions if position[0] == chrom and
+                                 position[1] <= window[1] and position[2] >= window[0]))
+        self.assertEqual(bindex.overlapping("Chr1", 1, 10 ** 9), [])
+
+        args = self.get_args()
+        for exclude_utr, protein_coding in ((False, False), (False, True), (True, False)):
+            with self.subTest(exclude_utr=exclude_utr, protein_coding=protein_coding):
+                from_sqlite = Accountant(GeneDict(indices[1], exclude_utr=exclude_utr,
+                                                  protein_coding=protein_coding), args, load_ref=True)
+                from_binary = Accountant(BinaryIndex(indices[2], exclude_utr=exclude_utr,
+                                                     protein_coding=protein_coding), args, load_ref=True)
+                for attribute in ("ref_genes", "exons", "starts", "ends", "introns", "intron_chains"):
+                    self.assertEqual(getattr(from_sqlite, attribute), getattr(from_binary, attribute))
+        bindex.close()
+
+        with open(indices[2], "rb") as index, open(os.path.join(self.folder.name, "truncated.midx"), "wb") as out:
+            out.write(index.read(1000))
+        with self.assertRaises(CorruptIndex):
+            check_index(os.path.join(self.folder.name, "truncated.midx"), self.logger)
+
+    def test_accountant_merge(self):
+
+        stats = dict()
+        for name in ("single", "merged"):
+            args = self.get_args(name)
+            final = Assigner(self.index, args, printout_tmap=True)
+            if name == "single":
+                for transcript in self.predictions:
+                    final.get_best(transcript.deepcopy())
+            else:
+                # As in multi-process runs, the workers send their results to the final assigner
+                for chunk in (self.predictions[::2], self.predictions[1::2]):
+                    worker = Assigner(self.index, args, printout_tmap=False)
+                    for transcript in chunk:
+                        worker.get_best(transcript.deepcopy())
+                    final.load_result(*worker.dump())
+            final.finish()
+            with open("{}.stats".format(args.out)) as out:
+                stats[name] = out.read().split("\n")[2:]
+        self.assertEqual(stats["single"], stats["merged"])
+
 
 if __name__ == '__main__':
     unittest.main()
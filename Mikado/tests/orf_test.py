@@ -12,6 +12,9 @@ from re import sub
 from ..utilities.log_utils import create_default_logger
 import pysam
 import pkg_resources
+import tempfile
+import os
+from ..serializers.orf import split_lines, _parse_orf_range
 
 
 class OrfTester(unittest.TestCase):
@@ -641,5 +644,67 @@ scallop_SRR5956444_SRR5956444_SCLP.17.0.1\tProdigal_v2.6.3\tCDS\t798\t1085\t16.5
             self.assertTrue(b.has_stop_codon)
 
 
+class OrfRangeTester(unittest.TestCase):
+
+    def test_split_lines(self):
+        with tempfile.NamedTemporaryFile(mode="wt", suffix=".txt", delete=False) as temp:
+            for num in range(100):
+                print("line{}".format(num) * (num % 7 + 1), file=temp)
+        try:
+            with open(temp.name) as handle:
+                lines = handle.readlines()
+            for chunks in (1, 2, 3, 10, 100, 1000):
+                with self.subTest(chunks=chunks):
+                    ranges = split_lines(temp.name, chunks)
+                    self.assertLessEqual(len(ranges), chunks)
+                    found = []
+                    with open(temp.name, "rb") as handle:
+                        for start, end in ranges:
+                            handle.seek(start)
+                            found.extend(handle.read(end - start).decode().splitlines(keepends=True))
+                    self.assertEqual(found, lines)
+        finally:
+            os.remove(temp.name)
+
+    def test_parse_ranges(self):
+        orfs = pkg_resources.resource_filename("Mikado.tests", "transcripts.fasta.prodigal.gff3")
+        fasta = pkg_resources.resource_filename("Mikado.tests", "mikado_prepared.fasta")
+        whole, invalid, _ = _parse_orf_range((0, os.path.getsize(orfs)), filename=orfs, fasta_index=fasta,
+                                             is_gff=True, max_regression=0.2, table=0)
+        self.assertGreater(len(whole), 0)
+        split, split_invalid = [], 0
+        for byte_range in split_lines(orfs, 7):
+            found, found_invalid, _ = _parse_orf_range(byte_range, filename=orfs, fasta_index=fasta,
+                                                       is_gff=True, max_regression=0.2, table=0)
+            split.extend(found)
+            split_invalid += sum(found_invalid.values())
+        self.assertEqual(split, whole)
+        self.assertEqual(split_invalid, sum(invalid.values()))
+
+    def test_parse_ranges_bed12(self):
+        orfs = pkg_resources.resource_filename("Mikado.tests", "transcripts.fasta.prodigal.gff3")
+        fasta = pkg_resources.resource_filename("Mikado.tests", "mikado_prepared.fasta")
+        fai = pysam.FastaFile(fasta)
+        lengths = dict(zip(fai.references, fai.lengths))
+        with tempfile.NamedTemporaryFile(mode="wt", suffix=".bed12", delete=False) as temp, open(orfs) as gff:
+            for line in GFF.GFF3(gff):
+                if line.header is True or line.feature != "CDS":
+                    continue
+                print(line.chrom, 0, lengths[line.chrom], "{}_{}".format(line.chrom, line.id), line.score, line.strand,
+                      line.start - 1, line.end, 0, 1, lengths[line.chrom], 0, sep="\t", file=temp)
+        try:
+            expected = [row.as_simple_dict() for row in bed12.Bed12Parser(
+                temp.name, fasta_index=fai, transcriptomic=True, max_regression=0.2, table=0)
+                if row.header is False and row.invalid is False]
+            self.assertGreater(len(expected), 0)
+            found = []
+            for byte_range in split_lines(temp.name, 7):
+                found.extend(_parse_orf_range(byte_range, filename=temp.name, fasta_index=fasta,
+                                              is_gff=False, max_regression=0.2, table=0)[0])
+            self.assertEqual(found, expected)
+        finally:
+            os.remove(temp.name)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -251,11 +251,9 @@ class MiscTest(unittest.TestCase):
         self.assertTrue(os.stat(proc.func.fasta_out).st_size > 0, (proc.func.fasta_out,
                         cmo.output))
         fasta_lines = []
-        with open(proc.func.fasta_out) as f_out:
-            for line in f_out:
-                line = line.rstrip()
-                line = re.sub("0/", "", line)
-                fasta_lines.append(line)
+        for counter, record in checking.read_records(proc.func.fasta_out):
+            self.assertEqual(counter, 0)
+            fasta_lines.extend(record.decode().rstrip().split("\n"))
 
         self.assertGreater(len(fasta_lines), 1)
         seq = self.fai.fetch(lines["chrom"], lines["start"] - 1, lines["end"])
@@ -280,3 +278,143 @@ class MiscTest(unittest.TestCase):
             os.remove(faix.name + ".fai")
 
         listener.stop()
+
+
+class PartialRecordsTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        records = [(1, b">t1\nACGT"), (3, b"Chr1\tfoo\ttranscript\t1\t4\n/3/\t.\t+"), (10, b"")]
+        with tempfile.NamedTemporaryFile(mode="wb", delete=False) as partial:
+            for counter, record in records:
+                checking.write_record(partial, counter, record)
+        self.assertEqual(list(checking.read_records(partial.name)),
+                         [(counter, record + b"\n") for counter, record in records])
+        os.remove(partial.name)
+
+    def test_merge_checked(self):
+        from ..preparation.prepare import _merge_checked
+        # Transcripts 2 and 4 (out of 5) were discarded by the checking processes
+        kept = {1: (b"gtf1", b"fa1"), 3: (b"gtf3", b"fa3"), 5: (b"gtf5", b"fa5")}
+        partial_gtf, partial_fasta = [], []
+        for batch in ((1, 5), (3,)):
+            for files, field in ((partial_gtf, 0), (partial_fasta, 1)):
+                with tempfile.NamedTemporaryFile(mode="wb", delete=False) as partial:
+                    for counter in batch:
+                        checking.write_record(partial, counter, kept[counter][field])
+                files.append(partial.name)
+        self.assertEqual(list(_merge_checked(partial_gtf, partial_fasta, [0, 4, 7, 8, 10])),
+                         [(0, ("gtf1", "fa1")), (4, False), (7, ("gtf3", "fa3")), (8, False), (10, ("gtf5", "fa5"))])
+        self.assertFalse(any(os.path.exists(filename) for filename in partial_gtf + partial_fasta))
+
+
+class BamLoadingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bam = pkg_resources.resource_filename("Mikado.tests", "trinity.minimap2.bam")
+        self.logger = utilities.log_utils.create_null_logger("bam_loading")
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _load(self, name, **kwargs):
+        from ..preparation.annotation_parser import load_from_bam
+        from ..parsers import to_gff
+        shelf = os.path.join(self.tempdir.name, name)
+        new_ids, rows = load_from_bam(shelf, to_gff(self.bam), "tr", set(), self.logger, **kwargs)
+        # Remove the write_start, which depends on the order of insertion into the shelf
+        return new_ids, sorted(row[:5] + row[6:] for row in rows)
+
+    def test_sharded_loading(self):
+        ids, rows = self._load("sequential")
+        self.assertEqual(len(ids), 38)
+        self.assertEqual(len(rows), 38)
+        for threads, shard_size in [(2, 0), (2, 10 ** 6), (3, 123457)]:
+            with self.subTest(threads=threads, shard_size=shard_size):
+                sh_ids, sh_rows = self._load("sharded_{}_{}".format(threads, shard_size),
+                                             threads=threads, shard_size=shard_size)
+                self.assertEqual(ids, sh_ids)
+                self.assertEqual(rows, sh_rows)
+
+    def test_mapq_filter(self):
+        ids, rows = self._load("filtered", min_mapq=61, threads=2)
+        self.assertEqual(len(ids), 0)
+        self.assertEqual(len(rows), 0)
+        ids, rows = self._load("secondary", skip_secondary=True, skip_supplementary=True)
+        self.assertEqual(len(ids), 38)
+
+    def test_index_rows_round_trip(self):
+        from ..preparation.annotation_parser import dump_rows, load_rows, index_name
+        from ..preparation.annotation_parser import load_from_bam
+        from ..parsers import to_gff
+        shelf = os.path.join(self.tempdir.name, "shelf")
+        _, rows = load_from_bam(shelf, to_gff(self.bam), "tr", set(), self.logger)
+        dump_rows(rows, shelf)
+        self.assertTrue(os.path.exists(index_name(shelf)))
+        columns = load_rows(shelf)
+        self.assertEqual(len(columns), 7)
+        self.assertEqual(list(zip(*columns)), rows)
+        dump_rows([], shelf)
+        self.assertEqual(load_rows(shelf), [[]] * 7)
+
+
+class PrepareCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        from ..configuration import configurator
+        self.conf = configurator.load_and_validate_config(None)
+        self.conf.reference.genome = pkg_resources.resource_filename("Mikado.tests", "genome.fai")
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.logger = utilities.log_utils.create_null_logger("prepare_cache")
+        self.gtf = os.path.join(self.tempdir.name, "input.gtf")
+        with open(self.gtf, "wt") as out:
+            out.write(open(pkg_resources.resource_filename("Mikado.tests", "trinity.gtf")).read())
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_shelf_round_trip(self):
+        import pandas as pd
+        from ..preparation.caching import PrepareCache
+        cache = PrepareCache(os.path.join(self.tempdir.name, "cache"), self.conf, self.logger)
+        shelf = os.path.join(self.tempdir.name, "shelf")
+        key = cache.input_key(shelf, self.gtf, "tr", False, False, False, False)
+        self.assertIsNone(cache.restore_shelf(shelf))
+        with open(shelf, "wb") as out:
+            out.write(b"shelf_content")
+        rows = pd.DataFrame([["Chr5", 10, 100, "+", "tr_t1", 0, 13, shelf]],
+                            columns=["chrom", "start", "end", "strand", "tid", "write_start", "write_length", "shelf"])
+        cache.store_shelf(shelf, rows)
+        os.remove(shelf)
+        restored = cache.restore_shelf(shelf)
+        self.assertEqual(restored.values.tolist(), rows.values.tolist())
+        with open(shelf, "rb") as inp:
+            self.assertEqual(inp.read(), b"shelf_content")
+        # Different options or a modified file invalidate the key
+        self.assertNotEqual(key, cache.input_key(shelf, self.gtf, "tr2", False, False, False, False))
+        self.assertNotEqual(key, cache.input_key(shelf, self.gtf, "tr", False, False, False, True))
+        with open(self.gtf, "at") as out:
+            out.write("\n")
+        self.assertNotEqual(key, cache.input_key(shelf, self.gtf, "tr", False, False, False, False))
+        self.assertIsNone(cache.restore_shelf(shelf))
+
+    def test_checked(self):
+        from ..preparation.caching import PrepareCache
+        cache_dir = os.path.join(self.tempdir.name, "cache")
+        cache = PrepareCache(cache_dir, self.conf, self.logger)
+        shelf = os.path.join(self.tempdir.name, "shelf")
+        cache.input_key(shelf, self.gtf, "tr", False, False, False, False)
+        self.assertIsNone(cache.get_checked(shelf, "tr_t1"))
+        cache.set_checked(shelf, "tr_t1", ("gtf", "fasta"))
+        cache.set_checked(shelf, "tr_t2", False)
+        cache.flush()
+        cache = PrepareCache(cache_dir, self.conf, self.logger)
+        cache.input_key(shelf, self.gtf, "tr", False, False, False, False)
+        self.assertEqual(cache.get_checked(shelf, "tr_t1"), ("gtf", "fasta"))
+        self.assertIs(cache.get_checked(shelf, "tr_t2"), False)
+        self.assertIsNone(cache.get_checked(shelf, "tr_t3"))
+        # Changing the checking options invalidates the results
+        self.conf.prepare.lenient = not self.conf.prepare.lenient
+        cache = PrepareCache(cache_dir, self.conf, self.logger)
+        cache.input_key(shelf, self.gtf, "tr", False, False, False, False)
+        self.assertIsNone(cache.get_checked(shelf, "tr_t1"))
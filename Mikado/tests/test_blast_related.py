@@ -3,14 +3,22 @@
 
 import tempfile
 from ..parsers import blast_utils
+from ..configuration import configurator
+import json
+import msgpack
+import zlib
 import unittest
 import os
 import gzip
 import subprocess
 from ..serializers.blast_serializer import xml_utils as seri_blast_utils
 from ..serializers.blast_serializer import xml_serialiser as seri_blast_xml
-from ..serializers.blast_serializer.tabular_utils import matrices
-from ..serializers.blast_serializer.btop_parser import parse_btop
+from ..serializers.blast_serializer.tabular_utils import matrices, prepare_tab_data, prepare_tab_hit, split_tab_data
+from ..serializers.blast_serializer.tabular_utils import query_grouped_chunks
+from ..exceptions import InvalidSerialization
+from ..utilities.log_utils import create_null_logger
+from ..serializers.blast_serializer.btop_parser import parse_btop, parse_btop_intervals
+import pandas as pd
 import numpy as np
 import time
 import itertools
@@ -128,6 +136,70 @@ class BtopTester(unittest.TestCase):
                                 self.assertEqual(np.where(qar[1] > 0)[0].shape[0], mlength * qmult)
 
 
+class BtopIntervalsTester(unittest.TestCase):
+
+    def test_intervals_equal_arrays(self):
+        matrix = matrices["blosum62"]
+        for btop in ("10", "5AT3", "4-A2", "3A-4", "2*-1AS-W6", "AAAT1-C*A", "ST-S2DE"):
+            for qmult, tmult in ((3, 1), (1, 1), (1, 3)):
+                with self.subTest(btop=btop, qmult=qmult, tmult=tmult):
+                    qar, sar = np.zeros([3, 200], dtype=int), np.zeros([3, 200], dtype=int)
+                    qar, sar, tot, match = parse_btop(btop, 2, 4, qar, sar, matrix, qmult=qmult, tmult=tmult)
+                    span, imatch, qend, send, identical, positives = parse_btop_intervals(
+                        btop, 2, 4, matrix, qmult, tmult)
+                    self.assertEqual(span, tot)
+                    self.assertEqual(imatch, match)
+                    self.assertEqual(list(np.where(qar[0] > 0)[0]), list(range(2, qend)))
+                    self.assertEqual(list(np.where(sar[0] > 0)[0]), list(range(4, send)))
+                    for row, intervals in ((1, identical), (2, positives)):
+                        self.assertEqual(list(np.where(qar[row] > 0)[0]),
+                                         [pos for start, end in intervals for pos in range(start, end)])
+
+    def test_prepare_tab_data(self):
+        data = pd.DataFrame(
+            [[1, 1, 0, 27, 0, 9, 1, 0, 1, 9, 50., 1e-10, "5AT3", 60, 30, 1, 1e-10, 50.],
+             [1, 1, 15, 33, 5, 12, 1, 0, 2, 7, 30., 1e-5, "4-A2", 60, 30, 1, 1e-10, 50.],
+             [1, 2, 3, 27, 2, 9, 1, 0, 1, 8, 20., 1e-3, "3A-4", 60, 20, 2, 1e-3, 20.]],
+            columns=["qid", "sid", "qstart", "qend", "sstart", "send", "query_frame", "target_frame", "hsp_num",
+                     "length", "bitscore", "evalue", "btop", "qlength", "slength", "hit_num", "min_evalue",
+                     "max_bitscore"])
+        columns = dict((col, idx) for idx, col in enumerate(data.columns))
+        hits, hsps = prepare_tab_data(data, matrix_name="blosum62", qmult=3, tmult=1)
+        self.assertEqual(len(hits), 2)
+        self.assertEqual(len(hsps), 3)
+        for num, rows in enumerate(([0, 1], [2])):
+            hit, hit_hsps = prepare_tab_hit(tuple(data.values[rows[0], :2]), data.values[rows, :],
+                                            columns=columns, matrix_name="blosum62", qmult=3, tmult=1)
+            self.assertEqual(hits[num], hit)
+            self.assertEqual(hsps[rows[0]:rows[-1] + 1], hit_hsps)
+        # Hits must never be split across chunks
+        chunks = list(split_tab_data(data, 3))
+        self.assertEqual([chunk.shape[0] for chunk in chunks], [2, 1])
+
+
+class TabularChunksTester(unittest.TestCase):
+
+    @staticmethod
+    def _chunks(qids, size):
+        data = pd.DataFrame({"qseqid": qids, "row": range(len(qids))})
+        return [data.iloc[start:start + size] for start in range(0, data.shape[0], size)]
+
+    def test_complete_queries(self):
+        qids = ["a"] * 5 + ["b"] + ["c"] * 3 + ["d"] * 2
+        for size in range(1, len(qids) + 1):
+            with self.subTest(size=size):
+                chunks = list(query_grouped_chunks(self._chunks(qids, size)))
+                self.assertEqual(pd.concat(chunks).row.tolist(), list(range(len(qids))))
+                found = [qid for chunk in chunks for qid in chunk.qseqid.unique()]
+                self.assertEqual(found, ["a", "b", "c", "d"])
+
+    def test_ungrouped(self):
+        for qids in (["a", "b", "a", "c"], ["a", "a", "b", "b", "c", "a"]):
+            for size in (1, 2, 4):
+                with self.subTest(qids=qids, size=size), self.assertRaises(InvalidSerialization):
+                    list(query_grouped_chunks(self._chunks(qids, size)))
+
+
 class XMLLineTester(unittest.TestCase):
 
     class HSP(object):
@@ -279,6 +351,137 @@ class BlastBasics(unittest.TestCase):
         os.chdir(master)
 
 
+class MatchEncodingTester(unittest.TestCase):
+
+    def test_roundtrip(self):
+        from ..serializers.blast_serializer.hsp import encode_match, decode_match
+        self.assertEqual(encode_match("|||||+/||"), "5|+/2|")
+        self.assertEqual(decode_match("5|+/2|"), "|||||+/||")
+        for match in ("", "|", "|+/-_*", "|+/|+/|+/||", "_" * 12 + "|" * 150 + "*-"):
+            with self.subTest(match=match):
+                self.assertEqual(decode_match(encode_match(match)), match)
+                # Plain match lines are returned unchanged
+                self.assertEqual(decode_match(match), match)
+        self.assertIsNone(decode_match(None))
+
+    def test_compact_hsps(self):
+        from ..serializers.blast_serializer.utils import compact_hsps, _match_index
+        hsps = [{"match": "|||+"}, {"match": "//"}]
+        self.assertEqual(compact_hsps(hsps), [{"match": "3|+"}, {"match": "2/"}])
+        row = [None] * (_match_index + 2)
+        row[_match_index] = "||"
+        self.assertEqual(compact_hsps([row])[0][_match_index], "2|")
+
+
+class XMLSplitTester(unittest.TestCase):
+
+    def setUp(self):
+        self.plain = tempfile.NamedTemporaryFile(suffix=".xml", delete=False)
+        with gzip.open(os.path.join(os.path.dirname(__file__), "chunk-001-proteins.xml.gz"), "rb") as xml:
+            self.plain.write(xml.read())
+        self.plain.close()
+        self.conf = configurator.load_and_validate_config(None)
+        self.conf.db_settings.db = tempfile.mktemp(suffix=".db")
+
+    def tearDown(self):
+        for name in (self.plain.name, self.conf.db_settings.db):
+            if os.path.exists(name):
+                os.remove(name)
+
+    def __unpickle(self, dbname, rows):
+        records = []
+        with open(dbname, "rb") as dbhandle:
+            for _, write_start, write_length in seri_blast_xml.struct_row.iter_unpack(zlib.decompress(rows)):
+                dbhandle.seek(write_start)
+                records.append(json.loads(msgpack.loads(dbhandle.read(write_length), raw=False)))
+        os.remove(dbname)
+        return records
+
+    def test_split(self):
+        with open(self.plain.name, "rb") as xml:
+            data = xml.read()
+        header_end, ranges = seri_blast_xml.split_xml(self.plain.name, 8, min_size=1000)
+        self.assertEqual(header_end, data.find(b"<Iteration>"))
+        self.assertEqual(len(ranges), 8)
+        self.assertEqual(ranges[-1][1], data.rfind(b"</BlastOutput_iterations>"))
+        for (start, end), (next_start, _) in zip(ranges[:-1], ranges[1:]):
+            self.assertEqual(end, next_start)
+        self.assertTrue(all(data[start:start + 11] == b"<Iteration>" for start, _ in ranges))
+        # Files smaller than the minimum chunk size are not split
+        self.assertEqual(len(seri_blast_xml.split_xml(self.plain.name, 8)[1]), 1)
+
+    def test_range_stream(self):
+        with open(self.plain.name, "rb") as xml:
+            data = xml.read()
+        header_end, ranges = seri_blast_xml.split_xml(self.plain.name, 5, min_size=1000)
+        for start, end in ranges:
+            with seri_blast_xml._XMLRange(self.plain.name, header_end, (start, end)) as stream:
+                streamed = b"".join(iter(lambda: stream.read(1000), b""))
+            self.assertEqual(streamed, data[:header_end] + data[start:end] + seri_blast_xml._xml_footer)
+
+    def test_chunks_equal_whole(self):
+        queries, targets = dict(), dict()
+        with blast_utils.BlastOpener(self.plain.name) as opened:
+            for record in opened:
+                queries.setdefault(record.id, len(queries) + 1)
+                for hit in record.hits:
+                    targets.setdefault(hit.accession, len(targets) + 1)
+        cache = {"query": queries, "target": targets}
+        header_end, ranges = seri_blast_xml.split_xml(self.plain.name, 5, min_size=1000)
+        whole = self.__unpickle(*seri_blast_xml.xml_pickler(self.conf, self.plain.name, None, cache=cache,
+                                                            max_target_seqs=5))
+        chunked = []
+        for byte_range in ranges:
+            chunked.extend(self.__unpickle(*seri_blast_xml.xml_pickler(
+                self.conf, self.plain.name, None, cache=cache, max_target_seqs=5,
+                byte_range=byte_range, header_end=header_end)))
+        self.assertEqual(len(whole), 93)
+        self.assertGreater(sum(len(record["hits"]) for record in whole), 0)
+        self.assertEqual(whole, chunked)
+
+    def test_tasks(self):
+        compressed = os.path.join(os.path.dirname(__file__), "chunk-001-proteins.xml.gz")
+        # Files too small to be split are parsed as a whole, without decompressing them
+        tasks, temporary = seri_blast_xml._xml_tasks([compressed, self.plain.name], 4)
+        self.assertEqual(tasks, [(compressed, None, None), (self.plain.name, None, None)])
+        self.assertEqual(temporary, [])
+        self.assertEqual(seri_blast_xml._uncompressed_size(compressed), os.stat(self.plain.name).st_size)
+        tasks, temporary = seri_blast_xml._xml_tasks([compressed], 4, min_size=1000)
+        try:
+            self.assertEqual(len(temporary), 1)
+            self.assertEqual(len(tasks), 8)
+            self.assertTrue(all(task[0] == temporary[0] and task[1] is not None for task in tasks))
+        finally:
+            [os.remove(name) for name in temporary]
+
+    def test_failed_range(self):
+
+        class Failed:
+            @staticmethod
+            def get():
+                raise ValueError("Truncated")
+
+        class Parsed:
+            def __init__(self, name):
+                self.name = name
+
+            def get(self):
+                return self.name, b""
+
+        logger = create_null_logger()
+        dbfile = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+        dbfile.close()
+        # A file parsed as a whole is skipped
+        results = seri_blast_xml._gather_results([("a.xml", None, None), ("b.xml", None, None)],
+                                                 [Failed(), Parsed(dbfile.name)], logger)
+        self.assertEqual(results, [(dbfile.name, b"")])
+        # A range is not, as part of the file would be missing
+        with self.assertRaises(InvalidSerialization):
+            seri_blast_xml._gather_results([("a.xml", (10, 20), 10), ("a.xml", (20, 30), 10)],
+                                           [Parsed(dbfile.name), Failed()], logger)
+        self.assertFalse(os.path.exists(dbfile.name))
+
+
 class TestMerging(unittest.TestCase):
 
     """Small class to test basic cases of the merging algorithm."""
@@ -12,6 +12,7 @@ import sqlalchemy.engine.base
 import sqlite3
 from .. import serializers
 import shutil
+import tempfile
 import pkg_resources
 
 
@@ -122,5 +123,93 @@ class TestDbConnect(unittest.TestCase):
         self.assertEqual(str(connector.url), "sqlite:///:memory:")
 
 
+class TestBulkLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.conf = configurator.load_and_validate_config(None)
+        self.conf.db_settings.db = tempfile.mktemp(suffix=".db")
+
+    def tearDown(self):
+        if os.path.exists(self.conf.db_settings.db):
+            os.remove(self.conf.db_settings.db)
+
+    def __indexes(self, engine):
+        inspector = sqlalchemy.inspect(engine)
+        return set(index["name"] for table in inspector.get_table_names()
+                   for index in inspector.get_indexes(table))
+
+    def test_deferred_indexes(self):
+        names = set(index.name for index in dbutils.deferred_indexes())
+        for name in ("hit_query_idx", "hit_evalue_idx", "hsp_combined_idx", "junction_index", "orf_index"):
+            self.assertIn(name, names)
+        unique = {"qt_index", "ix_query_query_name", "ix_target_target_name"}
+        self.assertFalse(unique & names)
+        engine = dbutils.connect(self.conf, indexes=False)
+        self.assertEqual(self.__indexes(engine), unique)
+        dbutils.build_indexes(engine)
+        self.assertEqual(self.__indexes(engine), names | unique)
+        engine.dispose()
+        # Connecting in bulk-load mode to an existing database drops the secondary indexes
+        engine = dbutils.connect(self.conf, indexes=False)
+        self.assertEqual(self.__indexes(engine), unique)
+        engine.dispose()
+
+    def test_bulk_insert(self):
+        engine = dbutils.connect(self.conf, indexes=False)
+        table = serializers.blast_serializer.Query.__table__
+        objects = [{"query_name": "q{}".format(num), "query_length": num * 10, "foo": None}
+                   for num in range(1, 101)]
+        dbutils.bulk_insert(engine, table, objects)
+        dbutils.bulk_insert(engine, table, [])
+        rows = engine.execute("SELECT query_id, query_name, query_length FROM query ORDER BY query_id").fetchall()
+        self.assertEqual([tuple(row) for row in rows],
+                         [(num, "q{}".format(num), num * 10) for num in range(1, 101)])
+        with self.assertRaises(sqlite3.IntegrityError):
+            dbutils.bulk_insert(engine, table, objects[:1])
+        self.assertEqual(engine.execute("SELECT COUNT(*) FROM query").fetchone()[0], 100)
+        engine.dispose()
+
+
+    def test_merge_untyped_staging(self):
+        engine = dbutils.connect(self.conf)
+        engine.execute("INSERT INTO query (query_name, query_length) VALUES ('q0', 10)")
+        staging = tempfile.mktemp(suffix=".staging.db")
+        with sqlite3.connect(staging) as conn:
+            conn.execute('CREATE TABLE query ("query_id", "query_name", "query_length")')
+            conn.executemany("INSERT INTO query VALUES (?, ?, ?)", [(None, "q1", "20"), (None, "q2", 30)])
+        dbutils.merge_databases(self.conf.db_settings.db, staging, ["query"])
+        os.remove(staging)
+        rows = engine.execute("SELECT query_id, query_name, query_length FROM query ORDER BY query_id").fetchall()
+        # The column affinity of the main table applies to the merged values
+        self.assertEqual([tuple(row) for row in rows], [(1, "q0", 10), (2, "q1", 20), (3, "q2", 30)])
+        engine.dispose()
+
+    def test_merge_shared_tables(self):
+        engine = dbutils.connect(self.conf)
+        engine.execute("INSERT INTO query (query_name, query_length) VALUES ('q0', 10)")
+        stagings = []
+        # Both staging databases start as copies of the main one, and add their own queries
+        for names in (("q1", "q2"), ("q2", "q3")):
+            staging = tempfile.mktemp(suffix=".staging.db")
+            shutil.copyfile(self.conf.db_settings.db, staging)
+            with sqlite3.connect(staging) as conn:
+                conn.executemany("INSERT INTO query (query_name, query_length) VALUES (?, 10)",
+                                 [(name,) for name in names])
+                stagings.append(staging)
+        with sqlite3.connect(stagings[0]) as conn:
+            conn.execute("INSERT INTO external_sources (source, rtype, valid_raw) VALUES ('foo', 'float', 0)")
+            conn.execute("INSERT INTO external (query_id, source_id, score) SELECT query_id, 1, query_name FROM query")
+        for staging in reversed(stagings):
+            dbutils.merge_databases(self.conf.db_settings.db, staging, ["external_sources", "external"],
+                                    new_rows_only=True, shared_tables=("query", "target"))
+            os.remove(staging)
+        rows = engine.execute("SELECT query_id, query_name FROM query ORDER BY query_id").fetchall()
+        self.assertEqual([tuple(row) for row in rows], [(1, "q0"), (2, "q2"), (3, "q3"), (4, "q1")])
+        # The foreign keys of the merged rows point to the queries with the same names
+        rows = engine.execute("SELECT query_name, score FROM external JOIN query USING (query_id)").fetchall()
+        self.assertEqual(sorted(tuple(row) for row in rows), [("q0", "q0"), ("q1", "q1"), ("q2", "q2")])
+        engine.dispose()
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -243,6 +243,46 @@ class TestLoadJunction(unittest.TestCase):
         if os.path.exists("{}.fai".format(genome_file.name)):
             os.remove("{}.fai".format(genome_file.name))
 
+    def test_merge_databases(self):
+
+        import shutil
+        import sqlite3
+        # The staging database starts as a copy of the main one, which already contains the junctions
+        main_db = tempfile.mktemp(suffix=".db")
+        shutil.copyfile(self.dbfile, main_db)
+        with serializers.junction.JunctionSerializer(self.junction_file, configuration=self.configuration,
+                                                     logger=self.logger) as jser:
+            jser()
+        utilities.dbutils.merge_databases(main_db, self.dbfile, ["chrom", "junctions"], new_rows_only=True)
+        with sqlite3.connect(main_db) as conn, sqlite3.connect(self.dbfile) as staging:
+            self.assertEqual(conn.execute("select count(*) from junctions").fetchone()[0], 744)
+            for table in ("chrom", "junctions"):
+                self.assertEqual(conn.execute("select * from {} order by rowid".format(table)).fetchall(),
+                                 staging.execute("select * from {} order by rowid".format(table)).fetchall())
+        os.remove(main_db)
+
+    def test_parse_junction_lines(self):
+
+        with open(self.junction_file) as handle:
+            lines = handle.readlines()
+        lines += ["# A comment\n", "\n", "track name=extra\n",
+                  "Chr2\t100\t300\tID=named_junc;coding=False\t.\t.\t150\t250\t0\t2\t50,50\t0,150\n",
+                  "Chr2\t400\t600\tjunc_attrs\t2.5\t-\t450\t550\t0\t2\t50,50\t0,150\tID=other_name\n"]
+        parsed = serializers.junction.parse_junction_lines(lines)
+        expected = []
+        for line in lines:
+            row = parsers.bed12.BED12(line)
+            if row.header is True:
+                continue
+            expected.append([row.chrom, row.start, row.end, row.name, row.strand,
+                             row.thick_start, row.thick_end, row.score])
+        self.assertEqual(parsed.shape[0], len(expected))
+        for found, row in zip(parsed.itertuples(index=False), expected):
+            found = list(found)
+            if found[-1] != found[-1]:  # NaN score
+                found[-1] = None
+            self.assertEqual(found, row)
+
     def test_invalid_bed12(self):
 
         with self.assertRaises(TypeError):
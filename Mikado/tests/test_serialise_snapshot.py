@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+import numpy as np
+import sqlalchemy.orm
+from .. import configuration, serializers, utilities
+from ..loci import Superlocus, Transcript
+from ..parsers import bed12
+from ..serializers.blast_serializer import Query, Target, Hit, Hsp
+from ..serializers.external import External, ExternalSource
+from ..serializers.orf import Orf
+from ..serializers.snapshot import export_snapshot, Snapshot, open_snapshot
+
+
+__author__ = 'Luca Venturini'
+
+
+class TestSnapshot(unittest.TestCase):
+
+    logger = utilities.log_utils.create_null_logger("test_snapshot")
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.configuration = configuration.configurator.load_and_validate_config(None)
+        self.configuration.db_settings.dbtype = "sqlite"
+        self.configuration.db_settings.db = os.path.join(self.folder.name, "mikado.db")
+        self.configuration.reference.genome_fai = os.path.join(os.path.dirname(__file__), "genome.fai")
+        serializers.junction.JunctionSerializer(os.path.join(os.path.dirname(__file__), "junctions.bed"),
+                                                configuration=self.configuration)()
+        self.engine = utilities.dbutils.connect(self.configuration)
+        session = sqlalchemy.orm.sessionmaker(bind=self.engine)()
+        queries = [Query("T1", 1200), Query("T2", 900), Query("T3", 600)]
+        targets = [Target("P{}".format(num), 200 + 50 * num) for num in range(1, 5)]
+        source = ExternalSource("fpkm", np.dtype("float"), False)
+        session.add_all(queries + targets + [source])
+        session.commit()
+
+        for query, start, end in ((queries[0], 10, 910), (queries[0], 300, 1101), (queries[1], 1, 603)):
+            orf = bed12.BED12("\t".join(str(_) for _ in [
+                query.query_name, 0, query.query_length, "{}.orf".format(query.query_name), 0, "+",
+                start, end, 0, 1, query.query_length, 0]), transcriptomic=True)
+            session.add(Orf(orf, query.query_id))
+        session.add(External(queries[1].query_id, source.source_id, 12.5))
+        session.commit()
+
+        hits, hsps = [], []
+        for query in queries[:2]:
+            for num, target in enumerate(targets, 1):
+                evalue = 10 ** (-60 + 15 * num)
+                hits.append({"query_id": query.query_id, "target_id": target.target_id, "evalue": evalue,
+                             "bits": 300 - 50 * num, "global_identity": 90, "global_positives": 95,
+                             "query_start": 1, "query_end": 600, "target_start": 1, "target_end": 200,
+                             "hit_number": num, "query_multiplier": 3, "target_multiplier": 1,
+                             "query_aligned_length": 600, "target_aligned_length": 200})
+                for counter, hsp_evalue in enumerate([evalue, evalue * 1e3]):
+                    hsps.append({"counter": counter, "query_id": query.query_id, "target_id": target.target_id,
+                                 "query_hsp_start": 1 + 300 * counter, "query_hsp_end": 300 + 300 * counter,
+                                 "query_frame": 1, "target_hsp_start": 1 + 100 * counter,
+                                 "target_hsp_end": 100 + 100 * counter, "target_frame": 0, "match": "100",
+                                 "hsp_evalue": hsp_evalue, "hsp_bits": 100, "hsp_identity": 90,
+                                 "hsp_positives": 95, "hsp_length": 100})
+        self.engine.execute(Hit.__table__.insert(), hits)
+        self.engine.execute(Hsp.__table__.insert(), hsps)
+        session.close()
+        self.snapshot = os.path.join(self.folder.name, "mikado.snapshot")
+        export_snapshot(self.configuration, self.snapshot, logger=self.logger, batch_size=2)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.folder.cleanup()
+
+    def __db_data_dict(self, tids):
+        transcript = Transcript()
+        transcript.chrom, transcript.start, transcript.end, transcript.strand, transcript.id = \
+            "Chr5", 1, 100, "+", "foo"
+        transcript.add_exon((1, 100))
+        transcript.finalize()
+        slocus = Superlocus(transcript, configuration=self.configuration)
+        slocus.connect_to_db(self.engine)
+        return slocus._create_data_dict(self.engine, tids)
+
+    def test_data_dict(self):
+
+        tids = ["T1", "T2", "T3", "T4"]
+        snapshot = Snapshot(self.snapshot)
+        self.assertTrue(snapshot.is_compatible(self.configuration))
+        for evalue, max_target_seqs in ((1e-6, 3), (1e-20, 3), (1e-6, 1)):
+            with self.subTest(evalue=evalue, max_target_seqs=max_target_seqs):
+                self.configuration.pick.chimera_split.blast_params.evalue = evalue
+                self.configuration.pick.chimera_split.blast_params.max_target_seqs = max_target_seqs
+                expected = self.__db_data_dict(tids)
+                found = snapshot.create_data_dict(self.configuration, "Chr5", [], tids)
+                self.assertGreater(len(found["hits"]["T1"]), 0)
+                for key in ("hits", "external"):
+                    self.assertEqual(dict((tid, val) for tid, val in expected[key].items() if val),
+                                     dict((tid, val) for tid, val in found[key].items() if val))
+                self.assertEqual(dict((tid, [str(orf) for orf in val]) for tid, val in expected["orfs"].items()),
+                                 dict((tid, [str(orf) for orf in val]) for tid, val in found["orfs"].items()))
+        snapshot.close()
+
+    def test_junctions(self):
+
+        with sqlite3.connect(self.configuration.db_settings.db) as conn:
+            junctions = conn.execute(" ".join([
+                "select chrom.name, junction_start, junction_end, strand from junctions",
+                "join chrom on junctions.chrom_id = chrom.chrom_id where chrom.name = 'Chr5'"])).fetchall()
+        introns = set((start, end) for _, start, end, _ in junctions)
+        introns.update((start + 1, end) for start, end in list(introns))
+        expected = dict(((chrom, start, end), strand) for chrom, start, end, strand in junctions)
+        snapshot = Snapshot(self.snapshot)
+        self.assertEqual(snapshot.verified_introns("Chr5", introns), expected)
+        self.assertEqual(snapshot.verified_introns("Chr2", introns), dict())
+        snapshot.close()
+
+    def test_compatibility(self):
+
+        self.configuration.db_settings.snapshot = self.snapshot
+        snapshot = open_snapshot(self.configuration, self.logger)
+        self.assertIsInstance(snapshot, Snapshot)
+        snapshot.close()
+        self.configuration.pick.chimera_split.blast_params.max_target_seqs = 10
+        self.assertIsNone(open_snapshot(self.configuration, self.logger))
+        self.configuration.pick.chimera_split.blast_params.max_target_seqs = 3
+        self.configuration.pick.chimera_split.blast_params.hsp_evalue = 1e-10
+        self.assertIsNone(open_snapshot(self.configuration, self.logger))
+        self.configuration.db_settings.snapshot = os.path.join(self.folder.name, "missing.snapshot")
+        self.assertIsNone(open_snapshot(self.configuration, self.logger))
+        with self.assertRaises(ValueError):
+            Snapshot(self.configuration.db_settings.db)
+
+    def test_stale(self):
+
+        self.configuration.db_settings.snapshot = self.snapshot
+        snapshot = open_snapshot(self.configuration, self.logger)
+        self.assertIsInstance(snapshot, Snapshot)
+        snapshot.close()
+        # A database serialised again makes the snapshot stale
+        time.sleep(0.1)
+        with sqlite3.connect(self.configuration.db_settings.db) as conn:
+            conn.execute("DELETE FROM external")
+        with self.assertLogs(self.logger.name, level="WARNING"):
+            self.assertIsNone(open_snapshot(self.configuration, self.logger))
+        export_snapshot(self.configuration, self.snapshot, logger=self.logger)
+        snapshot = open_snapshot(self.configuration, self.logger)
+        self.assertIsInstance(snapshot, Snapshot)
+        snapshot.close()
+        # As does pointing to a different database
+        self.configuration.db_settings.db = os.path.join(self.folder.name, "other.db")
+        self.assertIsNone(open_snapshot(self.configuration, self.logger))
+
+
+if __name__ == '__main__':
+    unittest.main()
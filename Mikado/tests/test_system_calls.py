@@ -30,6 +30,9 @@ from ..picking import picker
 from ..preparation import prepare
 from ..scales.compare import compare
 from ..scales.reference_preparation.indexing import load_index
+from ..scales.reference_preparation.gene_dict import GeneDict
+from ..scales.reference_preparation.reference_model import ReferenceModel, prepare_model
+from ..scales.accountant import Accountant
 from ..scales.calculator import Calculator
 from ..subprograms.prepare import prepare_launcher
 from ..subprograms.prepare import setup as prepare_setup
@@ -44,6 +47,7 @@ import threading
 from time import sleep
 import pysam
 import io
+import queue
 
 
 class ConvertCheck(unittest.TestCase):
@@ -983,6 +987,85 @@ class CompareCheck(unittest.TestCase):
                             pass
                     self.assertEqual(counter, 38)
 
+    def test_reference_model(self):
+
+        namespace = Namespace(default=False)
+        namespace.distance = 2000
+        namespace.index = True
+        namespace.prediction = None
+        namespace.log = None
+        logger = create_null_logger("null")
+        with tempfile.TemporaryDirectory() as folder:
+            temp_ref = os.path.join(folder, "trinity.gtf")
+            os.symlink(pkg_resources.resource_filename("Mikado.tests", "trinity.gtf"), temp_ref)
+            namespace.reference = to_gff(temp_ref)
+            with self.assertLogs("main_compare"):
+                compare(namespace)
+            index = "{}.midx".format(temp_ref)
+            model_name, temporary = prepare_model(index, namespace, logger)
+            self.assertEqual(model_name, "{}.model".format(index))
+            self.assertFalse(temporary)
+            # The second time, the model is reused
+            mtime = os.stat(model_name).st_mtime_ns
+            self.assertEqual(prepare_model(index, namespace, logger), (model_name, False))
+            self.assertEqual(os.stat(model_name).st_mtime_ns, mtime)
+
+            gdict, model = GeneDict(index), ReferenceModel(model_name)
+            self.assertEqual(list(gdict), list(model))
+            self.assertEqual(list(gdict.positions), list(model.positions))
+            for gid in gdict:
+                self.assertEqual(gdict[gid].as_dict(), model[gid].as_dict())
+                for transcript in gdict[gid]:
+                    self.assertEqual(transcript.location, model.location(gid, transcript.id))
+            args = Namespace(default=False)
+            args.verbose = False
+            args.log_queue = queue.Queue()
+            from_index = Accountant(gdict, args, load_ref=True)
+            from_model = Accountant(model, args, load_ref=True)
+            for attribute in ("ref_genes", "exons", "starts", "ends", "introns", "intron_chains"):
+                self.assertEqual(getattr(from_index, attribute), getattr(from_model, attribute), attribute)
+            model.close()
+
+            # Changing the flags makes the model obsolete
+            namespace.exclude_utr = True
+            prepare_model(index, namespace, logger)
+            model = ReferenceModel(model_name)
+            self.assertTrue(model.params["exclude_utr"])
+            model.close()
+            namespace.reference.close()
+
+    def test_compare_multiple_predictions(self):
+
+        files = [pkg_resources.resource_filename("Mikado.tests", filename)
+                 for filename in ("mikado_prepared.gtf", "trinity.gff3", "trinity.bed12")]
+        with tempfile.TemporaryDirectory() as folder:
+            # Keep the index out of the source tree
+            reference = os.path.join(folder, "trinity.gtf")
+            os.symlink(pkg_resources.resource_filename("Mikado.tests", "trinity.gtf"), reference)
+            outputs = dict()
+            for name, predictions, processes in [("single{}".format(num), [pred], 1)
+                                                 for num, pred in enumerate(files)] + [
+                    ("multi", files, 1), ("multi_procs", files, 2)]:
+                namespace = Namespace(default=False)
+                namespace.distance = 2000
+                namespace.gzip = False
+                namespace.processes = processes
+                namespace.log = None
+                namespace.reference = to_gff(reference)
+                namespace.prediction = [to_gff(pred) for pred in predictions]
+                namespace.out = os.path.join(folder, name)
+                with self.assertLogs("main_compare"):
+                    compare(namespace)
+                outputs[name] = namespace.out
+            labels = ["mikado_prepared", "trinity.2", "trinity.3"]
+            for num, run in itertools.product(range(len(labels)), ("multi", "multi_procs")):
+                for suffix in ("tmap", "refmap", "stats"):
+                    with self.subTest(label=labels[num], run=run, suffix=suffix):
+                        with open("{}.{}".format(outputs["single{}".format(num)], suffix)) as single, \
+                                open("{}.{}.{}".format(outputs[run], labels[num], suffix)) as multi:
+                            # The command line, at the top of the stats file, differs
+                            self.assertEqual(single.read().split("\n")[2:], multi.read().split("\n")[2:])
+
     def test_compare_problematic(self):
 
         problematic = pkg_resources.resource_filename("Mikado.tests", "Chrysemys_picta_bellii_problematic.gff3")
@@ -1900,6 +1983,57 @@ class SerialiseChecker(unittest.TestCase):
                 os.remove(db)
                 dir.cleanup()
 
+    def test_pipeline_vs_sequential(self):
+
+        xml = pkg_resources.resource_filename("Mikado.tests", "chunk-001-proteins.xml.gz")
+        transcripts = pkg_resources.resource_filename("Mikado.tests", "mikado_prepared.fasta")
+        junctions = pkg_resources.resource_filename("Mikado.tests", "junctions.bed")
+        orfs = pkg_resources.resource_filename("Mikado.tests", "transcripts.fasta.prodigal.gff3")
+        uniprot = pkg_resources.resource_filename("Mikado.tests", "uniprot_sprot_plants.fasta.gz")
+        external_base = pkg_resources.resource_filename("Mikado.tests", "test_external")
+        external_scores = os.path.join(external_base, "annotation_run1.metrics.testds.txt")
+
+        dir = tempfile.TemporaryDirectory(suffix="test_pipeline_vs_sequential")
+        json_file = os.path.join(dir.name, "mikado.yaml")
+        uni_out = os.path.join(dir.name, "uniprot_sprot_plants.fasta")
+        with gzip.open(uniprot, "rb") as uni, open(uni_out, "wb") as uni_out_handle:
+            uni_out_handle.write(uni.read())
+        # The external scores refer to a different set of transcripts
+        all_transcripts = os.path.join(dir.name, "transcripts.fasta")
+        with open(all_transcripts, "wt") as out:
+            for fasta in (transcripts, os.path.join(external_base, "mikado_prepared.testds.fasta")):
+                with open(fasta) as handle:
+                    out.write(handle.read())
+        self.configuration.multiprocessing_method = "fork"
+        with open(json_file, "wt") as json_handle:
+            print_config(self.configuration, json_handle, format="yaml")
+
+        contents = dict()
+        for pipeline in (False, True):
+            db = os.path.join(dir.name, "pipeline.db" if pipeline else "sequential.db")
+            log = "pipeline.log" if pipeline else "sequential.log"
+            sys.argv = [str(_) for _ in ["mikado", "serialise", "--json-conf", json_file,
+                                         "--transcripts", all_transcripts, "--blast_targets", uni_out,
+                                         "--orfs", orfs, "--junctions", junctions, "--xml", xml,
+                                         "--external-scores", external_scores, "-od", dir.name,
+                                         "-mo", 300, "--log", log, "--seed", "1078"]]
+            if pipeline is True:
+                sys.argv.append("--pipeline")
+            sys.argv.append(os.path.basename(db))
+            pkg_resources.load_entry_point("Mikado", "console_scripts", "mikado")()
+            with sqlite3.connect(db) as conn:
+                tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+                contents[pipeline] = dict(
+                    (table, conn.execute("SELECT * FROM {} ORDER BY rowid".format(table)).fetchall())
+                    for table in tables)
+
+        for table in ("query", "target", "orf", "hit", "hsp", "external_sources", "external", "chrom", "junctions"):
+            with self.subTest(table=table):
+                self.assertGreater(len(contents[False][table]), 0)
+                self.assertEqual(contents[False][table], contents[True][table])
+        self.assertEqual(contents[False], contents[True])
+        dir.cleanup()
+
     @mark.slow
     def test_xml_vs_tsv(self):
         xml = pkg_resources.resource_filename("Mikado.tests", os.path.join("blast_data", "diamond.0.9.30.xml.gz"))
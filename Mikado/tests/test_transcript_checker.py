@@ -3,8 +3,9 @@ import os
 import tempfile
 import unittest
 import pkg_resources
+import random
 import pyfaidx
-from ..transcripts.transcriptchecker import TranscriptChecker
+from ..transcripts.transcriptchecker import TranscriptChecker, wrap_sequence
 import pysam
 from ..parsers.GTF import GtfLine
 from ..transcripts.transcript import Transcript
@@ -365,6 +366,66 @@ class TChekerTester(unittest.TestCase):
         self.assertGreater(check_model.combined_cds_length, 0)
 
 
+class SpliceSiteBatchTester(unittest.TestCase):
+
+    logger = create_default_logger("splice_batch", level="WARNING")
+
+    def setUp(self):
+        random.seed(10)
+        self.sequence = "".join(random.choice("ACGTNacgt") for _ in range(2000))
+        # Introns with canonical splices on either strand, plus some soft-masked and non-canonical ones
+        self.sites = {(101, 200): ("GT", "AG"), (301, 400): ("CT", "AC"), (501, 600): ("GC", "AG"),
+                      (701, 800): ("GT", "AT"), (901, 1000): ("gt", "ag"), (1101, 1200): ("NN", "AG")}
+        sequence = list(self.sequence)
+        for (start, end), (donor, acceptor) in self.sites.items():
+            sequence[start - 1:start + 1] = donor
+            sequence[end - 2:end] = acceptor
+        self.sequence = "".join(sequence)
+
+    def test_against_single_check(self):
+        canonical = (("GT", "AG"), ("GC", "AG"), ("AT", "AC"))
+        batch = TranscriptChecker.classify_splice_sites(self.sequence, 1, list(self.sites) + [(1990, 2100)],
+                                                        canonical)
+        self.assertNotIn((1990, 2100), batch)
+        self.assertEqual(batch[(101, 200)], (True, False))
+        self.assertEqual(batch[(301, 400)], (False, True))
+        self.assertEqual(batch[(901, 1000)], (False, False))
+        for strand in ("+", "-"):
+            model = Transcript()
+            model.chrom, model.strand, model.id, model.parent = "Chr1", strand, "foo.1", "foo"
+            model.add_exons([(1, 100), (201, 300), (401, 500), (601, 700), (801, 900), (1001, 1100), (1201, 1300)])
+            model.finalize()
+            single = TranscriptChecker(model.copy(), self.sequence[:1300], lenient=True, logger=self.logger)
+            batched = TranscriptChecker(model.copy(), self.sequence[:1300], lenient=True, logger=self.logger,
+                                        splice_sites=batch)
+            for intron in model.introns:
+                with self.subTest(strand=strand, intron=intron):
+                    self.assertEqual(single._check_intron(intron),
+                                     batched._TranscriptChecker__intron_strand(*batch[intron]))
+            single.check_strand()
+            batched.check_strand()
+            self.assertEqual(single.strand, batched.strand)
+            self.assertEqual(single.attributes, batched.attributes)
+            self.assertIsNone(batched.splice_sites)
+
+
+class SequenceOutputTester(unittest.TestCase):
+
+    def test_rev_complement(self):
+        random.seed(20)
+        string = "".join(random.choice("ACGTUNRYKMBVDHSW-*acgtunrykmbvdhsw") for _ in range(500))
+        self.assertEqual(TranscriptChecker.rev_complement(string), Bio.Seq.reverse_complement(string))
+        self.assertEqual(TranscriptChecker.rev_complement(string.encode()),
+                         Bio.Seq.reverse_complement(string).encode())
+
+    def test_wrap_sequence(self):
+        for length in (0, 1, 59, 60, 61, 119, 120, 121, 1000):
+            with self.subTest(length=length):
+                sequence = "".join(random.choice("ACGT") for _ in range(length))
+                self.assertEqual(wrap_sequence(sequence.encode(), 60).decode(),
+                                 "\n".join(TranscriptChecker.grouper(sequence, 60)))
+
+
 class StopCodonChecker(unittest.TestCase):
 
     @classmethod
@@ -10,10 +10,58 @@ from ..exceptions import IncorrectStrandError, InvalidTranscript, InvalidCDS
 from collections import Counter
 from itertools import zip_longest
 from ..parsers.bed12 import BED12
+import functools
+import numpy as np
 import pyfaidx
 from Bio import Seq
 
 
+@functools.lru_cache(maxsize=8)
+def _canonical_codes(canonical_splices: tuple) -> (np.ndarray, np.ndarray):
+    """Private function to encode the canonical splices as integers, for the vectorised checks.
+    Each (donor, acceptor) couple is encoded in a 32-bit integer, one byte per base; the first array
+    contains the canonical splices on the plus strand of the genome, the second their reverse complements
+    as they would be found on the plus strand for an intron on the minus strand.
+    """
+
+    forward, reverse = [], []
+    for donor, acceptor in canonical_splices:
+        if not (len(donor) == len(acceptor) == 2):
+            continue
+        forward.append(_encode_splice((donor + acceptor).encode()))
+        reverse.append(_encode_splice((Seq.reverse_complement(acceptor) +
+                                       Seq.reverse_complement(donor)).encode()))
+    return np.array(forward, dtype=np.uint32), np.array(reverse, dtype=np.uint32)
+
+
+# Same complement as Bio.Seq.reverse_complement, including ambiguous bases and soft-masking
+_complement_from, _complement_to = b"ABCDGHKMRTUVYabcdghkmrtuvy", b"TVGHCDMKYAABRtvghcdmkyaabr"
+_bytes_complement = bytes.maketrans(_complement_from, _complement_to)
+_str_complement = str.maketrans(_complement_from.decode(), _complement_to.decode())
+
+
+def wrap_sequence(sequence: bytes, width=60) -> bytes:
+    """Function to split a sequence into lines of fixed width (without a trailing newline).
+    The lines are copied in a single pass into a preallocated buffer, through a NumPy view."""
+
+    full, rest = divmod(len(sequence), width)
+    num_lines = full + (rest > 0)
+    if num_lines <= 1:
+        return bytes(sequence)
+    buffer = bytearray(len(sequence) + num_lines)
+    view = np.frombuffer(buffer, dtype=np.uint8)
+    seq_view = np.frombuffer(sequence, dtype=np.uint8)
+    lines = view[:full * (width + 1)].reshape(full, width + 1)
+    lines[:, :width] = seq_view[:full * width].reshape(full, width)
+    lines[:, width] = ord("\n")
+    view[full * (width + 1):full * (width + 1) + rest] = seq_view[full * width:]
+    return bytes(memoryview(buffer)[:-1])
+
+
+def _encode_splice(splice: bytes):
+    return (splice[0] << 24) | (splice[1] << 16) | (splice[2] << 8) | splice[3]
+
+
 # pylint: disable=too-many-instance-attributes
 class TranscriptChecker(Transcript):
     """This is a subclass of the generic transcript class. Its purpose is to compare
@@ -36,7 +84,8 @@ class TranscriptChecker(Transcript):
                  is_reference=False,
                  canonical_splices=(("GT", "AG"), ("GC", "AG"), ("AT", "AC")),
                  strip_faulty_cds=False,
-                 logger=None):
+                 logger=None,
+                 splice_sites=None):
 
         """
         Constructor method. It inherits from Transcript, with some modifications.
@@ -52,6 +101,10 @@ class TranscriptChecker(Transcript):
         :param lenient: boolean flag. If set, incorrect transcripts will be
         flagged rather than discarded.
         :type lenient: bool
+
+        :param splice_sites: optional dictionary of introns already classified through
+        classify_splice_sites, e.g. for a whole batch of transcripts on the same chromosome.
+        :type splice_sites: (None|dict)
         """
         self.__strand_specific = False
         self.__is_reference = False
@@ -86,6 +139,7 @@ class TranscriptChecker(Transcript):
 
         self.canonical_junctions = []
         self.logger = logger
+        self.splice_sites = splice_sites
 
     # pylint: enable=too-many-arguments
 
@@ -113,10 +167,12 @@ class TranscriptChecker(Transcript):
         using the class translation table.
 
         :param string: the sequence to be rev-complented
-        :type string: str
+        :type string: (str|bytes)
         """
 
-        return Seq.reverse_complement(string)
+        if isinstance(string, (bytes, bytearray)):
+            return string.translate(_bytes_complement)[::-1]
+        return string.translate(_str_complement)[::-1]
 
     @property
     def is_reference(self):
@@ -212,9 +268,15 @@ class TranscriptChecker(Transcript):
         elif self.monoexonic is False:
             canonical_counter = Counter()
             canonical_index = dict()
+            splice_sites = self.splice_sites or dict()
+            missing = [intron for intron in self.introns if intron not in splice_sites]
+            if missing:
+                splice_sites = splice_sites.copy()
+                splice_sites.update(self.classify_splice_sites(
+                    self.fasta_seq.seq, self.start, missing, self.canonical_splices))
 
             for pos, intron in enumerate(self.introns):
-                canonical_index[pos+1] = self._check_intron(intron)
+                canonical_index[pos+1] = self.__intron_strand(*splice_sites[intron])
 
             canonical_counter.update(canonical_index.values())
 
@@ -277,6 +339,7 @@ we will not reverse it")
                                                                in self.canonical_junctions])
 
         self.checked = True
+        self.splice_sites = None  # Do not keep the batch classification alive past the check
         return
 
     def reverse_strand(self):
@@ -324,6 +387,62 @@ we will not reverse it")
                 strand = None
         return strand
 
+    @staticmethod
+    def classify_splice_sites(sequence, offset, introns, canonical_splices) -> dict:
+
+        """
+        Static method to classify in bulk the splice sites of a group of introns.
+        The donor and acceptor dinucleotides of all the introns are gathered from the sequence
+        with a single NumPy operation and compared against the canonical splices at once.
+        Introns falling (even partially) outside of the sequence are ignored.
+
+        :param sequence: genomic sequence containing the introns.
+        :type sequence: (str|bytes)
+
+        :param offset: genomic coordinate (1-based) of the first base of the sequence.
+        :type offset: int
+
+        :param introns: the intron tuples (int,int) in 1-base offset.
+
+        :param canonical_splices: the (donor, acceptor) couples considered as canonical.
+
+        :return: a dictionary linking each intron to a couple of booleans, indicating whether
+        the intron is canonical on the plus and on the minus strand of the genome, respectively.
+        :rtype: dict
+        """
+
+        introns = list(set(tuple(intron) for intron in introns))
+        if len(introns) == 0:
+            return dict()
+        if isinstance(sequence, str):
+            sequence = sequence.encode()
+        genome = np.frombuffer(sequence, dtype=np.uint8)
+        coordinates = np.array(introns, dtype=np.int64).reshape(-1, 2)
+        donors, acceptors = coordinates[:, 0] - offset, coordinates[:, 1] - 1 - offset
+        valid = (donors >= 0) & (donors + 1 < genome.shape[0]) & (acceptors >= 0) & (
+            acceptors + 1 < genome.shape[0])
+        donors, acceptors = donors[valid], acceptors[valid]
+        # Gather the dinucleotides from the uint8 view, and widen only the gathered bases
+        bases = genome[np.stack([donors, donors + 1, acceptors, acceptors + 1])].astype(np.uint32)
+        codes = (bases[0] << 24) | (bases[1] << 16) | (bases[2] << 8) | bases[3]
+        forward, reverse = _canonical_codes(tuple((str(splice[0]), str(splice[1]))
+                                                  for splice in canonical_splices))
+        on_forward, on_reverse = np.isin(codes, forward).tolist(), np.isin(codes, reverse).tolist()
+        introns = [intron for intron, is_valid in zip(introns, valid.tolist()) if is_valid]
+        return dict(zip(introns, zip(on_forward, on_reverse)))
+
+    def __intron_strand(self, on_forward, on_reverse):
+        """Private method to convert the genomic classification of an intron into its
+        strand relative to the transcript, with the same logic as _check_intron."""
+
+        if self.strand == "-":
+            on_forward, on_reverse = on_reverse, on_forward
+        if on_forward:
+            return "+"
+        elif on_reverse:
+            return "-"
+        return None
+
     def check_orf(self):
 
         """
@@ -395,25 +514,17 @@ we will not reverse it")
 
         """This property calculates the cDNA sequence of the transcript."""
 
-        sequence = ''
+        return self.cdna_bytes.decode()
 
-        for exon in self.exons:
-            start = exon[0] - self.start
-            end = exon[1] + 1 - self.start
-            _ = str(self.fasta_seq[start:end].seq)
-            sequence += _
+    @property
+    def cdna_bytes(self) -> bytes:
 
-        # pylint: disable=no-member
-        if not isinstance(sequence, str):
-            if hasattr(sequence, "seq"):
-                sequence = str(sequence.seq)
-            else:
-                raise TypeError("Invalid object for sequence: {0} ({1})".format(
-                    type(sequence),
-                    repr(sequence)
-                ))
-        # pylint: enable=no-member
+        """This property calculates the cDNA sequence of the transcript, as bytes."""
 
+        genomic = self.fasta_seq.seq
+        if not isinstance(genomic, (bytes, bytearray)):
+            genomic = str(genomic).encode()
+        sequence = b"".join([genomic[exon[0] - self.start:exon[1] + 1 - self.start] for exon in self.exons])
         assert len(sequence) == self.cdna_length
         if self.strand == "-":
             sequence = self.rev_complement(sequence)
@@ -429,17 +540,20 @@ we will not reverse it")
         :return:
         """
 
-        self.check_strand()
-        fasta = [">{0}".format(self.id)]
+        return self.fasta_bytes.decode()
 
-        # assert len(sequence) == sum(exon[1] + 1 - exon[0] for exon in self.exons), (
-        #     len(sequence), sum(exon[1] + 1 - exon[0] for exon in self.exons)
-        # )
+    @property
+    def fasta_bytes(self) -> bytes:
+        """
+        Bytes version of the "fasta" property, used when writing out the checked transcripts.
+        :return:
+        """
 
-        sequence = self.grouper(self.cdna, 60)
-        fasta.extend(sequence)
-        fasta = "\n".join(fasta)
-        return fasta
+        self.check_strand()
+        sequence = self.cdna_bytes
+        if len(sequence) == 0:
+            return b">" + self.id.encode()
+        return b">" + self.id.encode() + b"\n" + wrap_sequence(sequence, 60)
 
     @staticmethod
     def grouper(iterable, num, fillvalue=""):
@@ -8,6 +8,7 @@ from sqlalchemy.engine.reflection import Inspector
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.engine import create_engine, Engine
 from sqlalchemy import event
+from sqlalchemy.schema import CreateTable
 from sqlalchemy_utils import database_exists, create_database
 import sqlite3
 import logging
@@ -45,6 +46,12 @@ class DBConfiguration:
         "name": "dbport",
         "description": "Integer. It indicates the default port for the DB. Unused if dbtype is sqlite. Default: 0",
     })
+    snapshot: Optional[str] = field(default=None, metadata={
+        "name": "snapshot",
+        "description": "Optional read-only binary snapshot of the database, created by mikado serialise \
+with --export-snapshot. If present, exported from the current database and compatible with the BLAST parameters \
+of the configuration, mikado pick will retrieve the data of the loci from the snapshot rather than from the database.",
+    })
 
 
 def create_connector(configuration, logger=None):
@@ -126,13 +133,188 @@ def create_connector(configuration, logger=None):
     return func
 
 
-def connect(configuration, logger=None, **kwargs):
+def deferred_indexes():
+    """Function to retrieve the secondary indexes of the Mikado tables, ie the non-unique ones.
+    In bulk-load mode, these are built only after loading the data; unique indexes are kept
+    from the start, as they act as constraints."""
+
+    return [index for table in DBBASE.metadata.sorted_tables
+            for index in sorted(table.indexes, key=lambda index: index.name) if not index.unique]
+
+
+def create_tables(engine, indexes=True):
+    """
+    Function to create the Mikado tables which are not yet present in the database.
+
+    :param engine: the engine to use.
+    :param indexes: boolean flag. If False, the tables will be created without their secondary indexes,
+    and the secondary indexes of existing tables will be dropped; use build_indexes to create them.
+    """
+
+    if indexes is True:
+        DBBASE.metadata.create_all(engine, checkfirst=True)
+        return
+
+    inspector = Inspector.from_engine(engine)
+    existing = set(inspector.get_table_names())
+    for table in DBBASE.metadata.sorted_tables:
+        if table.name not in existing:
+            engine.execute(CreateTable(table))
+            [index.create(engine) for index in table.indexes if index.unique]
+            continue
+        present = set(index["name"] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name in present and not index.unique:
+                index.drop(engine)
+
+
+def build_indexes(engine, logger=None):
+    """
+    Function to build the secondary indexes missing from the database, at the end of a bulk load,
+    and to update the statistics used by the query planner.
+
+    :param engine: the engine to use.
+    :param logger: a logger instance
+    :type logger: logging.Logger
+    """
+
+    if logger is None:
+        logger = logging.Logger("null")
+        logger.addHandler(logging.NullHandler())
+
+    inspector = Inspector.from_engine(engine)
+    tables = set(inspector.get_table_names())
+    for index in deferred_indexes():
+        if index.table.name not in tables:
+            continue
+        if index.name in set(_["name"] for _ in inspector.get_indexes(index.table.name)):
+            continue
+        logger.debug("Building index %s on table %s", index.name, index.table.name)
+        index.create(engine)
+
+    if engine.dialect.name == "mysql":
+        engine.execute("ANALYZE TABLE {}".format(", ".join(sorted(tables))))
+    else:
+        engine.execute("ANALYZE")
+    logger.debug("Built the indexes of %s", ", ".join(sorted(tables)))
+
+
+def bulk_insert(engine, table, objects: list):
+    """
+    Function to insert a list of rows into a table. With SQLite, the rows are inserted through
+    executemany on a raw DB-API cursor, in a single transaction, bypassing the SQLAlchemy type processing;
+    the values must therefore be already of a type which SQLite understands.
+
+    :param engine: the engine to use.
+    :param table: the table to insert the data into (eg Hit.__table__).
+    :param objects: the rows to insert. These can be either dictionaries, all with the same keys (keys
+    which do not correspond to a column of the table are ignored, as with table.insert()), or lists with
+    the values of all the columns, in the order of the table.
+    """
+
+    if len(objects) == 0:
+        return
+    if isinstance(objects[0], dict):
+        columns = [column.name for column in table.columns if column.name in objects[0]]
+        values = ", ".join(":{}".format(column) for column in columns)
+    else:
+        columns = [column.name for column in table.columns]
+        values = ", ".join("?" for _ in columns)
+    if engine.dialect.name != "sqlite":
+        if isinstance(objects[0], dict):
+            engine.execute(table.insert(), objects)
+        else:
+            engine.execute(table.insert(), [dict(zip(columns, row)) for row in objects])
+        return
+
+    statement = "INSERT INTO {table} ({columns}) VALUES ({values})".format(
+        table=table.name, columns=", ".join('"{}"'.format(column) for column in columns), values=values)
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.executemany(statement, objects)
+        cursor.close()
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def merge_databases(db: str, staging_db: str, tables: list, new_rows_only=False, shared_tables=(), logger=None):
+    """
+    Function to copy the rows of the given tables from a staging SQLite database into the main one,
+    through ATTACH and INSERT ... SELECT, in a single transaction.
+
+    :param db: the main SQLite database.
+    :param staging_db: the staging SQLite database. Its tables must have the same columns as the main ones.
+    :param tables: the names of the tables to copy.
+    :param new_rows_only: boolean flag. If set, the staging database is assumed to have started as a copy
+    of the main one, and only the rows beyond the last row of the main table are copied, keeping their IDs.
+    :param shared_tables: names of tables (eg "query", "target") whose rows can be added by more than one
+    staging database, and are identified by a unique name column. Their rows missing from the main database
+    are copied first, matched by name and with new IDs; the foreign keys pointing to them from the copied
+    tables are remapped accordingly.
+    :param logger: a logger instance
+    :type logger: logging.Logger
+    """
+
+    if logger is None:
+        logger = logging.Logger("null")
+        logger.addHandler(logging.NullHandler())
+
+    connection = sqlite3.connect(db)
+    try:
+        connection.execute("ATTACH DATABASE ? AS staging", (staging_db,))
+        with connection:
+            for table in shared_tables:
+                key = list(DBBASE.metadata.tables[table].primary_key.columns)[0].name
+                name = [column.name for column in DBBASE.metadata.tables[table].columns if column.unique][0]
+                columns = ", ".join('"{}"'.format(column.name) for column in DBBASE.metadata.tables[table].columns
+                                    if column.name != key)
+                cursor = connection.execute(
+                    "INSERT INTO main.{table} ({columns}) SELECT {columns} FROM staging.{table} WHERE {name} NOT IN \
+(SELECT {name} FROM main.{table}) ORDER BY rowid".format(table=table, columns=columns, name=name))
+                logger.debug("Merged %d rows from %s into the \"%s\" table", cursor.rowcount, staging_db, table)
+                connection.execute("CREATE TEMP TABLE remap_{} (old INTEGER PRIMARY KEY, new INTEGER)".format(table))
+                connection.execute(
+                    "INSERT INTO temp.remap_{table} SELECT source.{key}, target.{key} FROM staging.{table} AS source \
+JOIN main.{table} AS target ON source.{name} = target.{name}".format(table=table, key=key, name=name))
+            for table in tables:
+                names, values = [], []
+                for column in DBBASE.metadata.tables[table].columns:
+                    names.append('"{}"'.format(column.name))
+                    parents = [key.column.table.name for key in column.foreign_keys
+                               if key.column.table.name in shared_tables]
+                    if parents:
+                        values.append('(SELECT new FROM temp.remap_{} WHERE old = source."{}")'.format(
+                            parents[0], column.name))
+                    else:
+                        values.append('source."{}"'.format(column.name))
+                statement = "INSERT INTO main.{table} ({names}) SELECT {values} FROM staging.{table} AS source"
+                if new_rows_only is True:
+                    statement += " WHERE source.rowid > (SELECT IFNULL(MAX(rowid), 0) FROM main.{table})"
+                statement += " ORDER BY source.rowid"
+                cursor = connection.execute(statement.format(table=table, names=", ".join(names),
+                                                             values=", ".join(values)))
+                logger.debug("Merged %d rows from %s into the \"%s\" table", cursor.rowcount, staging_db, table)
+            for table in shared_tables:
+                connection.execute("DROP TABLE temp.remap_{}".format(table))
+        connection.execute("DETACH DATABASE staging")
+    finally:
+        connection.close()
+
+
+def connect(configuration, logger=None, indexes=True, **kwargs):
 
     """
     Function to create an engine to connect to a DB with, using the
     configuration inside the provided json_conf.
     :param configuration:
     :param logger:
+    :param indexes: boolean flag. If False, missing tables will be created without their secondary
+    indexes, and the secondary indexes of the existing tables will be dropped (bulk-load mode).
     :return: sqlalchemy.engine.base.Engine
     """
 
@@ -156,6 +338,6 @@ def connect(configuration, logger=None, **kwargs):
     db_connection = functools.partial(create_connector, configuration, logger=logger)
     engine = create_engine("{0}://".format(configuration.db_settings.dbtype),
                            creator=db_connection, **kwargs)
-    DBBASE.metadata.create_all(engine, checkfirst=True)
+    create_tables(engine, indexes=indexes)
 
     return engine